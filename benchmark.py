@@ -0,0 +1,160 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import pandas as pd
+import staging
+import metrics
+from metrics import stage, print_metrics, git_commit
+from datagen import generate_sales
+from transform import read_sales_csv, clean_frame, split_star_schema, write_tables, stream_transform
+
+# expanded project directory path
+project_dir = os.path.expanduser('~/dwproject')
+
+# Directory holding the generated csv files and the staged tables of the benchmark runs
+benchmark_dir = os.path.join(project_dir, 'benchmark_data')
+
+# Directory the result files are written to, one json file per run
+results_dir = os.path.join(project_dir, 'benchmark_results')
+
+# Sizes benchmarked when none are given, in rows
+DEFAULT_SIZES = [100000, 1000000, 10000000, 50000000]
+
+def benchmark_transform(csv_path, chunksize):
+
+    # Time the transformation stages, the in-memory run stage by stage or the streaming run
+    if chunksize:
+        with stage('stream_transform'):
+            stream_transform(csv_path, chunksize)
+        return None
+
+    with stage('read') as record:
+        df = read_sales_csv(csv_path)
+        record['rows_out'] = len(df)
+    with stage('clean', rows_in=len(df)) as record:
+        cleaned = clean_frame(df)
+        record['rows_out'] = len(cleaned['sales'])
+    del df
+    with stage('dimensions', rows_in=len(cleaned['sales'])) as record:
+        tables = split_star_schema(cleaned['sales'])
+        record['rows_out'] = len(tables['salesFactTable'])
+    with stage('stage'):
+        write_tables(tables)
+    return tables
+
+def benchmark_postgres(tables, bulk=False):
+
+    # Time the load and the sample queries against the PostgreSQL instance from the .env file
+    from psqlconnect import psql_conn, psql_close, create_tables, insert_tables, finish_bulk_load, analyze_tables, \
+        refresh_rollups, table_names
+    from queryrunner import run_queries
+
+    with stage('connect'):
+        conn = psql_conn()
+    if conn is None:
+        return
+
+    try:
+        # Start every size from empty tables
+        cur = conn.cursor()
+        cur.execute('DROP TABLE IF EXISTS ' + ', '.join(f'public."{name}"' for name in table_names) + ' CASCADE;')
+        conn.commit()
+        cur.close()
+
+        with stage('create_tables'):
+            create_tables(conn, bulk=bulk)
+        with stage('load'):
+            insert_tables(conn, tables)
+        if bulk:
+            with stage('finish_bulk_load'):
+                finish_bulk_load(conn)
+        with stage('analyze'):
+            analyze_tables(conn)
+        refresh_rollups(conn)
+
+        # One query at a time, so each latency is not slowed down by the others
+        run_queries(conn, workers=1, show_rows=False)
+    finally:
+        psql_close(conn)
+
+def run_benchmark(sizes, seed=0, chunksize=0, postgres=False, bulk=False):
+
+    # Generate the data for each size once, then time every stage on it
+    os.makedirs(benchmark_dir, exist_ok=True)
+    os.makedirs(results_dir, exist_ok=True)
+
+    # The staged tables of the benchmark are kept apart from the ones of the pipeline
+    staging.staging_dir = benchmark_dir
+
+    # Every stage of a size is recorded by metrics.stage, then tagged with the size
+    results = []
+    for size in sizes:
+        metrics.records.clear()
+        csv_path = os.path.join(benchmark_dir, f'sales_{size}_{seed}.csv')
+        if not os.path.exists(csv_path):
+            with stage('generate'):
+                generate_sales(size, csv_path, seed)
+
+        tables = benchmark_transform(csv_path, chunksize)
+        if postgres:
+            benchmark_postgres(tables, bulk)
+        del tables
+
+        print_metrics()
+        results.extend({'rows': size, **record} for record in metrics.records)
+
+    commit, dirty = git_commit()
+    run = {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'seed': seed,
+        'chunksize': chunksize,
+        'postgres': postgres,
+        'bulk': bulk,
+        'results': results,
+    }
+    result_path = os.path.join(results_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit or 'nogit'}.json")
+    with open(result_path, 'w') as f:
+        json.dump(run, f, indent=2)
+    print(f'{os.path.basename(result_path)} created')
+    return result_path
+
+def compare_results(old_path, new_path):
+
+    # Print the stages of two result files side by side, a ratio above 1 means the new run is slower
+    runs = []
+    for path in (old_path, new_path):
+        with open(path) as f:
+            run = json.load(f)
+        runs.append(pd.DataFrame(run['results']).set_index(['rows', 'stage']))
+        print(f"{os.path.basename(path)}: commit {run['commit']}{' (dirty)' if run['dirty'] else ''}")
+
+    old, new = runs
+    comparison = old[['wall_s', 'peak_rss_mb']].join(new[['wall_s', 'peak_rss_mb']], how='inner',
+                                                      lsuffix='_old', rsuffix='_new')
+    comparison['wall_ratio'] = (comparison['wall_s_new'] / comparison['wall_s_old']).round(2)
+    comparison['rss_ratio'] = (comparison['peak_rss_mb_new'] / comparison['peak_rss_mb_old']).round(2)
+    print(comparison.to_string())
+    return comparison
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Time and memory-profile each pipeline stage on synthetic data')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='rows of synthetic data')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data')
+    parser.add_argument('--chunksize', type=int, default=0, help='run the streaming transformation in chunks')
+    parser.add_argument('--postgres', action='store_true', help='also load and query the local PostgreSQL instance')
+    parser.add_argument('--bulk', action='store_true', help='load into unlogged tables and add the keys afterwards')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(*args.compare)
+        sys.exit(0)
+    run_benchmark(args.sizes, args.seed, args.chunksize, args.postgres, args.bulk)
@@ -0,0 +1,107 @@
+import os
+import json
+import hashlib
+import pandas as pd
+from dotenv import load_dotenv
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# expanded project directory path
+project_dir = os.path.expanduser('~/dwproject')
+
+# Directory holding the cached output of the pipeline stages
+checkpoint_dir = os.path.join(project_dir, 'checkpoints')
+
+# Load unchanged stages from their checkpoints, 0 always recomputes them
+use_checkpoints = os.getenv('CHECKPOINTS', '1') == '1'
+
+# Checkpoints kept per stage, the least recently used ones are deleted
+checkpoint_keep = int(os.getenv('CHECKPOINT_KEEP') or 2)
+
+# Hashes of the files hashed in this run, by path, size and modification time
+file_hashes = {}
+
+def file_hash(path):
+
+    # sha256 of the content of a file, read in blocks so large files are not held in memory
+    stat = os.stat(path)
+    memo_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+    if memo_key not in file_hashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                digest.update(block)
+        file_hashes[memo_key] = digest.hexdigest()
+
+    return file_hashes[memo_key]
+
+def stage_key(stage_name, inputs, params=None):
+
+    # Key of a stage run, from the hashes or keys of its inputs and its parameters
+    payload = json.dumps({'stage': stage_name, 'inputs': inputs, 'params': params or {}}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+def checkpoint_path(stage_name, key):
+
+    return os.path.join(checkpoint_dir, f'{stage_name}-{key}.pkl')
+
+def load_checkpoint(stage_name, key):
+
+    # Return the cached output of a stage run, or None when there is none
+    path = checkpoint_path(stage_name, key)
+    if not use_checkpoints or not os.path.exists(path):
+        return None
+
+    try:
+        output = pd.read_pickle(path)
+    except Exception as e:
+        print(f"Error reading the {stage_name} checkpoint: {e}")
+        return None
+
+    # Mark the checkpoint as recently used so eviction keeps it
+    os.utime(path)
+    print(f'{stage_name} loaded from checkpoint {key}')
+    return output
+
+def save_checkpoint(stage_name, key, output):
+
+    if not use_checkpoints:
+        return
+
+    # Write to a temporary file first so an interrupted run never leaves a partial checkpoint
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    path = checkpoint_path(stage_name, key)
+    try:
+        pd.to_pickle(output, path + '.tmp')
+        os.replace(path + '.tmp', path)
+    except Exception as e:
+        print(f"Error saving the {stage_name} checkpoint: {e}")
+        return
+
+    evict_checkpoints(stage_name)
+
+def evict_checkpoints(stage_name, keep=None):
+
+    # Delete all but the keep most recently used checkpoints of a stage
+    keep = checkpoint_keep if keep is None else keep
+    prefix = f'{stage_name}-'
+    paths = [os.path.join(checkpoint_dir, name) for name in os.listdir(checkpoint_dir)
+             if name.startswith(prefix) and name.endswith('.pkl')]
+    paths.sort(key=os.path.getmtime, reverse=True)
+
+    for path in paths[keep:]:
+        os.remove(path)
+        print(f'Evicted checkpoint {os.path.basename(path)}')
+
+def run_stage(stage_name, inputs, params, compute):
+
+    # Load the output of a stage from its checkpoint, or compute and checkpoint it
+    # Returns the output and the key of the run, which later stages use as their input
+    key = stage_key(stage_name, inputs, params)
+    output = load_checkpoint(stage_name, key)
+    if output is None:
+        output = compute()
+        save_checkpoint(stage_name, key, output)
+    return output, key
@@ -0,0 +1,193 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+# Columns of car_prices.csv, in the order they appear in the file
+SALES_COLUMNS = ['year', 'make', 'model', 'trim', 'body', 'transmission', 'vin', 'state', 'condition',
+                 'odometer', 'color', 'interior', 'seller', 'mmr', 'sellingprice', 'saledate']
+
+# Rows generated and written at a time, so any number of rows fits in memory
+chunk_rows = 1000000
+
+MAKES = ['Ford', 'Chevrolet', 'Nissan', 'Toyota', 'Dodge', 'Honda', 'Hyundai', 'BMW', 'Kia', 'Chrysler',
+         'Mercedes-Benz', 'Jeep', 'Infiniti', 'Volkswagen', 'Lexus', 'GMC', 'Mazda', 'Cadillac', 'Acura', 'Audi',
+         'Lincoln', 'Buick', 'Subaru', 'Ram', 'Pontiac', 'Mitsubishi', 'Volvo', 'MINI', 'Saturn', 'Mercury',
+         'Land Rover', 'Scion', 'Jaguar', 'Porsche', 'Suzuki', 'FIAT', 'HUMMER', 'Saab', 'Smart', 'Oldsmobile',
+         'Isuzu', 'Maserati', 'Bentley', 'Aston Martin', 'Tesla', 'Rolls-Royce', 'Ferrari', 'Lamborghini',
+         'Plymouth', 'Geo', 'Daewoo', 'Lotus']
+BODIES = ['Sedan', 'SUV', 'Hatchback', 'Minivan', 'Coupe', 'Wagon', 'Crew Cab', 'Convertible', 'SuperCrew',
+          'G Sedan', 'SuperCab', 'Extended Cab', 'Regular Cab', 'Van', 'Quad Cab', 'Double Cab', 'Access Cab',
+          'King Cab', 'CrewMax Cab', 'Club Cab', 'Mega Cab', 'Koup', 'Elantra Coupe', 'G Coupe', 'Cab Plus']
+TRIMS = ['Base', 'SE', 'LX', 'LT', 'Limited', 'SXT', 'XLT', 'S', 'SEL', 'EX', 'Touring', 'Sport', 'LE',
+         'GLS', 'SV', 'Premium', 'i', 'SL', 'EX-L', 'Platinum', 'Lariat', 'SLE', 'XLE', 'GT', 'Titanium',
+         'Signature', 'Luxury', 'Express', 'Laredo', 'Overland', '2.5 S', '328i', 'Denali', 'LTZ', 'ES 350']
+STATES = ['fl', 'ca', 'pa', 'tx', 'ga', 'nj', 'il', 'nc', 'oh', 'tn', 'mo', 'mi', 'nv', 'va', 'md', 'wi',
+          'mn', 'az', 'co', 'wa', 'ma', 'ny', 'in', 'sc', 'ne', 'on', 'pr', 'la', 'ms', 'ut', 'qc', 'hi',
+          'or', 'ab', 'nm', 'ok', 'ns', 'al']
+COLORS = ['black', 'white', 'silver', 'gray', 'blue', 'red', 'gold', 'green', 'burgundy', 'beige', 'brown',
+          'orange', 'purple', 'off-white', 'yellow', 'charcoal', 'turquoise', 'pink', 'lime']
+INTERIORS = ['black', 'gray', 'beige', 'tan', 'brown', 'burgundy', 'silver', 'off-white', 'blue', 'red',
+             'purple', 'green', 'white', 'gold', 'orange', 'yellow']
+SALE_TIMES = ['01:30:00', '02:00:00', '02:30:00', '03:00:00', '09:30:00', '10:30:00', '12:30:00']
+
+# Share of the rows with each kind of dirty value, close to the rates of car_prices.csv
+DIRTY_RATES = {
+    'vin_duplicate': 0.015,
+    'vehicle_missing': 0.018,
+    'trim_missing': 0.0005,
+    'body_missing': 0.005,
+    'transmission_missing': 0.117,
+    'condition_missing': 0.021,
+    'odometer_missing': 0.0002,
+    'color_missing': 0.0013,
+    'color_dash': 0.044,
+    'interior_dash': 0.03,
+    'mmr_missing': 0.0001,
+    'lowercase': 0.01,
+    'shifted_row': 0.00005,
+}
+
+# Alphabet of the vin characters, vins in car_prices.csv are lowercase and never use i, o or q
+VIN_ALPHABET = np.frombuffer(b'0123456789abcdefghjklmnprstuvwxyz', dtype=np.uint8)[:32]
+
+def zipf_weights(n, exponent=1.1):
+
+    # Probabilities of n values where a few are very common and most are rare
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+def build_catalog(rng):
+
+    # Vehicles, sellers and sale dates the rows are drawn from, the same for every chunk of a run
+    # Each make has a few dozen models, each model a few trims, one usual body type and a base price
+    model_make = []
+    model_names = []
+    for make_id, make in enumerate(MAKES):
+        model_count = max(1, int(18 * zipf_weights(len(MAKES), 0.6)[make_id] * len(MAKES)))
+        for model_number in range(model_count):
+            model_make.append(make_id)
+            model_names.append(f'{make.split()[0][:3].upper()}{model_number + 1}')
+
+    model_make = np.array(model_make)
+    model_count = len(model_make)
+    trim_counts = rng.integers(1, 5, model_count)
+    trim_offsets = np.concatenate([[0], np.cumsum(trim_counts)[:-1]])
+
+    # Sale dates run from January 2014 to July 2015, most auctions are held on weekdays
+    days = pd.date_range('2014-01-01', '2015-07-21', freq='D')
+    day_weights = np.where(days.dayofweek < 5, 1.0, 0.1)
+    saledates = []
+    for day in days:
+        zone = 'GMT-0700 (PDT)' if 3 <= day.month <= 10 else 'GMT-0800 (PST)'
+        for time in SALE_TIMES:
+            saledates.append(f"{day.strftime('%a %b %d %Y')} {time} {zone}")
+
+    return {
+        'model_make': model_make,
+        'model_names': np.array(model_names, dtype=object),
+        'model_weights': zipf_weights(model_count, 0.9)[rng.permutation(model_count)],
+        'model_body': rng.choice(len(BODIES), model_count, p=zipf_weights(len(BODIES), 1.3)),
+        'model_price': np.round(rng.lognormal(10.0, 0.5, model_count), -2),
+        'trim_counts': trim_counts,
+        'trim_names': np.array(TRIMS, dtype=object)[(trim_offsets[:, None] + np.arange(4)) % len(TRIMS)],
+        'sellers': np.array([f'seller {number:05d} auto sales' for number in range(14000)], dtype=object),
+        'seller_weights': zipf_weights(14000, 1.05),
+        'saledates': np.array(saledates, dtype=object),
+        'saledate_weights': np.repeat(day_weights / day_weights.sum() / len(SALE_TIMES), len(SALE_TIMES)),
+    }
+
+def make_vins(ids):
+
+    # 17-character vins from row ids, the 64-bit mix is a bijection so different ids never share a vin
+    mixed = (ids.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)) ^ np.uint64(0x5DEECE66D)
+    prefix = mixed % np.uint64(997)
+    digits = np.empty((len(ids), 17), dtype=np.uint8)
+    for position in range(13):
+        digits[:, 16 - position] = VIN_ALPHABET[((mixed >> np.uint64(5 * position)) & np.uint64(31)).astype(np.int64)]
+    for position in range(4):
+        digits[:, 3 - position] = VIN_ALPHABET[((prefix >> np.uint64(5 * position)) & np.uint64(31)).astype(np.int64)]
+    return digits.view('S17').ravel().astype(str).astype(object)
+
+def generate_chunk(rng, catalog, rows, first_id):
+
+    # One chunk of sales rows, vin ids continue from first_id so duplicates can repeat a vin of an earlier chunk
+    rates = DIRTY_RATES
+    model = rng.choice(len(catalog['model_make']), rows, p=catalog['model_weights'])
+    make = catalog['model_make'][model]
+    age = np.minimum(rng.geometric(0.18, rows) - 1, 33)
+
+    ids = np.arange(first_id, first_id + rows)
+    duplicate = rng.random(rows) < rates['vin_duplicate']
+    duplicate[0] = duplicate[0] and first_id > 0
+    ids[duplicate] = (rng.random(duplicate.sum()) * ids[duplicate]).astype(np.int64)
+
+    mmr = np.round(catalog['model_price'][model] * 0.85 ** age * rng.lognormal(0.0, 0.15, rows), -1) * 2.5
+    chunk = pd.DataFrame({
+        'year': 2015 - age,
+        'make': np.array(MAKES, dtype=object)[make],
+        'model': catalog['model_names'][model],
+        'trim': catalog['trim_names'][model, rng.integers(0, 1 << 30, rows) % catalog['trim_counts'][model]],
+        'body': np.where(rng.random(rows) < 0.1, np.array(BODIES, dtype=object)[rng.integers(0, len(BODIES), rows)],
+                         np.array(BODIES, dtype=object)[catalog['model_body'][model]]),
+        'transmission': np.where(rng.random(rows) < 0.035, 'manual', 'automatic').astype(object),
+        'vin': make_vins(ids),
+        'state': np.array(STATES, dtype=object)[rng.choice(len(STATES), rows, p=zipf_weights(len(STATES), 0.9))],
+        'condition': np.where(rng.random(rows) < 0.2, np.round(rng.uniform(1, 5, rows), 1),
+                              rng.integers(10, 50, rows)).astype(float),
+        'odometer': np.round((age + rng.random(rows)) * rng.lognormal(9.4, 0.4, rows)) + 1,
+        'color': np.array(COLORS, dtype=object)[rng.choice(len(COLORS), rows, p=zipf_weights(len(COLORS), 1.2))],
+        'interior': np.array(INTERIORS, dtype=object)[rng.choice(len(INTERIORS), rows, p=zipf_weights(len(INTERIORS), 1.6))],
+        'seller': catalog['sellers'][rng.choice(len(catalog['sellers']), rows, p=catalog['seller_weights'])],
+        'mmr': mmr,
+        'sellingprice': np.round(mmr * rng.normal(1.0, 0.1, rows).clip(0.3) / 100) * 100 + 100,
+        'saledate': catalog['saledates'][rng.choice(len(catalog['saledates']), rows, p=catalog['saledate_weights'])],
+    })
+
+    # Missing and malformed values, the make, model, trim and body of a vehicle are missing together
+    def rows_with(rate):
+        return rng.random(rows) < rate
+
+    chunk.loc[rows_with(rates['vehicle_missing']), ['make', 'model', 'trim', 'body']] = np.nan
+    chunk.loc[rows_with(rates['trim_missing']), 'trim'] = np.nan
+    chunk.loc[rows_with(rates['body_missing']), 'body'] = np.nan
+    chunk.loc[rows_with(rates['transmission_missing']), 'transmission'] = np.nan
+    chunk.loc[rows_with(rates['condition_missing']), 'condition'] = np.nan
+    chunk.loc[rows_with(rates['odometer_missing']), 'odometer'] = np.nan
+    chunk.loc[rows_with(rates['color_missing']), ['color', 'interior']] = np.nan
+    chunk.loc[rows_with(rates['color_dash']), 'color'] = '—'
+    chunk.loc[rows_with(rates['interior_dash']), 'interior'] = '—'
+    chunk.loc[rows_with(rates['mmr_missing']), 'mmr'] = np.nan
+    lowercase = rows_with(rates['lowercase'])
+    chunk.loc[lowercase, 'make'] = chunk.loc[lowercase, 'make'].str.lower()
+    lowercase = rows_with(rates['lowercase'])
+    chunk.loc[lowercase, 'body'] = chunk.loc[lowercase, 'body'].str.lower()
+
+    # Rows whose values moved one column to the left, the state holds a vin and the last columns are empty
+    shifted = rows_with(rates['shifted_row'])
+    chunk.loc[shifted, 'transmission'] = 'sedan'
+    chunk.loc[shifted, 'state'] = chunk.loc[shifted, 'vin']
+    chunk.loc[shifted, 'color'] = rng.integers(1000, 30000, shifted.sum()).astype(str)
+    chunk.loc[shifted, ['sellingprice', 'saledate']] = np.nan
+
+    return chunk[SALES_COLUMNS]
+
+def generate_sales(rows, csv_path, seed=0):
+
+    # Write rows of synthetic sales with the schema of car_prices.csv, the same seed always gives the same file
+    rng = np.random.default_rng(seed)
+    catalog = build_catalog(rng)
+
+    written = 0
+    while written < rows:
+        chunk = generate_chunk(rng, catalog, min(chunk_rows, rows - written), written)
+        chunk.to_csv(csv_path, index=False, mode='w' if written == 0 else 'a', header=written == 0)
+        written = written + len(chunk)
+
+    print(f'{os.path.basename(csv_path)} created with {written} rows')
+    return csv_path
+
+if __name__ == '__main__':
+
+    # python3 datagen.py <rows> <csv path> [seed]
+    generate_sales(int(sys.argv[1]), sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 0)
@@ -0,0 +1,269 @@
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import psycopg2
+from metrics import stage, in_current_stage
+from psqlconnect import psql_conn, psql_close, get_pool
+from sqlqueries import sql_query_sales_extract, sql_query_sale_id_range, query_1, query_2, query_3, query_4, query_5, query_6, query_7
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# expanded project directory path
+project_dir = os.path.expanduser('~/dwproject')
+
+# Directory the exported files are written to
+export_dir = os.path.join(project_dir, 'exports')
+
+# Format of the exported files, csv or parquet
+export_format = os.getenv('EXPORT_FORMAT') or 'csv'
+
+# Rows fetched from the server-side cursor at a time for a parquet export, also the rows of each row group
+export_batch_rows = int(os.getenv('EXPORT_BATCH_ROWS') or 50000)
+
+# Parts of a partitioned export written at the same time, each one on its own pooled connection
+export_workers = int(os.getenv('EXPORT_WORKERS') or 4)
+
+# Compression of the exported parquet files
+parquet_compression = 'zstd'
+
+# The queries that can be exported by name, as (function returning the sql and its parameters, column to partition by,
+# function returning the query of the lowest and highest value of that column)
+# The sample queries have no column to partition by, they are exported as a single file
+EXPORT_QUERIES = {
+    'sales': (sql_query_sales_extract, 'sale_id', sql_query_sale_id_range),
+    'query_1': (lambda: (query_1(), None), None, None),
+    'query_2': (lambda: (query_2(), None), None, None),
+    'query_3': (lambda: (query_3(), None), None, None),
+    'query_4': (lambda: (query_4(), None), None, None),
+    'query_5': (lambda: (query_5(), None), None, None),
+    'query_6': (lambda: (query_6(), None), None, None),
+    'query_7': (lambda: (query_7(), None), None, None),
+}
+
+# Parquet type of the PostgreSQL types by oid, the other types are written as text
+PARQUET_TYPES = {
+    16: 'bool',
+    20: 'int64',
+    21: 'int16',
+    23: 'int32',
+    700: 'float32',
+    701: 'float64',
+    1082: 'date32',
+    1114: 'timestamp[us]',
+}
+
+def bound_query(cur, query, params):
+
+    # The query with its parameters filled in and without its closing semicolon, so it can be put inside COPY (...)
+    if params:
+        query = cur.mogrify(query, params).decode()
+    return query.strip().rstrip(';')
+
+def copy_csv(conn, query, params, path):
+
+    # Stream the rows of a query to a csv file with COPY (...) TO STDOUT, the server formats the rows
+    # and they are written to the file as they arrive, so the result is never held in memory
+    cur = conn.cursor()
+    try:
+        with open(path, 'wb') as f:
+            cur.copy_expert(f'COPY ({bound_query(cur, query, params)}) TO STDOUT WITH (FORMAT csv, HEADER)', f)
+        return cur.rowcount
+    finally:
+        cur.close()
+
+def parquet_column(column):
+
+    # Parquet type of a result column and the function converting its values
+    # numeric columns with a precision are exact decimals, the ones without one, such as an average, become floats
+    import pyarrow as pa
+
+    if column.type_code == 1700:
+        if column.precision is not None and column.precision <= 38:
+            return pa.decimal128(column.precision, column.scale), None
+        return pa.float64(), lambda value: None if value is None else float(value)
+    if column.type_code in PARQUET_TYPES:
+        return pa.type_for_alias(PARQUET_TYPES[column.type_code]), None
+    return pa.string(), lambda value: None if value is None else str(value)
+
+def fetch_parquet(conn, query, params, path, batch_rows=export_batch_rows):
+
+    # Stream the rows of a query to a parquet file through a named server-side cursor
+    # The rows are fetched batch_rows at a time and each batch is written as a row group, so at most one batch is held
+    # pyarrow is only needed for parquet exports, so it is imported here
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    cur = conn.cursor(name=f'export_{os.getpid()}_{id(conn)}')
+    cur.itersize = batch_rows
+    writer = None
+    rows = 0
+    try:
+        cur.execute(query, params)
+        while True:
+            batch = cur.fetchmany(batch_rows)
+
+            # The description of a named cursor is known once its first rows are fetched
+            if writer is None:
+                columns = [parquet_column(column) for column in cur.description]
+                schema = pa.schema([(column.name, arrow_type)
+                                    for column, (arrow_type, convert) in zip(cur.description, columns)])
+                writer = pq.ParquetWriter(path, schema, compression=parquet_compression)
+            if not batch:
+                break
+
+            arrays = []
+            for values, (arrow_type, convert) in zip(zip(*batch), columns):
+                arrays.append(pa.array(values if convert is None else [convert(value) for value in values],
+                                       type=arrow_type))
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            rows = rows + len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+        cur.close()
+    return rows
+
+def snapshot_transaction(conn, snapshot=None):
+
+    # Start a read-only repeatable read transaction, on the snapshot exported by another transaction when one is given
+    with conn.cursor() as cur:
+        cur.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY;')
+        if snapshot is not None:
+            cur.execute('SET TRANSACTION SNAPSHOT %s;', (snapshot,))
+
+def export_query(conn, query, params, path, file_format=export_format, batch_rows=export_batch_rows, snapshot=None):
+
+    # Write the rows of a query to a csv or parquet file, returns the number of rows written
+    # The query only reads, so its transaction is rolled back once the rows are written
+    conn.rollback()
+    try:
+        snapshot_transaction(conn, snapshot)
+        if file_format == 'parquet':
+            rows = fetch_parquet(conn, query, params, path, batch_rows)
+        else:
+            rows = copy_csv(conn, query, params, path)
+    finally:
+        conn.rollback()
+    return rows
+
+def partition_bounds(conn, bounds_query, partitions):
+
+    # Split the range of an integer column into partitions ranges [start, stop) of the same width
+    # bounds_query returns the lowest and highest value of the column in the table it comes from, such as the
+    # primary key of salesFactTable, so the query that is exported is not run just to find them
+    # Returns no ranges when the table is empty
+    with conn.cursor() as cur:
+        cur.execute(bounds_query)
+        low, high = cur.fetchone()
+    if low is None:
+        return []
+
+    width = -(-(high - low + 1) // max(partitions, 1))
+    return [(start, min(start + width, high + 1)) for start in range(low, high + 1, width)]
+
+def export_part(conn_pool, query, params, column, bounds, path, file_format, batch_rows, snapshot):
+
+    # Export the rows of one partition on a pooled connection, the range is a filter on the outer query
+    # so the server can push it down to the scan of the table, such as the primary key of salesFactTable
+    # The part is read on the snapshot of the export, so all the parts see the same data
+    conn = conn_pool.getconn()
+    start, stop = bounds
+    part_query = f'SELECT * FROM ({query.strip().rstrip(";")}) AS export ' \
+                 f'WHERE {column} >= {int(start)} AND {column} < {int(stop)}'
+    try:
+        with stage(f'export/{os.path.basename(path)}') as record:
+            record['rows_out'] = export_query(conn, part_query, params, path, file_format, batch_rows, snapshot)
+        return record['rows_out']
+    finally:
+        conn_pool.putconn(conn)
+
+def export_partitioned(conn, query, params, column, bounds_query, target_dir, file_format=export_format,
+                       workers=export_workers, batch_rows=export_batch_rows):
+
+    # Export a query as one file per range of an integer column, part-00000.csv, part-00001.csv, ... in target_dir,
+    # at most workers parts at a time over the shared pool, returns the number of rows written
+    # The connection of the caller stays borrowed, so one connection of the pool is left out
+    conn_pool = get_pool()
+    workers = max(1, min(workers, conn_pool.maxconn - 1))
+
+    # The transaction of the caller exports its snapshot and stays open until every part is written, the parts read
+    # on that snapshot, so a load running at the same time can not make them disagree with each other or the bounds
+    conn.rollback()
+    try:
+        snapshot_transaction(conn)
+        with conn.cursor() as cur:
+            cur.execute('SELECT pg_export_snapshot();')
+            snapshot = cur.fetchone()[0]
+        partitions = partition_bounds(conn, bounds_query, workers)
+
+        # Parts of an earlier export are removed so the directory only holds the parts of this one
+        os.makedirs(target_dir, exist_ok=True)
+        for name in os.listdir(target_dir):
+            if name.startswith('part-'):
+                os.remove(os.path.join(target_dir, name))
+
+        paths = [os.path.join(target_dir, f'part-{number:05d}.{file_format}') for number in range(len(partitions))]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            parts = executor.map(in_current_stage(export_part), [conn_pool] * len(partitions), [query] * len(partitions),
+                                 [params] * len(partitions), [column] * len(partitions), partitions, paths,
+                                 [file_format] * len(partitions), [batch_rows] * len(partitions),
+                                 [snapshot] * len(partitions))
+            return sum(parts)
+    finally:
+        conn.rollback()
+
+def export_named(conn, name, file_format=export_format, workers=export_workers, batch_rows=export_batch_rows):
+
+    # Export one of EXPORT_QUERIES to the export directory, as a directory of parts when it has a column to
+    # partition by and more than one worker, otherwise as a single file
+    query_function, column, bounds_function = EXPORT_QUERIES[name]
+    query, params = query_function()
+    os.makedirs(export_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    try:
+        with stage(f'export_{name}') as record:
+            if column is not None and workers > 1:
+                path = os.path.join(export_dir, name)
+                rows = export_partitioned(conn, query, params, column, bounds_function(), path, file_format, workers,
+                                          batch_rows)
+            else:
+                path = os.path.join(export_dir, f'{name}.{file_format}')
+                rows = export_query(conn, query, params, path, file_format, batch_rows)
+            record['rows_out'] = rows
+    except (psycopg2.Error, OSError) as e:
+        print(f"Error exporting {name}: {e}")
+        return None
+
+    elapsed = time.perf_counter() - start
+    print(f'Exported {rows} rows of {name} to {path} ({elapsed:.2f} s, {rows / max(elapsed, 1e-9):.0f} rows/s)')
+    return path
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Export query results of the PostgreSQL instance to csv or parquet')
+    parser.add_argument('names', nargs='*', help='queries to export, the sales extract by default')
+    parser.add_argument('--format', choices=['csv', 'parquet'], default=export_format, help='format of the files')
+    parser.add_argument('--workers', type=int, default=export_workers, help='parts written at the same time')
+    parser.add_argument('--batch-rows', type=int, default=export_batch_rows,
+                        help='rows fetched at a time for a parquet export')
+    args = parser.parse_args()
+
+    names = args.names or ['sales']
+    unknown = [name for name in names if name not in EXPORT_QUERIES]
+    if unknown:
+        print(f"Error exporting the queries: unknown queries {', '.join(unknown)}")
+        sys.exit(1)
+
+    conn = psql_conn()
+    if conn is None:
+        sys.exit(1)
+    try:
+        for name in names:
+            export_named(conn, name, args.format, args.workers, args.batch_rows)
+    finally:
+        psql_close(conn)
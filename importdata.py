@@ -1,32 +1,187 @@
-import subprocess
 import os
+import json
+import shutil
+import zipfile
+import tempfile
+import subprocess
+import urllib.error
+import urllib.parse
+import urllib.request
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from checkpoints import file_hash
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# expanded project directory path
+project_dir = os.path.expanduser('~/dwproject')
+
+# Kaggle dataset holding the vehicle sales csv file
+dataset = 'syedanwarafridi/vehicle-sales-data'
 
-def importdata():
+# Where the dataset is read from: 'kaggle', an http(s) url, or the path of a local csv file or zip archive
+dataset_source = os.getenv('DATASET_SOURCE') or 'kaggle'
+
+# Directory of the downloaded files, each one is stored under the sha256 of its content
+download_dir = os.path.join(project_dir, 'downloads')
+
+# Version of each remote source when it was last downloaded and the sha256 of the file it gave
+download_index_path = os.path.join(download_dir, 'index.json')
+
+# csv file the transformation reads when no dataset was downloaded through the cache
+legacy_csv_path = os.path.join(project_dir, 'Vehicle_sales_data.csv')
+
+def kaggle_version(source):
     
-    # Expand the '~' to the full home directory path
-    project_dir = os.path.expanduser('~/dwproject')
+    # The files of the dataset with their size and creation date, they change with every new version of it
+    files_command = ['kaggle', 'datasets', 'files', dataset, '--csv']
+    result = subprocess.run(files_command, check=True, capture_output=True, text=True)
+    return result.stdout.strip()
+
+def kaggle_fetch(source, target_dir):
     
-    # Command to download the dataset using Kaggle CLI
+    # Download the zip archive of the dataset as it is, it is read without being unzipped
     download_command = [
-        'kaggle', 'datasets', 'download', 'syedanwarafridi/vehicle-sales-data',
-        '-p', project_dir, '--unzip'
+        'kaggle', 'datasets', 'download', dataset,
+        '-p', target_dir, '--force'
     ]
+    subprocess.run(download_command, check=True)
+    return os.path.join(target_dir, os.listdir(target_dir)[0])
 
-    # Command to rename the file after downloading
-    rename_command = [
-        'mv', os.path.join(project_dir, 'car_prices.csv'), os.path.join(project_dir, 'Vehicle_sales_data.csv')
-    ]
+def url_version(source):
+    
+    # ETag of the file, or its last modification time and size when the server sends no ETag
+    request = urllib.request.Request(source, method='HEAD')
+    with urllib.request.urlopen(request, timeout=30) as response:
+        headers = response.headers
+    return headers.get('ETag') or f"{headers.get('Last-Modified')} {headers.get('Content-Length')}"
+
+def url_fetch(source, target_dir):
+    
+    # Stream the file to disk in blocks
+    path = os.path.join(target_dir, os.path.basename(urllib.parse.urlparse(source).path) or 'dataset')
+    with urllib.request.urlopen(source, timeout=30) as response, open(path, 'wb') as f:
+        shutil.copyfileobj(response, f, 2**20)
+    return path
+
+# Remote sources of the dataset, as (function returning the current version, function downloading it to a directory)
+# A source that is not listed and is not a url is read as a local path
+DATASET_SOURCES = {
+    'kaggle': (kaggle_version, kaggle_fetch),
+    'url': (url_version, url_fetch),
+}
 
-    # Run the download command
+def source_type(source):
+    
+    if source in DATASET_SOURCES:
+        return source
+    return 'url' if source.startswith(('http://', 'https://')) else 'local'
+
+def read_index():
+    
+    if not os.path.exists(download_index_path):
+        return {}
     try:
-        subprocess.run(download_command, check=True)
-        print("Dataset downloaded and unzipped successfully.")
-    except subprocess.CalledProcessError as e:
-        print(f"Error downloading the dataset: {e}")
+        with open(download_index_path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Error reading the download index: {e}")
+        return {}
+
+def write_index(index):
+    
+    # Write to a temporary file first so an interrupted run never leaves a partial index
+    with open(download_index_path + '.tmp', 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(download_index_path + '.tmp', download_index_path)
+
+def cached_path(entry):
+    
+    # Path of a downloaded file in the cache, None when it was deleted
+    path = os.path.join(download_dir, entry['file'])
+    return path if os.path.exists(path) else None
+
+def store_download(path):
+    
+    # Move a downloaded file into the cache under the sha256 of its content, an identical file is kept only once
+    digest = file_hash(path)
+    name = digest + os.path.splitext(path)[1]
+    if os.path.exists(os.path.join(download_dir, name)):
+        os.remove(path)
+    else:
+        os.replace(path, os.path.join(download_dir, name))
+    return digest, name
 
-    # Run the rename command
+def dataset_path(source=dataset_source):
+    
+    # The csv file or zip archive of the dataset already on disk, without checking the source for a new version
+    if source_type(source) == 'local':
+        return os.path.abspath(os.path.expanduser(source))
+    entry = read_index().get(source)
+    path = cached_path(entry) if entry is not None else None
+    return path or legacy_csv_path
+
+def importdata(refresh=False, source=dataset_source):
+    
+    # Return the path of the csv file or zip archive of the dataset, downloading it only when it changed
+    # A local file is read in place, a remote one is checked for a new version and kept in the download cache
+    kind = source_type(source)
+    if kind == 'local':
+        path = dataset_path(source)
+        print(f"Reading the dataset from {path}")
+        return path
+    
+    version_of, fetch = DATASET_SOURCES[kind]
+    os.makedirs(download_dir, exist_ok=True)
+    index = read_index()
+    entry = index.get(source)
+    cached = cached_path(entry) if entry is not None else None
+    
+    # Without a version, such as when offline, the cached file is used as it is
     try:
-        subprocess.run(rename_command, check=True)
-        print("File renamed successfully.")
-    except subprocess.CalledProcessError as e:
-        print(f"Error renaming the file: {e}")
+        version = version_of(source)
+    except (OSError, subprocess.CalledProcessError, urllib.error.URLError) as e:
+        print(f"Error checking the version of the dataset: {e}")
+        version = None
+    
+    if cached is not None and not refresh and (version is None or version == entry['version']):
+        print("Dataset unchanged since the last download, using the cached file.")
+        return cached
+    
+    try:
+        with tempfile.TemporaryDirectory(dir=download_dir) as target_dir:
+            digest, name = store_download(fetch(source, target_dir))
+        print("Dataset downloaded successfully.")
+    except (OSError, subprocess.CalledProcessError, urllib.error.URLError) as e:
+        print(f"Error downloading the dataset: {e}")
+        return cached or legacy_csv_path
+    
+    # The file of the previous version is deleted unless another source still refers to it
+    index[source] = {'version': version, 'sha256': digest, 'file': name}
+    write_index(index)
+    if cached is not None and entry['file'] != name and \
+            entry['file'] not in [other['file'] for other in index.values()]:
+        os.remove(cached)
+    return os.path.join(download_dir, name)
+
+def csv_member(archive):
+    
+    # The csv file of a zip archive, such as car_prices.csv in the Kaggle download
+    members = [name for name in archive.namelist() if name.lower().endswith('.csv')]
+    if not members:
+        raise ValueError(f"No csv file in {archive.filename}")
+    return members[0]
+
+@contextmanager
+def open_dataset(path):
+    
+    # Binary file object of the csv file of the dataset
+    # The csv member of a zip archive is decompressed as it is read, it is never extracted to disk
+    if not zipfile.is_zipfile(path):
+        with open(path, 'rb') as f:
+            yield f
+        return
+    
+    with zipfile.ZipFile(path) as archive, archive.open(csv_member(archive)) as f:
+        yield f
@@ -1,40 +1,131 @@
 from importdata import importdata
 from psqldocker import psqldocker_up, psqldocker_down
-from psqlconnect import psql_conn, psql_close, create_tables, insert_datedimtable, insert_statedimtable, insert_sellerdimtable, \
-    insert_vehicledimtable, insert_salesfacttable, sql_verify_queries
+from psqlconnect import psql_conn, psql_close, create_tables, insert_tables, insert_new_rows, finish_bulk_load, analyze_tables, refresh_rollups, load_mode
+from queryrunner import run_queries
+from transform import run_transform
+from metrics import stage, print_metrics, write_metrics
+from scheduler import run_pipeline, pause
 import os
+import sys
 
-def main():
-  
+def import_dataset(outputs):
+    
     print('Importing data from Kaggle')
-    importdata()
+    with stage('import'):
+        return importdata()
+
+def transform_dataset(outputs):
     
     print('Performing transformation on the Kaggle dataset')
-    import transform
+    with stage('transform') as record:
+        tables = run_transform(outputs['import'])
+        if tables is not None:
+            record['rows_out'] = len(tables['salesFactTable'])
+    return tables
 
+def start_instance(outputs):
+    
     print('Starting the PSQL instance in Docker')
-    psqldocker_up()
+    with stage('docker_up'):
+        started = psqldocker_up()
+    if not started:
+        raise RuntimeError('the PSQL instance did not start')
+
+def connect(outputs):
     
     print('Connecting to the PSQL instance via psycopg2')
-    conn = psql_conn()
+    with stage('connect'):
+        conn = psql_conn()
+    if conn is None:
+        raise ConnectionError('no connection to the PSQL instance')
+    return conn
 
+def create_schema(outputs):
+    
     print('Creating dimension tables and fact table')
-    create_tables(conn)
+    with stage('create_tables'):
+        create_tables(outputs['connect'], bulk=load_mode == 'bulk', replace=load_mode == 'full')
+
+def load_tables(outputs):
+    
+    conn = outputs['connect']
+    with stage('load'):
+        if load_mode == 'incremental':
+            print('Appending new values from the transformed tables to the database tables')
+            loaded = insert_new_rows(conn, outputs['transform'])
+        else:
+            print('Inserting values from the transformed tables to the database tables')
+            loaded = insert_tables(conn, outputs['transform'])
+    if not loaded:
+        raise RuntimeError('the tables were not loaded')
+
+def finish_load(outputs):
     
-    print('Inserting values from the csv files to the database tables')
-    insert_datedimtable()
-    insert_statedimtable()
-    insert_sellerdimtable()
-    insert_vehicledimtable()
-    insert_salesfacttable()
+    # A bulk load adds the keys and switches the tables to logged once the data is in
+    if load_mode == 'bulk':
+        print('Adding the primary keys and foreign keys to the loaded tables')
+        with stage('finish_bulk_load'):
+            finished = finish_bulk_load(outputs['connect'])
+        if not finished:
+            raise RuntimeError('the keys of the bulk-loaded tables were not added')
+
+def analyze(outputs):
+    
+    with stage('analyze'):
+        analyze_tables(outputs['connect'])
+
+def refresh(outputs):
+    
+    # The rollup tables count the sales of this load, so the report queries can read them instead of salesFactTable
+    print('Refreshing the rollup tables')
+    refresh_rollups(outputs['connect'])
+
+def query(outputs):
     
     print('Querying the database')
-    input('Press enter to run the sample queries: ')
-    sql_verify_queries()
+    pause('Press enter to run the sample queries: ')
+    with stage('queries'):
+        run_queries(outputs['connect'])
+
+# Stages of the pipeline and the stages each one waits for
+# The PSQL instance is started and its tables are created while the dataset is downloaded and transformed
+PIPELINE = {
+    'import': (import_dataset, []),
+    'transform': (transform_dataset, ['import']),
+    'docker_up': (start_instance, []),
+    'connect': (connect, ['docker_up']),
+    'create_tables': (create_schema, ['connect']),
+    'load': (load_tables, ['transform', 'create_tables']),
+    'finish_load': (finish_load, ['load']),
+    'analyze': (analyze, ['finish_load']),
+    'refresh_rollups': (refresh, ['analyze']),
+    'queries': (query, ['refresh_rollups']),
+}
+
+def print_failed(failed):
+    
+    # Stages that failed or were skipped because a stage they depend on failed, in the order of the pipeline
+    if failed:
+        print(f"Stages that failed or were skipped: {', '.join(name for name in PIPELINE if name in failed)}")
+
+def main():
+    
+    # Returns the exit status of the pipeline, 1 when a stage failed or was skipped
+    outputs, failed = run_pipeline(PIPELINE)
+    conn = outputs.get('connect')
+    if conn is None:
+        print('Stopping the PSQL instance in Docker')
+        psqldocker_down(remove_volume=False)
+        print_failed(failed)
+        return 1
+    
+    # Time, memory and rows of every stage, written as json and csv to the metrics directory
+    print_metrics()
+    write_metrics('mainscript', {'load_mode': load_mode})
     
     
     # Get a user input to proceed to closing the connection and stopping the db instance
-    input('Press enter to close the connection and stop the PSQL instance: ')
+    pause('Press enter to close the connection and stop the PSQL instance: ')
     
     # Clear the stored environment variable PGPASSWORD
     print('Is PGPASSWORD still in environment variables?', end=' ')
@@ -42,13 +133,17 @@ def main():
     print('Clearing environment variables')
     del os.environ['PGPASSWORD']
     print('Is PGPASSWORD still in environment variables?', end=' ')
-    print('PGPASSWORD' in os.environ) 
+    print('PGPASSWORD' in os.environ)
     
     print('Closing the connection to the PSQL instance')
     psql_close(conn)
     
     print('Stopping the PSQL instance in Docker')
-    psqldocker_down()
+    # Incremental loads keep the volume so the next run can append to the warehouse
+    psqldocker_down(remove_volume=load_mode != 'incremental')
     
+    print_failed(failed)
+    return 1 if failed else 0
+
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,151 @@
+import os
+import csv
+import json
+import time
+import resource
+import threading
+import contextvars
+import subprocess
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# expanded project directory path
+project_dir = os.path.expanduser('~/dwproject')
+
+# Directory the metrics of each run are written to, as a json file and a csv file
+metrics_dir = os.getenv('METRICS_DIR') or os.path.join(project_dir, 'metrics')
+
+# Interval in seconds at which the resident memory is sampled while a stage runs
+rss_sample_interval = 0.01
+
+# Fields of a stage record, in the order of the csv columns
+METRIC_FIELDS = ['stage', 'started', 'wall_s', 'cpu_s', 'peak_rss_mb', 'rows_in', 'rows_out', 'error']
+
+# Stage records of this run, stages running on several threads append to it under the lock
+records = []
+records_lock = threading.Lock()
+
+# Names of the stages open in the current context, a stage started inside another is recorded as parent/child
+# Worker threads start with an empty context, so functions run on a pool are wrapped with in_current_stage
+open_stages = contextvars.ContextVar('open_stages', default=())
+
+def current_rss_mb():
+
+    # Resident memory of this process, read from /proc where it is available
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class RssSampler:
+
+    # Samples the resident memory on a thread, the process-wide maximum would hide the peak of later stages
+
+    def __init__(self):
+
+        self.peak = current_rss_mb()
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def sample(self):
+
+        while not self.done.wait(rss_sample_interval):
+            self.peak = max(self.peak, current_rss_mb())
+
+    def stop(self):
+
+        self.done.set()
+        self.thread.join()
+        self.peak = max(self.peak, current_rss_mb())
+        return self.peak
+
+@contextmanager
+def stage(name, rows_in=None):
+
+    # Record the wall time, CPU time, peak resident memory and rows of a stage
+    # The stage sets record['rows_out'] (and record['rows_in'] when it only knows it later) on the yielded record
+    # CPU time is for the whole process, so it includes the other threads running at the same time
+    names = open_stages.get() + (name,)
+    token = open_stages.set(names)
+    record = {'stage': '/'.join(names), 'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'rows_in': rows_in, 'rows_out': None, 'error': None}
+
+    sampler = RssSampler()
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+    try:
+        yield record
+    except BaseException as e:
+        record['error'] = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        record['wall_s'] = round(time.perf_counter() - start_wall, 4)
+        record['cpu_s'] = round(time.process_time() - start_cpu, 4)
+        record['peak_rss_mb'] = round(sampler.stop(), 1)
+        open_stages.reset(token)
+        with records_lock:
+            records.append(record)
+
+def in_current_stage(function):
+
+    # Wrap a function submitted to a thread pool so it runs under the stages open where it was submitted,
+    # each call gets its own copy of that context since a context can only be entered by one thread at a time
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.copy().run(function, *args, **kwargs)
+
+    return run
+
+def git_commit():
+
+    # Commit the run is on, with a flag for uncommitted changes
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True,
+                               text=True, check=True).stdout.strip() != ''
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Error reading the git commit: {e}")
+        return None, False
+
+def print_metrics(stage_records=None):
+
+    # Print one line per stage, in the order the stages finished
+    for record in stage_records or records:
+        rows = ''
+        if record['rows_in'] is not None or record['rows_out'] is not None:
+            rows = f", rows {record['rows_in'] if record['rows_in'] is not None else '-'} -> " \
+                   f"{record['rows_out'] if record['rows_out'] is not None else '-'}"
+        print(f"{record['stage']}: {record['wall_s']:.3f} s wall, {record['cpu_s']:.3f} s cpu, "
+              f"{record['peak_rss_mb']:.1f} MB peak{rows}")
+
+def write_metrics(run_name='mainscript', extra=None):
+
+    # Write the stage records of this run to <time>-<run_name>.json and .csv in the metrics directory
+    os.makedirs(metrics_dir, exist_ok=True)
+    base_path = os.path.join(metrics_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{run_name}")
+    commit, dirty = git_commit()
+    with records_lock:
+        stage_records = list(records)
+
+    run = {'run': run_name, 'commit': commit, 'dirty': dirty, **(extra or {}), 'stages': stage_records}
+    try:
+        with open(base_path + '.json', 'w') as f:
+            json.dump(run, f, indent=2)
+        with open(base_path + '.csv', 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=METRIC_FIELDS, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(stage_records)
+    except OSError as e:
+        print(f"Error writing the metrics: {e}")
+        return None
+
+    print(f'{os.path.basename(base_path)}.json and .csv created')
+    return base_path + '.json'
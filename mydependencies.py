@@ -60,11 +60,24 @@ def install_pydotenv():
     except subprocess.CalledProcessError as e:
         print(f"Error installing python-dotenv: {e}")
 
+def install_pyarrow():
+    
+    # Command to install pyarrow, used by the optional pyarrow csv reader
+    pip_command = ['pip', 'install', 'pyarrow']
+    
+    # Run the pip_command
+    try:
+        subprocess.run(pip_command, check=True)
+        print('Pyarrow succesfully installed')
+    except subprocess.CalledProcessError as e:
+        print(f"Error installing pyarrow: {e}")
+
 def main():
     
     print('Installing dependencies...')
     install_kaggle_api()
     install_pandas()
+    install_pyarrow()
     install_pydotenv()
     install_pyscopg2()
     install_psql_cli()
@@ -0,0 +1,316 @@
+import re
+import sys
+import time
+import argparse
+from decimal import Decimal
+import numpy as np
+import pandas as pd
+from staging import STAGING_SCHEMAS, read_table
+from sqlqueries import TABLE_COLUMNS, FACT_FOREIGN_KEYS, STAR_ATTRIBUTES, STAR_MEASURES, REPORT_QUERIES
+
+# Fact columns summed by the measures, numeric(9, 2) in PostgreSQL, kept as integer cents so sums are exact
+CENT_COLUMNS = ['mmr', 'sellingprice']
+
+# Fact columns averaged by the measures, integer in PostgreSQL
+INTEGER_COLUMNS = ['odometer', 'condition']
+
+# Groups counted directly by their number when the group attributes have at most this many combinations
+dense_group_limit = 2**22
+
+# Fact column and aggregate of each measure of STAR_MEASURES
+LOCAL_MEASURES = {
+    'units_sold': (None, 'count'),
+    'total_sales': ('mmr', 'sum'),
+    'total_mmr': ('mmr', 'sum'),
+    'total_sellingprice': ('sellingprice', 'sum'),
+    'avg_mmr': ('mmr', 'avg'),
+    'avg_sellingprice': ('sellingprice', 'avg'),
+    'avg_odometer': ('odometer', 'avg'),
+    'avg_condition': ('condition', 'avg'),
+}
+
+def typed_table(table_name, table):
+
+    # Columns of a transformed or staged table in the types of its staging schema, strings as plain objects
+    table = table.copy()
+    for column, type_alias in STAGING_SCHEMAS[table_name].items():
+        if column not in table.columns:
+            continue
+        if type_alias == 'date32':
+            table[column] = pd.to_datetime(table[column])
+        elif type_alias == 'string':
+            table[column] = table[column].astype(str).astype(object)
+        else:
+            table[column] = table[column].astype(type_alias)
+    return table
+
+def load_star(tables=None):
+
+    # The star schema as arrays for the local queries, from the tables built by transform.py or its staged files
+    # Keys and measures of the fact table are numpy arrays, each dimension table is indexed by its id
+    read = (lambda table_name: tables[table_name]) if tables is not None else read_table
+    star = {'dimensions': {}, 'fact': {}, 'codes': {}, 'key_totals': {}}
+
+    for key_column, dimension_table in FACT_FOREIGN_KEYS:
+        dimension = typed_table(dimension_table, read(dimension_table))
+        star['dimensions'][dimension_table] = dimension.set_index(key_column).sort_index()
+
+    salesFactTable = typed_table('salesFactTable', read('salesFactTable'))
+    for key_column, dimension_table in FACT_FOREIGN_KEYS:
+        star['fact'][key_column] = salesFactTable[key_column].to_numpy(dtype=np.int64)
+    for column in CENT_COLUMNS:
+        star['fact'][column] = np.rint(salesFactTable[column].to_numpy(dtype=np.float64) * 100).astype(np.int64)
+    for column in INTEGER_COLUMNS:
+        star['fact'][column] = salesFactTable[column].to_numpy(dtype=np.int64)
+    star['fact']['vin'] = salesFactTable['vin'].to_numpy(dtype=object)
+    star['rows'] = len(salesFactTable)
+    return star
+
+def dimension_key(table_name):
+
+    return TABLE_COLUMNS[table_name][1]
+
+def id_lookup(dimension, values, fill):
+
+    # Array indexed by the ids of a dimension table holding one value per member, fill for ids that are not members
+    lookup = np.full(int(dimension.index.max()) + 1 if len(dimension) else 1, fill, dtype=np.asarray(values).dtype)
+    lookup[dimension.index.to_numpy()] = values
+    return lookup
+
+def like_pattern(pattern):
+
+    # Regular expression of a SQL LIKE pattern
+    return '^' + ''.join('.*' if char == '%' else '.' if char == '_' else re.escape(char) for char in pattern) + '$'
+
+def compare(values, operator, value):
+
+    # Boolean mask of a filter over a series, with the operators of sql_query_star
+    if operator == '=':
+        return values == value
+    if operator == '!=':
+        return values != value
+    if operator == '<':
+        return values < value
+    if operator == '<=':
+        return values <= value
+    if operator == '>':
+        return values > value
+    if operator == '>=':
+        return values >= value
+    if operator == 'in':
+        return values.isin(list(value))
+    if operator == 'between':
+        return (values >= value[0]) & (values <= value[1])
+    if operator == 'like':
+        return values.astype(str).str.match(like_pattern(value))
+    raise ValueError(f"Unknown filter operator {operator}")
+
+def attribute_codes(star, attribute):
+
+    # Code of the attribute value of every fact row and the values the codes stand for, computed once per attribute
+    if attribute not in star['codes']:
+        table_name = STAR_ATTRIBUTES[attribute][0]
+        if table_name == 'salesFactTable':
+            codes, uniques = pd.factorize(pd.Series(star['fact'][attribute]), sort=True)
+            if attribute in CENT_COLUMNS:
+                uniques = [Decimal(int(total)).scaleb(-2) for total in uniques]
+        else:
+            dimension = star['dimensions'][table_name]
+            member_codes, uniques = pd.factorize(dimension[attribute], sort=True)
+            codes = id_lookup(dimension, member_codes.astype(np.int32), -1)[star['fact'][dimension_key(table_name)]]
+        star['codes'][attribute] = (codes, np.asarray(uniques, dtype=object))
+    return star['codes'][attribute]
+
+def key_totals(star, table_name):
+
+    # Rows and sums of the measure columns of each member of a dimension, computed once per dimension
+    if table_name not in star['key_totals']:
+        keys = star['fact'][dimension_key(table_name)]
+        size = int(star['dimensions'][table_name].index.max()) + 1
+        totals = {None: np.bincount(keys, minlength=size)}
+        for column in CENT_COLUMNS + INTEGER_COLUMNS:
+            totals[column] = np.rint(np.bincount(keys, weights=star['fact'][column], minlength=size)).astype(np.int64)
+        star['key_totals'][table_name] = totals
+    return star['key_totals'][table_name]
+
+def numeric_weight(value):
+
+    # Weight and first digit of a numeric value in base 10000, the way PostgreSQL stores it, zero has no digits
+    if value == 0:
+        return 0, 0
+    weight = abs(value).adjusted() // 4
+    return weight, int(abs(value).scaleb(-4 * weight))
+
+def numeric_average(total, count, scale):
+
+    # AVG of PostgreSQL, which divides the sum (total units of 10**-scale) by the count as numeric values
+    # The result has the scale numeric division picks, at least 16 significant digits and no fewer than the sum has,
+    # and is rounded half away from zero, None for no rows like the NULL of PostgreSQL
+    if count == 0:
+        return None
+    weight, first_digit = numeric_weight(Decimal(total).scaleb(-scale))
+    count_weight, count_first_digit = numeric_weight(Decimal(count))
+    quotient_weight = weight - count_weight - (1 if first_digit <= count_first_digit else 0)
+    result_scale = min(max(16 - quotient_weight * 4, scale, 0), 1000)
+
+    quotient, remainder = divmod(abs(total) * 10**(result_scale - scale), count)
+    quotient = quotient + (1 if 2 * remainder >= count else 0)
+    return Decimal(quotient if total >= 0 else -quotient).scaleb(-result_scale)
+
+def measure_values(measure, counts, sums):
+
+    # Values of a measure from the rows and sums of each group, the numeric sums and averages as Decimal like
+    # PostgreSQL returns them, the sums and averages of a group without rows are None
+    column, aggregate = LOCAL_MEASURES[measure]
+    if aggregate == 'count':
+        return counts.astype(np.int64)
+    scale = 2 if column in CENT_COLUMNS else 0
+    if aggregate == 'sum':
+        return [Decimal(int(total)).scaleb(-scale) if count else None for total, count in zip(sums[column], counts)]
+    return [numeric_average(int(total), int(count), scale) for total, count in zip(sums[column], counts)]
+
+def single_dimension(group_by, filters):
+
+    # The dimension all the grouped and filtered attributes belong to, None when they span several or the fact table
+    table_names = {STAR_ATTRIBUTES[attribute][0] for attribute in list(group_by) + [item[0] for item in filters]}
+    if len(table_names) != 1 or 'salesFactTable' in table_names:
+        return None
+    return table_names.pop()
+
+def dimension_groups(star, table_name, measures, group_by, filters):
+
+    # Query answered from the totals of each member of one dimension, without going over the fact rows
+    dimension = star['dimensions'][table_name]
+    totals = key_totals(star, table_name)
+    members = dimension.index.to_numpy()
+
+    mask = np.ones(len(dimension), dtype=bool)
+    for attribute, operator, value in filters:
+        mask &= compare(dimension[attribute], operator, value).to_numpy()
+    members = members[mask]
+
+    group_frame = dimension.loc[members, list(group_by)].reset_index(drop=True)
+    group_frame['_rows'] = totals[None][members]
+    columns = {column: totals[column][members] for column in CENT_COLUMNS + INTEGER_COLUMNS}
+    group_frame = group_frame.assign(**{f'_{column}': values for column, values in columns.items()})
+    # Without group columns there is one row even when no sale matches the filters, as in PostgreSQL
+    if group_by:
+        group_frame = group_frame.groupby(list(group_by), sort=False, observed=True).sum().reset_index()
+        group_frame = group_frame[group_frame['_rows'] > 0]
+    else:
+        group_frame = group_frame.sum().to_frame().T
+    counts = group_frame['_rows'].to_numpy(dtype=np.int64)
+    sums = {column: group_frame[f'_{column}'].to_numpy(dtype=np.int64) for column in CENT_COLUMNS + INTEGER_COLUMNS}
+    result = group_frame[list(group_by)].reset_index(drop=True)
+    for measure in measures:
+        result[measure] = measure_values(measure, counts, sums)
+    return result
+
+def fact_groups(star, measures, group_by, filters):
+
+    # Query answered over the fact rows, the dimension filters become masks over the fact keys
+    mask = None
+    for attribute, operator, value in filters:
+        table_name = STAR_ATTRIBUTES[attribute][0]
+        if table_name == 'salesFactTable':
+            values = star['fact'][attribute]
+            if attribute in CENT_COLUMNS:
+                values = values / 100
+            rows = compare(pd.Series(values), operator, value).to_numpy()
+        else:
+            dimension = star['dimensions'][table_name]
+            member_mask = compare(dimension[attribute], operator, value).to_numpy()
+            rows = id_lookup(dimension, member_mask, False)[star['fact'][dimension_key(table_name)]]
+        mask = rows if mask is None else mask & rows
+
+    def selected(values):
+        return values if mask is None else values[mask]
+
+    # The codes of the group attributes are combined into one group number per row
+    group_ids = np.zeros(star['rows'] if mask is None else int(mask.sum()), dtype=np.int64)
+    uniques = []
+    for attribute in group_by:
+        codes, values = attribute_codes(star, attribute)
+        group_ids = group_ids * len(values) + selected(codes)
+        uniques.append(values)
+
+    # Few possible groups are counted directly by their number, otherwise the numbers are first made dense
+    possible_groups = int(np.prod([len(values) for values in uniques]))
+    # Without group columns there is one group even when no row is selected, as in PostgreSQL
+    if possible_groups <= dense_group_limit:
+        counts = np.bincount(group_ids, minlength=possible_groups)
+        groups = np.flatnonzero(counts) if group_by else np.arange(1)
+    else:
+        groups, group_ids = np.unique(group_ids, return_inverse=True)
+        counts = np.bincount(group_ids, minlength=len(groups))
+
+    # Only the columns the measures need are summed
+    columns = {LOCAL_MEASURES[measure][0] for measure in measures} - {None}
+    sums = {}
+    for column in columns:
+        totals = np.bincount(group_ids, weights=selected(star['fact'][column]), minlength=len(counts))
+        sums[column] = np.rint(totals[groups] if possible_groups <= dense_group_limit else totals).astype(np.int64)
+    counts = counts[groups] if possible_groups <= dense_group_limit else counts
+
+    result = pd.DataFrame(index=range(len(groups)))
+    for attribute, values in reversed(list(zip(group_by, uniques))):
+        groups, codes = np.divmod(groups, len(values))
+        result[attribute] = values[codes]
+    result = result[list(group_by)]
+    for measure in measures:
+        result[measure] = measure_values(measure, counts, sums)
+    return result
+
+def order_result(result, order_by, limit):
+
+    # ORDER BY terms such as units_sold DESC, then LIMIT
+    if order_by:
+        terms = [term.split() for term in order_by]
+        columns = [term[0] for term in terms]
+        ascending = [len(term) < 2 or term[1].upper() != 'DESC' for term in terms]
+        result = result.sort_values(columns, ascending=ascending, kind='stable').reset_index(drop=True)
+    return result.head(int(limit)) if limit else result
+
+def local_query(star, measures, group_by=(), filters=(), order_by=(), limit=None):
+
+    # The query of sql_query_star answered from the arrays of load_star, the columns are the same as in PostgreSQL
+    # Queries that only group and filter by one dimension are answered from the totals of its members
+    filters = [tuple(item) for item in filters]
+    unknown = [name for name in measures if name not in STAR_MEASURES] + \
+        [name for name in list(group_by) + [item[0] for item in filters] if name not in STAR_ATTRIBUTES]
+    if unknown:
+        raise ValueError(f"Unknown measures or attributes: {', '.join(unknown)}")
+
+    table_name = single_dimension(group_by, filters)
+    if table_name is not None:
+        result = dimension_groups(star, table_name, measures, group_by, filters)
+    else:
+        result = fact_groups(star, measures, group_by, filters)
+    return order_result(result, order_by, limit)
+
+def local_report(star, report_name):
+
+    # A report query of REPORT_QUERIES answered locally
+    return local_query(star, **REPORT_QUERIES[report_name])
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Answer the report queries from the staged files, without PostgreSQL')
+    parser.add_argument('names', nargs='*', help='report queries to run, all of them by default')
+    args = parser.parse_args()
+
+    unknown = [name for name in args.names if name not in REPORT_QUERIES]
+    if unknown:
+        print(f"Error running the queries: unknown queries {', '.join(unknown)}")
+        sys.exit(1)
+
+    start = time.perf_counter()
+    star = load_star()
+    print(f"Staged tables loaded ({time.perf_counter() - start:.2f} s, {star['rows']} sales)")
+
+    for name in args.names or list(REPORT_QUERIES):
+        start = time.perf_counter()
+        result = local_report(star, name)
+        print(f'{name} ({(time.perf_counter() - start) * 1000:.1f} ms)')
+        print(result.to_string(index=False))
+        print()
@@ -1,17 +1,25 @@
 import os
+import io
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
-import subprocess
 import time
+import numpy as np
+import pandas as pd
 import psycopg2
-from psycopg2 import OperationalError
-from sqlqueries import sql_query_creating_tables, query_1, query_2, query_3, query_4, query_5, query_6, query_7
+from psycopg2 import OperationalError, pool
+from staging import read_table, read_batches
+from metrics import stage, in_current_stage
+from sqlqueries import sql_query_creating_tables, sql_query_creating_vin_index, sql_query_appending_new_sales, \
+    sql_query_creating_unlogged_tables, sql_query_building_indexes, sql_query_adding_constraints, sql_query_setting_logged, \
+    sql_query_analyzing_tables, sql_query_bumping_data_version, sql_query_creating_rollups, sql_query_refreshing_rollup, sql_query_rollup_report, \
+    sql_query_adding_partitioned_foreign_keys, sql_query_creating_partition_load, sql_query_indexing_partition_load, \
+    sql_query_attaching_partition, sql_query_creating_partition, sql_query_creating_partition_staging, \
+    sql_query_filling_partition_load, ROLLUP_TABLES, REPORT_QUERIES, partitioned_fact
 
 # Load environment variables from the .env file
 load_dotenv()
 
-# expanded project directory path
-file_path = os.path.expanduser('~/dwproject/')
-
 # Read connection information from environment variables
 hostname = 'localhost'
 username = os.getenv('POSTGRES_USER')
@@ -20,64 +28,138 @@ port_used = '5433'
 db = os.getenv('POSTGRES_DB')
 os.environ['PGPASSWORD'] = pw
 
-# Base command for using psql cli
-psql_command = ['psql', '-h', hostname, '-U', username, '-d', db,'-p', port_used, '-c']
+# The data has non-ascii values such as '—', so COPY always sends utf-8 whatever the server default is
+client_encoding = 'UTF8'
 
-def psql_conn():
+# Seconds to keep retrying while the PSQL instance starts, and the first and longest wait between attempts
+connect_timeout = float(os.getenv('CONNECT_TIMEOUT') or 120)
+connect_first_delay = 0.05
+connect_max_delay = 2.0
+
+# Connections opened when the shared pool is created, the pool grows up to one per load worker plus the main one
+pool_min_connections = int(os.getenv('POOL_MIN_CONNECTIONS') or 2)
+
+# Connection errors that waiting will not fix, anything else is retried until connect_timeout
+FATAL_CONNECT_ERRORS = [
+    'password authentication failed',
+    'does not exist',
+    'no pg_hba.conf entry',
+    'invalid port',
+]
+
+# Pool of connections shared by every stage, opened once by psql_conn
+shared_pool = None
+
+def is_fatal_connect_error(e):
+    
+    # A fatal error, such as bad credentials or a missing database, stops the wait at once
+    return any(message in str(e) for message in FATAL_CONNECT_ERRORS)
+
+def wait_for_pool(minconn, maxconn):
     
-    # Timeout counter
-    timeout = 0
+    # Open a pool of connections as soon as the PSQL instance accepts them
+    # The wait between attempts starts short and doubles up to connect_max_delay, so a ready instance is used at once
+    deadline = time.monotonic() + connect_timeout
+    delay = connect_first_delay
+    attempts = 0
     
     while True:
-        
-        timeout = timeout + 1
-        
+        attempts = attempts + 1
         try:
-            # Establish the connection to the PostgreSQL server
-            conn = psycopg2.connect(
+            return pool.ThreadedConnectionPool(
+                minconn, maxconn,
                 host=hostname,
                 user=username,
                 password=pw,
                 port=port_used,
-                dbname=db
+                dbname=db,
+                client_encoding=client_encoding,
+                connect_timeout=max(1, int(connect_max_delay))
             )
-            print("Connected to PostgreSQL database successfully.")
-            # Return the connection object
-            return conn
         
-        except:
-            print('Connecting to the PSQL instance via psycopg2')
-            time.sleep(3)
-        
-        finally:
-            #exit the loop when timeout counter reached 200, approximately 10 mins
-            if timeout == 200:
-                print('Connection to the PSQL instance timed out')
+        except OperationalError as e:
+            if is_fatal_connect_error(e):
+                print(f"Error connecting to the PSQL instance: {e}")
                 return None
+            if time.monotonic() + delay > deadline:
+                print(f'Connection to the PSQL instance timed out after {attempts} attempts: {e}')
+                return None
+            print(f'Waiting for the PSQL instance, retrying in {delay:.2f} s')
+            time.sleep(delay)
+            delay = min(delay * 2, connect_max_delay)
+
+def get_pool():
+    
+    # The shared pool, pre-warmed with pool_min_connections when it is opened, None when the instance is not reachable
+    global shared_pool
+    
+    if shared_pool is None:
+        maxconn = max(load_workers, 1) + 1
+        shared_pool = wait_for_pool(min(pool_min_connections, maxconn), maxconn)
+    return shared_pool
+
+def psql_conn():
+    
+    # Return a connection borrowed from the shared pool, the later stages borrow the other ones
+    conn_pool = get_pool()
+    if conn_pool is None:
+        return None
+    
+    conn = conn_pool.getconn()
+    print("Connected to PostgreSQL database successfully.")
+    return conn
     
 def psql_close(conn):
     
-    # Close the psql connection
+    # Give the connection back to the shared pool and close every connection of the pool
+    global shared_pool
+    
     try:
-        conn.close()
+        if shared_pool is not None:
+            if conn is not None:
+                shared_pool.putconn(conn)
+            shared_pool.closeall()
+            shared_pool = None
+        elif conn is not None:
+            conn.close()
         print('Connection to the PostgreSQL database closed')
     
-    except OperationalError as e:
+    except (OperationalError, pool.PoolError) as e:
         print(f"Error: {e}")
         return None
     
-def create_tables(conn):
+def create_tables(conn, bulk=False, replace=False):
+    
+    cur = None
     
     try:
         # Create a cursor
         cur = conn.cursor()
         
+        # A bulk load replaces the tables with unlogged ones without keys, finish_bulk_load adds the keys afterwards
+        if bulk:
+            cur.execute(sql_query_creating_unlogged_tables(partitioned_fact))
+            conn.commit()
+            print('Unlogged dimension tables and fact table created for the bulk load')
+            return None
+        
+        # The tables are kept between incremental runs, adding the foreign keys again would duplicate them
+        # A full load (replace) finds them too when the volume of an incremental run was kept, it creates them again
+        # so the COPY does not run into the keys already there, except a partitioned salesFactTable, whose quarters
+        # are replaced by insert_partitions
+        cur.execute('SELECT relkind FROM pg_class WHERE oid = to_regclass(\'public."salesFactTable"\')')
+        row = cur.fetchone()
+        if row is not None and (not replace or (partitioned_fact and row[0] == 'p')):
+            print('Dimension tables and fact table already exist')
+            return None
+        
         # SQL command for setting up the dimension tables and fact table for the data warehouse
-        sql_command = sql_query_creating_tables()
+        sql_command = sql_query_creating_tables(partitioned_fact, replace=row is not None)
         
         cur.execute(sql_command)
         conn.commit()
-        print('Dimension tables and fact table created successfully')
+        print('Dimension tables and fact table created successfully' if row is None else
+              'Dimension tables and fact table dropped and created again for the full load')
     
     except OperationalError as e:
         print(f"Error: {e}")
@@ -90,136 +172,635 @@ def create_tables(conn):
             cur.close()
             print('Cursor closed')
             
-def insert_datedimtable():
+# Rows written to the in-memory buffer for each COPY statement
+copy_batch_rows = 100000
+
+# Connections used to load the tables at the same time, 1 loads them one after another
+load_workers = int(os.getenv('LOAD_WORKERS') or 4)
+
+# full loads the transformed tables into empty tables, incremental appends only new members and sales,
+# bulk reloads them into unlogged tables without keys and adds the keys once the data is in
+load_mode = os.getenv('LOAD_MODE') or 'full'
+
+# Columns that identify a member of each dimension table, and its id column
+dimension_keys = {
+    'dateDimTable': (['saledate'], 'date_id'),
+    'stateDimTable': (['state'], 'state_id'),
+    'sellerDimTable': (['seller'], 'seller_id'),
+    'vehicleDimTable': (['year', 'make', 'model', 'trim', 'body', 'transmission', 'color', 'interior'], 'vehicle_id'),
+}
+
+# Order in which the tables are loaded, the dimension tables go before the fact table
+dimension_table_names = ['dateDimTable', 'stateDimTable', 'sellerDimTable', 'vehicleDimTable']
+table_names = dimension_table_names + ['salesFactTable']
+
+def table_batches(table_name, table=None):
+    
+    # Yield the column names and batches of at most copy_batch_rows rows of a table
+    # table is a dataframe or an iterable of dataframe chunks, without it the file staged by transform.py is read
+    if table is None:
+        chunks = read_batches(table_name, copy_batch_rows)
+    else:
+        chunks = [table] if isinstance(table, pd.DataFrame) else table
+    
+    for chunk in chunks:
+        for start in range(0, len(chunk), copy_batch_rows):
+            yield list(chunk.columns), chunk.iloc[start:start + copy_batch_rows]
+
+def copy_batch(conn, table_name, columns, batch):
     
-    psql_command.append(f"\\copy \"dateDimTable\"(saledate, saledate_year, saledate_month, saledate_monthname, saledate_day, saledate_weekday, saledate_weekdayname, quarter, quartername, date_id) FROM '{file_path}dateDimTable.csv' DELIMITER ',' CSV HEADER;")
+    # Write a batch of rows as csv text to an in-memory buffer and stream it to the server
+    buffer = io.StringIO()
+    batch.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
     
+    columns = ', '.join(f'"{column}"' for column in columns)
+    cur = conn.cursor()
     try:
-        subprocess.run(psql_command, check=True)
-        print('Successfully inserted data to dateDimTable in the PSQL instance')
-    except subprocess.CalledProcessError as e:
-        print(f"Error inserting data to dateDimTable: {e}")
-        
-    psql_command.pop()
-    
-def insert_statedimtable():
+        cur.copy_expert(f'COPY "{table_name}"({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+    finally:
+        cur.close()
     
-    psql_command.append(f"\\copy \"stateDimTable\"(state,state_id) FROM '{file_path}stateDimTable.csv' DELIMITER ',' CSV HEADER;")
-   
-    try:
-        subprocess.run(psql_command, check=True)
-        print('Successfully inserted data to stateDimTable in the PSQL instance')
-    except subprocess.CalledProcessError as e:
-        print(f"Error inserting data to stateDimTable: {e}")
+    return len(batch)
+
+def table_rows(table):
     
-    psql_command.pop()
+    # Rows of a table handed to the loader, None when it is read from its staged file or comes in chunks
+    return len(table) if isinstance(table, pd.DataFrame) else None
 
-def insert_sellerdimtable():
+def print_load_rate(table_name, rows, start):
     
-    psql_command.append(f"\\copy \"sellerDimTable\"(seller,seller_id) FROM '{file_path}sellerDimTable.csv' DELIMITER ',' CSV HEADER;")
+    elapsed = time.perf_counter() - start
+    print(f'Successfully inserted {rows} rows to {table_name} in the PSQL instance '
+          f'({elapsed:.2f} s, {rows / max(elapsed, 1e-9):.0f} rows/s)')
 
-    try:
-        subprocess.run(psql_command, check=True)
-        print('Successfully inserted data to sellerDimTable in the PSQL instance')
-    except subprocess.CalledProcessError as e:
-        print(f"Error inserting data to sellerDimTable: {e}")
+def copy_table(conn, table_name, table=None):
+    
+    # Load every batch of a table on one connection and commit once, returns None when the table was not loaded
+    start = time.perf_counter()
+    rows = 0
+    
+    with stage(f'insert_{table_name}', rows_in=table_rows(table)) as record:
+        try:
+            for columns, batch in table_batches(table_name, table):
+                rows = rows + copy_batch(conn, table_name, columns, batch)
+            conn.commit()
+            print_load_rate(table_name, rows, start)
         
-    psql_command.pop()
+        except (OSError, psycopg2.Error) as e:
+            conn.rollback()
+            print(f"Error inserting data to {table_name}: {e}")
+            record['error'] = str(e)
+            rows = None
         
-def insert_vehicledimtable():
+        record['rows_out'] = rows
+    
+    return rows
+
+def pooled_copy_table(conn_pool, table_name, table=None):
     
-    psql_command.append(f"\\copy \"vehicleDimTable\"(year,make,model,trim,body,transmission,color,interior,vehicle_id) FROM '{file_path}vehicleDimTable.csv' DELIMITER ',' CSV HEADER;")
+    # Load a whole table on a connection borrowed from the pool
+    conn = conn_pool.getconn()
+    try:
+        return copy_table(conn, table_name, table)
+    finally:
+        conn_pool.putconn(conn)
+
+def pooled_copy_batch(conn_pool, table_name, columns, batch):
     
+    # Load and commit one batch on a connection borrowed from the pool
+    conn = conn_pool.getconn()
     try:
-        subprocess.run(psql_command, check=True)
-        print('Successfully inserted data to vehicleDimTable in the PSQL instance')
-    except subprocess.CalledProcessError as e:
-        print(f"Error inserting data to vehicleDimTable: {e}")
+        rows = copy_batch(conn, table_name, columns, batch)
+        conn.commit()
+        return rows
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn_pool.putconn(conn)
+
+def split_copy_table(conn, conn_pool, table_name, table=None, workers=load_workers):
+    
+    # Split a table into batches of consecutive rows (sale_id ranges for the fact table) and COPY them on several
+    # connections at the same time, at most two batches per worker are held in memory
+    # A full load always starts from an empty table, so when a batch fails the table is truncated on conn and the
+    # batches already committed leave no gap of sale_ids for refresh_rollups to move its watermark past
+    start = time.perf_counter()
+    rows = 0
+    
+    with stage(f'insert_{table_name}', rows_in=table_rows(table)) as record:
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                pending = set()
+                for columns, batch in table_batches(table_name, table):
+                    if len(pending) >= 2 * workers:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        rows = rows + sum(future.result() for future in done)
+                    pending.add(executor.submit(pooled_copy_batch, conn_pool, table_name, columns, batch))
+                rows = rows + sum(future.result() for future in pending)
+            print_load_rate(table_name, rows, start)
         
-    psql_command.pop()
+        except (OSError, psycopg2.Error) as e:
+            print(f"Error inserting data to {table_name}: {e}")
+            record['error'] = str(e)
+            rows = None
+            
+            # The other batches are done once the executor has shut down, so none is committed after the truncate
+            try:
+                with conn.cursor() as cur:
+                    cur.execute(f'TRUNCATE public."{table_name}";')
+                conn.commit()
+            except psycopg2.Error as e:
+                conn.rollback()
+                print(f"Error removing the rows already inserted to {table_name}: {e}")
         
-def insert_salesfacttable():
+        record['rows_out'] = rows
     
-    psql_command.append(f"\\copy \"salesFactTable\"(vin,condition,odometer,mmr,sellingprice,date_id,seller_id,state_id,vehicle_id,sale_id) FROM '{file_path}salesFactTable.csv' DELIMITER ',' CSV HEADER;")
+    return rows
+
+def insert_tables(conn, tables=None, workers=load_workers):
+    
+    # Load the dataframes built by transform.py, or its staged files when the tables are not in memory
+    # Returns whether every table was loaded, the fact table is not loaded when a dimension table failed
+    def table_of(table_name):
+        return tables[table_name] if tables is not None else None
+    
+    # A partitioned reload into a warehouse that already has sales matches the dimension members as an incremental
+    # load does, so the partitions it replaces refer to the ids of the members already in the warehouse
+    lookups = None
+    if partitioned_fact and warehouse_has_sales(conn):
+        lookups = warehouse_lookups(conn, tables)
+        dimensions_loaded = lookups is not None
+    elif workers <= 1:
+        dimensions_loaded = all(copy_table(conn, table_name, table_of(table_name)) is not None
+                                for table_name in dimension_table_names)
+    else:
+        # Load the dimension tables at the same time, then split the fact table across the workers
+        # The workers borrow their connections from the shared pool, which is opened with one per worker to spare
+        conn_pool = get_pool()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            loaded = list(executor.map(in_current_stage(lambda table_name: pooled_copy_table(conn_pool, table_name, table_of(table_name))),
+                                       dimension_table_names))
+        dimensions_loaded = all(rows is not None for rows in loaded)
+    
+    # Sales whose keys are missing from a dimension table would fail their foreign keys, or in a partition that
+    # replaces an existing one refer to the wrong members
+    if not dimensions_loaded:
+        print('Error inserting data to salesFactTable: a dimension table was not loaded, the sales are not loaded')
+        return False
+    
+    if partitioned_fact:
+        rows = insert_partitions(conn, tables, workers, lookups)
+    elif workers <= 1:
+        rows = copy_table(conn, 'salesFactTable', table_of('salesFactTable'))
+    else:
+        rows = split_copy_table(conn, get_pool(), 'salesFactTable', table_of('salesFactTable'), workers)
+    if rows is None:
+        return False
+    bump_data_version(conn)
+    return True
+
+def bump_data_version(conn):
     
+    # Give the warehouse a new data version after a load, so results cached for the old data are not used again
     try:
-        subprocess.run(psql_command, check=True)
-        print('Successfully inserted data to salesFactTable in the PSQL instance')
-    except subprocess.CalledProcessError as e:
-        print(f"Error inserting data to salesFactTable: {e}")
+        with conn.cursor() as cur:
+            cur.execute(sql_query_bumping_data_version(), {'data_version': uuid.uuid4().hex})
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"Error updating the data version: {e}")
+
+def data_version(conn):
+    
+    # Version of the loaded data, None when the warehouse has none yet
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SELECT data_version FROM public."warehouseVersionTable";')
+            row = cur.fetchone()
+        conn.rollback()
+        return row[0] if row else None
+    except psycopg2.Error:
+        conn.rollback()
+        return None
+
+# Memory each index build of a bulk load may use for sorting
+maintenance_work_mem = os.getenv('MAINTENANCE_WORK_MEM') or '256MB'
+
+def build_index(conn_pool, command):
     
-    psql_command.pop()
+    # Build one index on a connection borrowed from the pool
+    conn = conn_pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute('SET maintenance_work_mem = %s', (maintenance_work_mem,))
+            cur.execute(command)
+        conn.commit()
+    except psycopg2.Error:
+        conn.rollback()
+        raise
+    finally:
+        conn_pool.putconn(conn)
 
-def sql_verify_queries():
+def finish_bulk_load(conn, workers=None):
     
-    psql_command.append(query_1())
+    # After the COPY of a bulk load, build the primary key and foreign-key indexes at the same time on the pooled
+    # connections, then add the constraints, validate them against the loaded rows and switch the tables to logged
+    workers = workers or load_workers
+    start = time.perf_counter()
     
     try:
-        print('First 5 rows of dateDimTable')
-        subprocess.run(psql_command, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error querying database table: {e}")  
+        with stage('build_indexes'), ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+            list(executor.map(in_current_stage(lambda command: build_index(get_pool(), command)),
+                              sql_query_building_indexes(partitioned_fact)))
+        
+        with stage('add_constraints'), conn.cursor() as cur:
+            cur.execute(sql_query_adding_constraints(partitioned_fact))
+            conn.commit()
+        
+        with stage('set_logged'), conn.cursor() as cur:
+            cur.execute(sql_query_setting_logged(partitioned_fact))
+            conn.commit()
+        
+        # A partitioned salesFactTable is logged, it can only reference the dimension tables once they are logged too
+        if partitioned_fact:
+            with stage('add_foreign_keys'), conn.cursor() as cur:
+                cur.execute(sql_query_adding_partitioned_foreign_keys())
+                conn.commit()
+        print(f'Primary keys and foreign keys added to the bulk-loaded tables ({time.perf_counter() - start:.2f} s)')
+        return True
+    
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"Error adding the keys to the bulk-loaded tables: {e}")
+        return False
+
+def partition_name(quarter):
     
-    psql_command.pop()
+    return f'salesFactTable_{quarter.year}q{quarter.quarter}'
+
+def quarter_bounds(quarter):
     
-    psql_command.append(query_2())
+    # First day of a quarter and of the next one, the bounds of its partition
+    return quarter.start_time.date(), (quarter + 1).start_time.date()
+
+def fact_saledates(tables=None):
     
-    try:
-        print('First 5 rows of sellerDimTable')
-        subprocess.run(psql_command, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error querying database table: {e}")  
+    # Sale date of each date_id of the transformed dateDimTable
+    dateDimTable = read_dimension_table('dateDimTable', tables)
+    return pd.Series(pd.to_datetime(dateDimTable['saledate']).to_numpy(), index=dateDimTable['date_id'].to_numpy())
+
+def with_saledates(chunks, saledates):
     
-    psql_command.pop()
+    # Add the sale date of their date_id to chunks of the transformed fact table
+    for chunk in chunks:
+        chunk['saledate'] = saledates.reindex(chunk['date_id'].astype(np.int64)).to_numpy()
+        yield chunk
+
+def with_warehouse_keys(chunks, lookups, sale_id_offset):
+    
+    # Give chunks of the transformed fact table the warehouse ids of their members, and sale ids after the highest one
+    # in the warehouse, the sale dates have to be added before the date ids are rewritten
+    for chunk in chunks:
+        for table_name, (columns, id_col) in dimension_keys.items():
+            chunk[id_col] = lookups[table_name][chunk[id_col].astype(np.int64).to_numpy()]
+        chunk['sale_id'] = chunk['sale_id'].astype(np.int64) + sale_id_offset
+        yield chunk
+
+def stage_partitions(conn, chunks):
+    
+    # Copy chunks of the fact rows with their sale date into an unlogged table per quarter as they are read,
+    # so the fact table is never held in memory, returns the number of rows of each quarter
+    quarters = {}
+    with conn.cursor() as cur:
+        for chunk in chunks:
+            for quarter, rows in chunk.groupby(chunk['saledate'].dt.to_period('Q'), sort=True):
+                name = partition_name(quarter)
+                if quarter not in quarters:
+                    cur.execute(sql_query_creating_partition_staging(name))
+                    quarters[quarter] = 0
+                quarters[quarter] = quarters[quarter] + copy_batch(conn, f'{name}_staging', list(rows.columns), rows)
+    conn.commit()
+    return quarters
+
+def load_partition(conn_pool, quarter, rows):
     
-    psql_command.append(query_3())
+    # Sort the staged sales of one quarter into a table of their own and build its indexes, on a pooled connection
+    name = partition_name(quarter)
+    start, end = quarter_bounds(quarter)
+    conn = conn_pool.getconn()
     
     try:
-        print('First 5 rows of stateDimTable')
-        subprocess.run(psql_command, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error querying database table: {e}")  
+        with stage(f'insert_{name}', rows_in=rows) as record, conn.cursor() as cur:
+            cur.execute(sql_query_creating_partition_load(name, start, end))
+            cur.execute(sql_query_filling_partition_load(name))
     
-    psql_command.pop()
+            cur.execute('SET maintenance_work_mem = %s', (maintenance_work_mem,))
+            for command in sql_query_indexing_partition_load(name):
+                cur.execute(command)
+            conn.commit()
+            record['rows_out'] = rows
+        return name, start, end, rows
     
-    psql_command.append(query_4())
+    except psycopg2.Error:
+        conn.rollback()
+        raise
     
+    finally:
+        conn_pool.putconn(conn)
+
+def insert_partitions(conn, tables=None, workers=load_workers, lookups=None):
+    
+    # Load the quarters of the fact table at the same time, then swap them in one transaction
+    # A quarter that is already in the warehouse has its partition replaced by the newly loaded one
+    # When the warehouse already has sales, lookups gives the rows the warehouse keys of their members,
+    # the ids of transform.py would refer to other members
+    # Returns the number of rows loaded, None when the partitions were not swapped in
+    start = time.perf_counter()
+    conn_pool = get_pool()
+    rows = 0
+    
+    with stage('insert_salesFactTable') as record:
+        try:
+            # Reloaded sales get sale ids after the highest one in the warehouse, so they never share one with the
+            # sales of the partitions that are kept
+            sale_id_offset = 0
+            if lookups is not None:
+                with conn.cursor() as cur:
+                    fact_oid, sale_id_offset = fact_table_state(cur)
+                conn.rollback()
+    
+            # The quarters are copied as the fact table is read in batches, then each one is sorted by the server
+            chunks = with_saledates(read_fact_chunks(tables), fact_saledates(tables))
+            if lookups is not None:
+                chunks = with_warehouse_keys(chunks, lookups, sale_id_offset)
+            with stage('stage_partitions') as staged:
+                quarters = stage_partitions(conn, chunks)
+                staged['rows_out'] = sum(quarters.values())
+    
+            with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+                futures = [executor.submit(in_current_stage(load_partition), conn_pool, quarter, quarter_rows)
+                           for quarter, quarter_rows in sorted(quarters.items())]
+                loaded = [future.result() for future in futures]
+    
+            replaced = []
+            with conn.cursor() as cur:
+                for name, partition_start, partition_end, partition_rows in loaded:
+                    cur.execute('SELECT to_regclass(%s)', (f'public."{name}"',))
+                    exists = cur.fetchone()[0] is not None
+                    cur.execute(sql_query_attaching_partition(name, partition_start, partition_end, replace=exists))
+                    replaced = replaced + [name] if exists else replaced
+                    rows = rows + partition_rows
+    
+                # The rollups may have counted the sales of a replaced partition, removing their state leaves them
+                # stale until the next refresh_rollups rebuilds them from all sales, and until then report_query
+                # reads salesFactTable instead
+                cur.execute('SELECT to_regclass(\'public."rollupStateTable"\')')
+                if replaced and cur.fetchone()[0] is not None:
+                    cur.execute('DELETE FROM public."rollupStateTable";')
+            conn.commit()
+    
+            print_load_rate('salesFactTable', rows, start)
+            print(f'{len(loaded)} partitions attached to salesFactTable, {len(replaced)} of them replaced')
+            if replaced:
+                print('The rollup tables are stale until they are refreshed')
+    
+        except (OSError, psycopg2.Error) as e:
+            conn.rollback()
+            print(f"Error inserting data to salesFactTable: {e}")
+            record['error'] = str(e)
+            rows = None
+    
+        record['rows_out'] = rows
+    
+    return rows
+
+def create_new_partitions(cur):
+    
+    # Partitions for the quarters of the staged sales that have none yet
+    cur.execute('SELECT DISTINCT date_trunc(\'quarter\', saledate)::date FROM "salesFactStaging";')
+    for quarter_start, in cur.fetchall():
+        quarter = pd.Period(quarter_start, freq='Q')
+        cur.execute(sql_query_creating_partition(partition_name(quarter), *quarter_bounds(quarter)))
+
+def analyze_tables(conn):
+    
+    # Refresh the planner statistics of the loaded tables
     try:
-        print('First 5 rows of vehicleDimTable')
-        subprocess.run(psql_command, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error querying database table: {e}")  
+        with conn.cursor() as cur:
+            cur.execute(sql_query_analyzing_tables())
+        conn.commit()
+        print('Tables analyzed')
+    except psycopg2.Error as e:
+        conn.rollback()
+        print(f"Error analyzing the tables: {e}")
+
+# Answer the report queries from the rollup tables when they are up to date, 0 always queries salesFactTable
+use_rollups = os.getenv('USE_ROLLUPS', '1') == '1'
+
+def fact_table_state(cur):
     
-    psql_command.pop()
+    # Oid and highest sale_id of salesFactTable, the oid changes when the table is dropped and created again
+    cur.execute('''SELECT 'public."salesFactTable"'::regclass::oid, COALESCE(MAX(sale_id), 0)
+        FROM public."salesFactTable";''')
+    return cur.fetchone()
+
+def refresh_rollups(conn):
     
-    psql_command.append(query_5())
+    # Add the sales loaded since the last refresh to every rollup table
+    # A rollup whose fact table was created again, or lost rows, is emptied and built from all sales
+    cur = conn.cursor()
     
+    with stage('refresh_rollups') as record:
+        try:
+            cur.execute(sql_query_creating_rollups())
+            fact_oid, max_sale_id = fact_table_state(cur)
+            cur.execute('SELECT rollup_name, fact_oid, last_sale_id FROM public."rollupStateTable";')
+            rollup_states = {rollup_name: (oid, last_sale_id) for rollup_name, oid, last_sale_id in cur.fetchall()}
+            
+            for rollup_name in ROLLUP_TABLES:
+                oid, last_sale_id = rollup_states.get(rollup_name, (None, 0))
+                if oid != fact_oid or last_sale_id > max_sale_id:
+                    cur.execute(f'TRUNCATE public."{rollup_name}";')
+                    last_sale_id = 0
+                
+                cur.execute(sql_query_refreshing_rollup(rollup_name),
+                            {'last_sale_id': last_sale_id, 'max_sale_id': max_sale_id})
+                cur.execute('''INSERT INTO public."rollupStateTable" (rollup_name, fact_oid, last_sale_id)
+                    VALUES (%s, %s, %s) ON CONFLICT (rollup_name)
+                    DO UPDATE SET fact_oid = EXCLUDED.fact_oid, last_sale_id = EXCLUDED.last_sale_id;''',
+                            (rollup_name, fact_oid, max_sale_id))
+                print(f'{rollup_name} refreshed up to sale_id {max_sale_id}')
+            
+            conn.commit()
+            record['rows_out'] = max_sale_id
+        
+        except psycopg2.Error as e:
+            conn.rollback()
+            print(f"Error refreshing the rollup tables: {e}")
+            record['error'] = str(e)
+        
+        finally:
+            cur.close()
+
+def rollups_fresh(conn):
+    
+    # Whether every rollup has counted all the sales in salesFactTable
+    # The check only reads, its transaction is rolled back so the connection is not left idle in transaction
+    cur = conn.cursor()
     try:
-        print('First 5 rows of SalesFactTable')
-        subprocess.run(psql_command, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error querying database table: {e}")  
+        fact_oid, max_sale_id = fact_table_state(cur)
+        cur.execute('''SELECT COUNT(*) FROM public."rollupStateTable"
+            WHERE fact_oid = %s AND last_sale_id = %s;''', (fact_oid, max_sale_id))
+        fresh = cur.fetchone()[0] == len(ROLLUP_TABLES)
+        conn.rollback()
+        return fresh
+    except psycopg2.Error:
+        conn.rollback()
+        return False
+    finally:
+        cur.close()
+
+def report_query(conn, report_name, query):
     
-    psql_command.pop()
+    # The sql of a report query, read from a rollup table when one can answer it and is up to date
+    if not use_rollups or conn is None or report_name not in REPORT_QUERIES or not rollups_fresh(conn):
+        return query()
     
-    psql_command.append(query_6())
+    rollup_query = sql_query_rollup_report(report_name)
+    return rollup_query if rollup_query is not None else query()
+
+def fetch_table(conn, table_name, columns):
     
+    # Read the given columns of a warehouse table into a dataframe
+    cur = conn.cursor()
     try:
-        print('Top 10 car make sold')
-        subprocess.run(psql_command, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error querying database table: {e}")  
+        quoted_columns = ', '.join(f'"{column}"' for column in columns)
+        cur.execute(f'SELECT {quoted_columns} FROM "{table_name}"')
+        return pd.DataFrame(cur.fetchall(), columns=columns)
+    finally:
+        cur.close()
+
+def read_dimension_table(table_name, tables=None):
+    
+    # The dimension table built by transform.py, read back from its staged file when the tables are not in memory
+    if tables is not None:
+        return tables[table_name]
     
-    psql_command.pop()
+    columns, id_col = dimension_keys[table_name]
+    return read_table(table_name).astype({id_col: int})
+
+def read_fact_chunks(tables=None):
     
-    psql_command.append(query_7())
+    # Batches of the fact table built by transform.py, copied so their keys can be rewritten
+    if tables is not None:
+        salesFactTable = tables['salesFactTable']
+        for start in range(0, len(salesFactTable), copy_batch_rows):
+            yield salesFactTable.iloc[start:start + copy_batch_rows].copy()
+        return
     
-    try:
-        print('Total car sales for each quarter of each year')
-        subprocess.run(psql_command, check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error querying database table: {e}")  
+    yield from read_batches('salesFactTable', copy_batch_rows)
+
+def match_dimension(conn, table_name, dimTable):
+    
+    # Give the members of a transformed dimension table their warehouse ids
+    # Members already in the warehouse keep their id, new members continue after the highest id
+    columns, id_col = dimension_keys[table_name]
+    existing = fetch_table(conn, table_name, columns + [id_col])
+    
+    # Compare the members as text, pandas and psycopg2 return dates and numbers as different types
+    local_keys = dimTable[columns].astype(str)
+    existing_keys = existing[columns].astype(str)
+    existing_keys[id_col] = existing[id_col]
+    matched = local_keys.merge(existing_keys, on=columns, how='left')[id_col]
     
-    psql_command.pop()
+    new = matched.isnull().to_numpy()
+    next_id = int(existing[id_col].max()) if len(existing) else 0
+    warehouse_ids = matched.fillna(0).to_numpy(dtype=np.int64)
+    warehouse_ids[new] = np.arange(next_id + 1, next_id + new.sum() + 1)
+    
+    new_members = dimTable[new].copy()
+    new_members[id_col] = warehouse_ids[new]
+    
+    # Lookup array from the ids given by transform.py to the warehouse ids
+    local_ids = dimTable[id_col].to_numpy(dtype=np.int64)
+    lookup = np.zeros(local_ids.max() + 1 if len(local_ids) else 1, dtype=np.int64)
+    lookup[local_ids] = warehouse_ids
+    
+    return new_members, lookup
+
+def append_new_sales(conn, chunks, lookups):
+    
+    # Stage the transformed sales with their warehouse keys, then append the ones whose vin is not loaded yet
+    start = time.perf_counter()
+    staged = 0
+    cur = conn.cursor()
+    
+    with stage('append_salesFactTable') as record:
+        try:
+            cur.execute(sql_query_creating_vin_index())
+            cur.execute('CREATE TEMP TABLE "salesFactStaging" (LIKE public."salesFactTable") ON COMMIT DROP')
+            
+            for chunk in chunks:
+                for table_name, (columns, id_col) in dimension_keys.items():
+                    chunk[id_col] = lookups[table_name][chunk[id_col].astype(np.int64).to_numpy()]
+                staged = staged + copy_batch(conn, 'salesFactStaging', list(chunk.columns), chunk)
+            
+            if partitioned_fact:
+                create_new_partitions(cur)
+            cur.execute(sql_query_appending_new_sales(partitioned_fact))
+            appended = cur.rowcount
+            conn.commit()
+            print(f'Skipped {staged - appended} sales already in salesFactTable')
+            print_load_rate('salesFactTable', appended, start)
+            record['rows_out'] = appended
+            return appended
+        
+        except (OSError, psycopg2.Error) as e:
+            conn.rollback()
+            print(f"Error inserting data to salesFactTable: {e}")
+            record['error'] = str(e)
+            return None
+        
+        finally:
+            cur.close()
+            record['rows_in'] = staged
+
+def warehouse_has_sales(conn):
+    
+    # Whether salesFactTable already holds sales
+    with conn.cursor() as cur:
+        cur.execute('SELECT EXISTS (SELECT 1 FROM public."salesFactTable");')
+        has_sales = cur.fetchone()[0]
+    conn.rollback()
+    return has_sales
+
+def warehouse_lookups(conn, tables=None):
+    
+    # Insert the members of the transformed dimension tables that are not in the warehouse yet
+    # Returns the lookups from the ids given by transform.py to the warehouse ids, None when a dimension table failed
+    lookups = {}
+    for table_name in dimension_table_names:
+        new_members, lookups[table_name] = match_dimension(conn, table_name, read_dimension_table(table_name, tables))
+        if copy_table(conn, table_name, new_members) is None:
+            return None
+    return lookups
 
-        
\ No newline at end of file
+def insert_new_rows(conn, tables=None):
+    
+    # Incremental load, only members and sales that are not in the warehouse yet are inserted
+    # Returns whether the sales were appended, they are not when a dimension table failed
+    lookups = warehouse_lookups(conn, tables)
+    if lookups is None:
+        print('Error inserting data to salesFactTable: a dimension table was not loaded, the sales are not loaded')
+        return False
+    
+    # A partitioned salesFactTable also takes the sale date of each sale, read before the date ids are rewritten
+    chunks = read_fact_chunks(tables)
+    if partitioned_fact:
+        chunks = with_saledates(chunks, fact_saledates(tables))
+    if append_new_sales(conn, chunks, lookups) is None:
+        return False
+    bump_data_version(conn)
+    return True
@@ -1,6 +1,45 @@
 import subprocess
+import time
 
-def psqldocker_up():
+# Name of the container in docker-compose.yml
+container_name = 'postgres_instance'
+
+# Seconds to wait for the container healthcheck to pass, and the longest wait between two checks
+health_timeout = 120
+health_max_delay = 1.0
+
+def container_health():
+
+    # Health status reported by the healthcheck in docker-compose.yml, 'starting', 'healthy' or 'unhealthy'
+    # An empty string means the container has no healthcheck
+    inspect = ['docker', 'inspect', '-f', '{{if .State.Health}}{{.State.Health.Status}}{{end}}', container_name]
+    result = subprocess.run(inspect, capture_output=True, text=True, check=True)
+    return result.stdout.strip()
+
+def wait_healthy(timeout=health_timeout):
+
+    # Wait until the healthcheck passes, checking often at first and backing off up to health_max_delay
+    deadline = time.monotonic() + timeout
+    delay = 0.1
+
+    while True:
+        try:
+            status = container_health()
+        except subprocess.CalledProcessError as e:
+            print(f"Error checking the PSQL instance: {e}")
+            return False
+
+        if status in ('healthy', ''):
+            print('PSQL instance is ready')
+            return True
+        if status == 'unhealthy' or time.monotonic() + delay > deadline:
+            print(f'PSQL instance is not ready: {status}')
+            return False
+
+        time.sleep(delay)
+        delay = min(delay * 2, health_max_delay)
+
+def psqldocker_up(wait=True):
 
     # Command to run the docker-compose.yml file to start a PSQL instance
     run_psql = ['docker-compose', 'up', '-d']
@@ -12,11 +51,17 @@ def psqldocker_up():
     
     except subprocess.CalledProcessError as e:
         print(f"Error starting the PSQL instance: {e}")
+        return False
+
+    # Return once the database accepts connections rather than when the container is created
+    return wait_healthy() if wait else True
 
-def psqldocker_down():
+def psqldocker_down(remove_volume=True):
 
-    # Command to stop the running PSQL instance
-    run_psql = ['docker-compose', 'down', '-v']
+    # Command to stop the running PSQL instance, -v also deletes the volume holding the data
+    run_psql = ['docker-compose', 'down']
+    if remove_volume:
+        run_psql.append('-v')
     
     # Run the run_psql command
     try:
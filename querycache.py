@@ -0,0 +1,129 @@
+import os
+import re
+import json
+import time
+import pickle
+import hashlib
+import threading
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# expanded project directory path
+project_dir = os.path.expanduser('~/dwproject')
+
+# Serve repeated queries from the cache until the next load, 0 always runs them
+use_query_cache = os.getenv('QUERY_CACHE', '1') == '1'
+
+# Results kept in the cache, the least recently used ones are evicted first
+query_cache_size = int(os.getenv('QUERY_CACHE_SIZE') or 256)
+
+# Seconds a result is served for, whatever the data version, 0 keeps results until they are evicted
+query_cache_max_age = float(os.getenv('QUERY_CACHE_MAX_AGE') or 3600)
+
+# Keep the cache in a file between runs, 1 turns it on
+persist_query_cache = os.getenv('QUERY_CACHE_PERSIST', '0') == '1'
+
+# File the cache is kept in when it is persisted
+query_cache_path = os.path.join(project_dir, 'query_cache.pkl')
+
+# Cached results by key, in order of use, the queries running on several threads read and add them under the lock
+cache_entries = OrderedDict()
+cache_lock = threading.Lock()
+cache_loaded = False
+
+# String literals and quoted identifiers, which are kept as they are when the sql is normalized
+QUOTED_PATTERN = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")")
+
+def normalize_sql(sql):
+
+    # Same key for queries that only differ in whitespace, case of keywords or a trailing semicolon
+    parts = QUOTED_PATTERN.split(sql.strip().rstrip(';'))
+    return ''.join(part if index % 2 else ' '.join(part.split()).lower() for index, part in enumerate(parts))
+
+def cache_key(sql, params, version):
+
+    # Key of a query result, from the normalized sql, its parameters and the data version it was read from
+    payload = json.dumps({'sql': normalize_sql(sql), 'params': params, 'version': version}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def load_cache():
+
+    # Read the persisted cache once, the results past their age are dropped
+    global cache_loaded
+    if cache_loaded or not persist_query_cache or not os.path.exists(query_cache_path):
+        cache_loaded = True
+        return
+
+    try:
+        with open(query_cache_path, 'rb') as f:
+            entries = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError) as e:
+        print(f"Error reading the query cache: {e}")
+        entries = OrderedDict()
+
+    with cache_lock:
+        cache_entries.update(entries)
+        for key in [key for key, entry in cache_entries.items() if expired(entry)]:
+            del cache_entries[key]
+    cache_loaded = True
+
+def save_cache():
+
+    if not persist_query_cache:
+        return
+
+    # Write to a temporary file first so an interrupted run never leaves a partial cache
+    os.makedirs(project_dir, exist_ok=True)
+    with cache_lock:
+        entries = OrderedDict(cache_entries)
+    try:
+        with open(query_cache_path + '.tmp', 'wb') as f:
+            pickle.dump(entries, f)
+        os.replace(query_cache_path + '.tmp', query_cache_path)
+    except OSError as e:
+        print(f"Error saving the query cache: {e}")
+
+def expired(entry):
+
+    return query_cache_max_age > 0 and time.time() - entry['stored'] > query_cache_max_age
+
+def cache_get(key):
+
+    # The cached result of a key, or None when there is none or it is too old
+    if not use_query_cache:
+        return None
+    load_cache()
+
+    with cache_lock:
+        entry = cache_entries.get(key)
+        if entry is None:
+            return None
+        if expired(entry):
+            del cache_entries[key]
+            return None
+        cache_entries.move_to_end(key)
+        return entry['result']
+
+def cache_put(key, result):
+
+    # Add a result, then evict the least recently used ones over the size of the cache
+    if not use_query_cache:
+        return
+    load_cache()
+
+    with cache_lock:
+        cache_entries[key] = {'result': result, 'stored': time.time()}
+        cache_entries.move_to_end(key)
+        while len(cache_entries) > query_cache_size:
+            cache_entries.popitem(last=False)
+
+def clear_cache():
+
+    # Drop every cached result, also from the persisted file
+    with cache_lock:
+        cache_entries.clear()
+    if os.path.exists(query_cache_path):
+        os.remove(query_cache_path)
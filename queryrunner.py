@@ -0,0 +1,186 @@
+import os
+import sys
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import pandas as pd
+import psycopg2
+from metrics import stage, in_current_stage
+from psqlconnect import psql_conn, psql_close, get_pool, report_query, data_version
+from querycache import cache_key, cache_get, cache_put, save_cache
+from sqlqueries import query_1, query_2, query_3, query_4, query_5, query_6, query_7
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# expanded project directory path
+project_dir = os.path.expanduser('~/dwproject')
+
+# Queries run at the same time, each on its own pooled connection
+query_workers = int(os.getenv('QUERY_WORKERS') or 4)
+
+# Also capture the EXPLAIN (ANALYZE, BUFFERS) plan of each query, 1 turns it on
+explain_queries = os.getenv('EXPLAIN_QUERIES', '0') == '1'
+
+# Directory the captured plans are written to, one text file per query
+plans_dir = os.path.join(project_dir, 'plans')
+
+# The sample queries, by name, with the title printed above their rows
+sample_queries = {
+    'query_1': ('First 5 rows of dateDimTable', query_1),
+    'query_2': ('First 5 rows of sellerDimTable', query_2),
+    'query_3': ('First 5 rows of stateDimTable', query_3),
+    'query_4': ('First 5 rows of vehicleDimTable', query_4),
+    'query_5': ('First 5 rows of SalesFactTable', query_5),
+    'query_6': ('Top 10 car make sold', query_6),
+    'query_7': ('Total car sales for each quarter of each year', query_7),
+}
+
+def execution_time_ms(plan):
+
+    # Execution time reported on the last lines of an EXPLAIN ANALYZE plan
+    for line in reversed(plan.splitlines()):
+        if line.startswith('Execution Time:'):
+            return float(line.split()[2])
+    return None
+
+def run_query(conn_pool, name, query, explain=False):
+
+    # Run one query on a pooled connection, the latency covers executing it and fetching its rows
+    result = {'name': name, 'query': query, 'columns': [], 'rows': [], 'latency_ms': None, 'plan': None, 'error': None,
+              'cached': False}
+    conn = conn_pool.getconn()
+    cur = conn.cursor()
+
+    with stage(name) as record:
+        try:
+            start = time.perf_counter()
+            cur.execute(query)
+            result['rows'] = cur.fetchall()
+            result['latency_ms'] = round((time.perf_counter() - start) * 1000, 3)
+            result['columns'] = [column.name for column in cur.description]
+            record['rows_out'] = len(result['rows'])
+
+            # EXPLAIN ANALYZE runs the query a second time, so its buffers are those of a run with a warm cache
+            if explain:
+                cur.execute(f'EXPLAIN (ANALYZE, BUFFERS) {query}')
+                result['plan'] = '\n'.join(line for line, in cur.fetchall())
+            conn.rollback()
+
+        except psycopg2.Error as e:
+            conn.rollback()
+            print(f"Error querying database table: {e}")
+            result['error'] = str(e)
+            record['error'] = str(e)
+
+        finally:
+            cur.close()
+            conn_pool.putconn(conn)
+
+    return result
+
+def write_plans(results):
+
+    # Write the captured plans to <time>-<query name>.txt in the plans directory
+    os.makedirs(plans_dir, exist_ok=True)
+    prefix = time.strftime('%Y%m%d-%H%M%S')
+    for result in results:
+        if result['plan'] is None:
+            continue
+        plan_path = os.path.join(plans_dir, f"{prefix}-{result['name']}.txt")
+        try:
+            with open(plan_path, 'w') as f:
+                f.write(result['query'] + '\n\n' + result['plan'] + '\n')
+        except OSError as e:
+            print(f"Error writing the plan of {result['name']}: {e}")
+
+def print_results(results, titles):
+
+    # Print the rows of each query under its title, in the order the queries were given
+    for result in results:
+        print(titles.get(result['name'], result['name']))
+        if result['error'] is None:
+            print(pd.DataFrame(result['rows'], columns=result['columns']).to_string(index=False))
+        print()
+
+def print_summary(results):
+
+    # One line per query with its rows, latency and whether it came from the cache, and the execution time of its plan when one was captured
+    summary = pd.DataFrame({
+        'query': [result['name'] for result in results],
+        'rows': [len(result['rows']) for result in results],
+        'latency_ms': [result['latency_ms'] for result in results],
+        'cached': ['yes' if result['cached'] else 'no' for result in results],
+        'plan_ms': [execution_time_ms(result['plan']) if result['plan'] else None for result in results],
+        'error': [result['error'] or '' for result in results],
+    })
+    if summary['plan_ms'].isnull().all():
+        summary = summary.drop(columns='plan_ms')
+    if (summary['error'] == '').all():
+        summary = summary.drop(columns='error')
+    print(summary.to_string(index=False))
+
+def run_queries(conn, names=None, workers=query_workers, explain=explain_queries, show_rows=True):
+
+    # Run the named sample queries, all of them by default, at most workers at a time over the shared pool
+    # The report queries are read from the rollup tables when those are up to date
+    names = names or list(sample_queries)
+    queries = {name: report_query(conn, name, sample_queries[name][1]) for name in names}
+
+    # The connection of the caller stays borrowed, so one connection of the pool is left out
+    conn_pool = get_pool()
+    workers = max(1, min(workers, conn_pool.maxconn - 1))
+
+    # Results read from the same data version are served from the cache, each load gives the warehouse a new version
+    # Without a version there is nothing to tell the results of two loads apart, so nothing is cached
+    version = data_version(conn)
+    keys = {name: cache_key(query, None, version) for name, query in queries.items()}
+    results = {}
+    for name, query in queries.items():
+        start = time.perf_counter()
+        cached = cache_get(keys[name]) if version is not None else None
+        if cached is not None and (cached['plan'] is not None or not explain):
+            results[name] = {**cached, 'name': name, 'cached': True,
+                             'latency_ms': round((time.perf_counter() - start) * 1000, 3)}
+
+    pending = {name: query for name, query in queries.items() if name not in results}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {name: executor.submit(in_current_stage(run_query), conn_pool, name, query, explain) for name, query in pending.items()}
+        for name, future in futures.items():
+            results[name] = future.result()
+            if version is not None and results[name]['error'] is None:
+                cache_put(keys[name], results[name])
+    save_cache()
+
+    results = [results[name] for name in queries]
+
+    if show_rows:
+        print_results(results, {name: title for name, (title, query) in sample_queries.items()})
+    print_summary(results)
+    if explain:
+        write_plans(results)
+        print(f'Plans written to {plans_dir}')
+    return results
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Run the sample queries against the PostgreSQL instance')
+    parser.add_argument('names', nargs='*', help='queries to run, all of them by default')
+    parser.add_argument('--workers', type=int, default=query_workers, help='queries run at the same time')
+    parser.add_argument('--explain', action='store_true', default=explain_queries,
+                        help='capture the EXPLAIN (ANALYZE, BUFFERS) plan of each query')
+    args = parser.parse_args()
+
+    unknown = [name for name in args.names if name not in sample_queries]
+    if unknown:
+        print(f"Error running the queries: unknown queries {', '.join(unknown)}")
+        sys.exit(1)
+
+    conn = psql_conn()
+    if conn is None:
+        sys.exit(1)
+    try:
+        run_queries(conn, args.names, args.workers, args.explain)
+    finally:
+        psql_close(conn)
@@ -1,4 +1,11 @@
 #!/bin/bash
 
-sudo rm dateDimTable.csv salesFactTable.csv sellerDimTable.csv stateDimTable.csv \
-        Vehicle_sales_data.csv vehicleDimTable.csv
\ No newline at end of file
+sudo rm -f dateDimTable.csv salesFactTable.csv sellerDimTable.csv stateDimTable.csv \
+        Vehicle_sales_data.csv vehicleDimTable.csv \
+        dateDimTable.parquet salesFactTable.parquet sellerDimTable.parquet stateDimTable.parquet vehicleDimTable.parquet
+sudo rm -rf checkpoints
+sudo rm -rf benchmark_data
+sudo rm -rf plans
+sudo rm -f query_cache.pkl
+sudo rm -rf downloads
+sudo rm -rf exports
@@ -0,0 +1,75 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from dotenv import load_dotenv
+from metrics import in_current_stage
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# Stages of the pipeline running at the same time at most, 1 runs them one after another
+pipeline_workers = int(os.getenv('PIPELINE_WORKERS') or 4)
+
+# Go on at the pauses of the pipeline without waiting for enter, 1 turns it on
+non_interactive = os.getenv('NON_INTERACTIVE', '0') == '1'
+
+def pause(prompt):
+
+    # Wait for enter before going on, unless the pipeline runs non-interactively
+    if non_interactive:
+        print(prompt.rstrip(': ') + ' (non-interactive, going on)')
+        return
+    input(prompt)
+
+def check_stages(stages):
+
+    # Every dependency has to be a stage of the pipeline
+    unknown = {dependency for function, depends_on in stages.values() for dependency in depends_on} - set(stages)
+    if unknown:
+        raise ValueError(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+def run_pipeline(stages, workers=pipeline_workers):
+
+    # Run the stages of a pipeline, each one as soon as the stages it depends on are done
+    # stages maps a name to (function, names of the stages it depends on), the function is called with the dict
+    # of the outputs of the stages done so far and its return value is the output of its stage
+    # A stage that raises fails, and the stages that depend on it are skipped
+    # Returns the outputs of the stages that ran and the names of the ones that failed or were skipped
+    check_stages(stages)
+    pending = dict(stages)
+    running = {}
+    outputs = {}
+    failed = set()
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        while pending or running:
+
+            # Skip the stages behind a failed one, then start the ones whose dependencies are all done
+            skipped = True
+            while skipped:
+                skipped = False
+                for name, (function, depends_on) in list(pending.items()):
+                    if any(dependency in failed for dependency in depends_on):
+                        print(f"Skipping the {name} stage, a stage it depends on failed")
+                        failed.add(name)
+                        del pending[name]
+                        skipped = True
+                    elif all(dependency in outputs for dependency in depends_on):
+                        running[executor.submit(in_current_stage(function), outputs)] = name
+                        del pending[name]
+
+            # Nothing is running and nothing can start, the remaining stages depend on each other
+            if not running:
+                if pending:
+                    raise ValueError(f"Stages depend on each other: {', '.join(sorted(pending))}")
+                break
+
+            done, not_done = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    outputs[name] = future.result()
+                except Exception as e:
+                    print(f"Error in the {name} stage: {e}")
+                    failed.add(name)
+
+    return outputs, failed
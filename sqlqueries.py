@@ -1,101 +1,268 @@
 # Here are the list of queries to be performed when connected to the PSQL instance
+import os
+from dotenv import load_dotenv
 
-def sql_query_creating_tables():
-    
-    command = '''BEGIN;
+# Load environment variables from the .env file
+load_dotenv()
 
+# quarter partitions salesFactTable by the quarter of its sale date, none keeps it as one table
+# The generated queries of a partitioned salesFactTable filter sale dates on its own saledate column
+fact_partitioning = os.getenv('FACT_PARTITIONING') or 'none'
+partitioned_fact = fact_partitioning == 'quarter'
 
-        CREATE TABLE IF NOT EXISTS public."dateDimTable"
-        (
-            date_id integer NOT NULL,
-            saledate date NOT NULL,
-            saledate_year integer NOT NULL,
-            saledate_month integer NOT NULL,
-            saledate_monthname character varying(20) NOT NULL,
-            saledate_day integer NOT NULL,
-            saledate_weekday integer NOT NULL,
-            saledate_weekdayname character varying(20) NOT NULL,
-            quarter integer NOT NULL,
-            quartername character varying(2) NOT NULL,
-            PRIMARY KEY (date_id)
-        );
+# Columns of each table of the star schema and its primary key, dimension tables first
+TABLE_COLUMNS = {
+    'dateDimTable': ([
+        'date_id integer NOT NULL',
+        'saledate date NOT NULL',
+        'saledate_year integer NOT NULL',
+        'saledate_month integer NOT NULL',
+        'saledate_monthname character varying(20) NOT NULL',
+        'saledate_day integer NOT NULL',
+        'saledate_weekday integer NOT NULL',
+        'saledate_weekdayname character varying(20) NOT NULL',
+        'quarter integer NOT NULL',
+        'quartername character varying(2) NOT NULL',
+    ], 'date_id'),
+    'vehicleDimTable': ([
+        'vehicle_id integer NOT NULL',
+        'year integer NOT NULL',
+        'make character varying(30) NOT NULL',
+        'model character varying(30) NOT NULL',
+        '"trim" character varying(100) NOT NULL',
+        'body character varying(30) NOT NULL',
+        'transmission character varying(30) NOT NULL',
+        'color character varying(30) NOT NULL',
+        'interior character varying(30) NOT NULL',
+    ], 'vehicle_id'),
+    'sellerDimTable': ([
+        'seller_id integer NOT NULL',
+        'seller character varying(50) NOT NULL',
+    ], 'seller_id'),
+    'stateDimTable': ([
+        'state_id integer NOT NULL',
+        'state character varying(5) NOT NULL',
+    ], 'state_id'),
+    'salesFactTable': ([
+        'sale_id integer NOT NULL',
+        'vin character varying(50) NOT NULL',
+        'vehicle_id integer NOT NULL',
+        'state_id integer NOT NULL',
+        'seller_id integer NOT NULL',
+        'mmr numeric(9, 2) NOT NULL',
+        'sellingprice numeric(9, 2) NOT NULL',
+        'odometer integer NOT NULL',
+        'condition integer NOT NULL',
+        'date_id integer NOT NULL',
+    ], 'sale_id'),
+}
 
-        CREATE TABLE IF NOT EXISTS public."vehicleDimTable"
-        (
-            vehicle_id integer NOT NULL,
-            year integer NOT NULL,
-            make character varying(30) NOT NULL,
-            model character varying(30) NOT NULL,
-            "trim" character varying(100) NOT NULL,
-            body character varying(30) NOT NULL,
-            transmission character varying(30) NOT NULL,
-            color character varying(30) NOT NULL,
-            interior character varying(30) NOT NULL,
-            PRIMARY KEY (vehicle_id)
-        );
+# Foreign keys of salesFactTable, as (column, referenced dimension table)
+FACT_FOREIGN_KEYS = [
+    ('vehicle_id', 'vehicleDimTable'),
+    ('state_id', 'stateDimTable'),
+    ('seller_id', 'sellerDimTable'),
+    ('date_id', 'dateDimTable'),
+]
 
-        CREATE TABLE IF NOT EXISTS public."sellerDimTable"
+def sql_creating_table(table_name, unlogged=False, primary_key=True):
+    
+    # CREATE TABLE statement of one table, bulk loads create it unlogged and without its primary key
+    columns, key_column = TABLE_COLUMNS[table_name]
+    definitions = columns + [f'PRIMARY KEY ({key_column})'] if primary_key else columns
+    body = ',\n            '.join(definitions)
+    return f'''CREATE {'UNLOGGED ' if unlogged else ''}TABLE IF NOT EXISTS public."{table_name}"
         (
-            seller_id integer NOT NULL,
-            seller character varying(50) NOT NULL,
-            PRIMARY KEY (seller_id)
-        );
+            {body}
+        );'''
 
-        CREATE TABLE IF NOT EXISTS public."stateDimTable"
-        (
-            state_id integer NOT NULL,
-            state character varying(5) NOT NULL,
-            PRIMARY KEY (state_id)
-        );
+def sql_adding_foreign_key(column, dimension_table, not_valid=True):
+    
+    # Foreign key from salesFactTable to a dimension table, NOT VALID so existing rows are checked separately
+    # A partitioned salesFactTable can not have NOT VALID foreign keys, they are checked when they are added
+    not_valid_clause = '\n            NOT VALID' if not_valid else ''
+    return f'''ALTER TABLE IF EXISTS public."salesFactTable"
+            ADD FOREIGN KEY ({column})
+            REFERENCES public."{dimension_table}" ({column}) MATCH SIMPLE
+            ON UPDATE NO ACTION
+            ON DELETE NO ACTION{not_valid_clause};'''
+
+# Column salesFactTable gets when it is partitioned, the sale date of its date_id copied from dateDimTable
+FACT_PARTITION_COLUMN = 'saledate date NOT NULL'
 
-        CREATE TABLE IF NOT EXISTS public."salesFactTable"
+def sql_creating_partitioned_fact():
+    
+    # salesFactTable partitioned by sale date, the partitions are loaded and attached by the loader
+    # The primary key of a partitioned table must include the partition column
+    # BRIN keeps one summary per block range, it stays small and selective because each partition is loaded sorted
+    columns, key_column = TABLE_COLUMNS['salesFactTable']
+    body = ',\n            '.join(columns + [FACT_PARTITION_COLUMN, f'PRIMARY KEY ({key_column}, saledate)'])
+    return f'''CREATE TABLE IF NOT EXISTS public."salesFactTable"
         (
-            sale_id integer NOT NULL,
-            vin character varying(50) NOT NULL,
-            vehicle_id integer NOT NULL,
-            state_id integer NOT NULL,
-            seller_id integer NOT NULL,
-            mmr numeric(9, 2) NOT NULL,
-            sellingprice numeric(9, 2) NOT NULL,
-            odometer integer NOT NULL,
-            condition integer NOT NULL,
-            date_id integer NOT NULL,
-            PRIMARY KEY (sale_id)
-        );
+            {body}
+        ) PARTITION BY RANGE (saledate);
+        
+        CREATE INDEX IF NOT EXISTS "salesFactTable_saledate_brin" ON public."salesFactTable" USING brin (saledate);'''
 
-        ALTER TABLE IF EXISTS public."salesFactTable"
-            ADD FOREIGN KEY (vehicle_id)
-            REFERENCES public."vehicleDimTable" (vehicle_id) MATCH SIMPLE
-            ON UPDATE NO ACTION
-            ON DELETE NO ACTION
-            NOT VALID;
+def sql_query_creating_tables(partitioned=False, replace=False):
+    
+    # replace drops the tables first, so a full load starts from empty tables
+    statements = [sql_query_dropping_tables()] if replace else []
+    statements = statements + [sql_creating_table(table_name) for table_name in TABLE_COLUMNS
+                               if not (partitioned and table_name == 'salesFactTable')]
+    statements = statements + [sql_creating_partitioned_fact()] if partitioned else statements
+    statements = statements + [sql_adding_foreign_key(column, table_name, not_valid=not partitioned)
+                               for column, table_name in FACT_FOREIGN_KEYS]
+    command = 'BEGIN;\n\n        ' + '\n\n        '.join(statements) + '\n\n        END;'
+        
+    return command
 
+def sql_query_dropping_tables():
+    
+    # Drop the dimension tables and fact table, with the partitions of a partitioned salesFactTable
+    # The rollups see a salesFactTable with a new oid and are built again at their next refresh
+    drops = ', '.join(f'public."{table_name}"' for table_name in TABLE_COLUMNS)
+    return f'DROP TABLE IF EXISTS {drops} CASCADE;'
 
-        ALTER TABLE IF EXISTS public."salesFactTable"
-            ADD FOREIGN KEY (state_id)
-            REFERENCES public."stateDimTable" (state_id) MATCH SIMPLE
-            ON UPDATE NO ACTION
-            ON DELETE NO ACTION
-            NOT VALID;
+def sql_query_creating_unlogged_tables(partitioned=False):
+    
+    # Bulk load, the tables are dropped and created unlogged with no index, so COPY writes neither WAL nor index entries
+    # A partitioned salesFactTable is created with its keys, its partitions are loaded without indexes instead
+    statements = [sql_query_dropping_tables()]
+    statements = statements + [sql_creating_table(table_name, unlogged=True, primary_key=False)
+                               for table_name in bulk_tables(partitioned)]
+    statements = statements + [sql_creating_partitioned_fact()] if partitioned else statements
+    command = 'BEGIN;\n\n        ' + '\n\n        '.join(statements) + '\n\n        END;'
+    return command
 
+def bulk_tables(partitioned=False):
+    
+    # Tables a bulk load creates unlogged and adds the keys to afterwards
+    return [table_name for table_name in TABLE_COLUMNS if not (partitioned and table_name == 'salesFactTable')]
 
-        ALTER TABLE IF EXISTS public."salesFactTable"
-            ADD FOREIGN KEY (seller_id)
-            REFERENCES public."sellerDimTable" (seller_id) MATCH SIMPLE
-            ON UPDATE NO ACTION
-            ON DELETE NO ACTION
-            NOT VALID;
+def sql_query_building_indexes(partitioned=False):
+    
+    # Indexes built after a bulk load, one statement each so they can be built at the same time on several connections
+    # The unique indexes become the primary keys, the others back the foreign keys of salesFactTable
+    commands = [f'CREATE UNIQUE INDEX IF NOT EXISTS "{table_name}_pkey" ON public."{table_name}" '
+                f'({TABLE_COLUMNS[table_name][1]});' for table_name in bulk_tables(partitioned)]
+    if partitioned:
+        return commands
+    commands = commands + [f'CREATE INDEX IF NOT EXISTS "salesFactTable_{column}_idx" ON public."salesFactTable" ({column});'
+                           for column, table_name in FACT_FOREIGN_KEYS]
+    return commands
 
+def sql_query_adding_constraints(partitioned=False):
+    
+    # Primary keys on the indexes built after the bulk load, then the foreign keys, validated against the loaded rows
+    # The foreign keys of a partitioned salesFactTable are added by sql_query_adding_partitioned_foreign_keys instead
+    statements = [f'ALTER TABLE public."{table_name}" ADD CONSTRAINT "{table_name}_pkey" PRIMARY KEY USING INDEX "{table_name}_pkey";'
+                  for table_name in bulk_tables(partitioned)]
+    if partitioned:
+        return '\n'.join(statements)
+    statements = statements + [sql_adding_foreign_key(column, table_name) for column, table_name in FACT_FOREIGN_KEYS]
+    statements = statements + [f'ALTER TABLE public."salesFactTable" VALIDATE CONSTRAINT "salesFactTable_{column}_fkey";'
+                               for column, table_name in FACT_FOREIGN_KEYS]
+    return '\n'.join(statements)
 
-        ALTER TABLE IF EXISTS public."salesFactTable"
-            ADD FOREIGN KEY (date_id)
-            REFERENCES public."dateDimTable" (date_id) MATCH SIMPLE
-            ON UPDATE NO ACTION
-            ON DELETE NO ACTION
-            NOT VALID;
+def sql_query_setting_logged(partitioned=False):
+    
+    # The dimension tables are switched to logged first, a logged table can not reference an unlogged one
+    return '\n'.join(f'ALTER TABLE public."{table_name}" SET LOGGED;' for table_name in bulk_tables(partitioned))
+
+def sql_query_adding_partitioned_foreign_keys():
+    
+    # Foreign keys of a partitioned salesFactTable, added once the dimension tables of a bulk load are logged
+    return '\n'.join(sql_adding_foreign_key(column, table_name, not_valid=False) for column, table_name in FACT_FOREIGN_KEYS)
+
+def sql_query_creating_partition_staging(partition_name):
+    
+    # Unlogged table the sales of one quarter are copied into chunk by chunk, before they are sorted into its partition
+    return f'''DROP TABLE IF EXISTS public."{partition_name}_staging";
+        CREATE UNLOGGED TABLE public."{partition_name}_staging" (LIKE public."salesFactTable");'''
+
+def sql_query_filling_partition_load(partition_name):
+    
+    # Write the staged sales of a quarter sorted by sale date, so the BRIN ranges of its partition stay narrow
+    return f'''INSERT INTO public."{partition_name}_load"
+            SELECT * FROM public."{partition_name}_staging" ORDER BY saledate, sale_id;
+        DROP TABLE public."{partition_name}_staging";'''
+
+def sql_query_creating_partition_load(partition_name, start, end):
+    
+    # Table a partition of salesFactTable is loaded into before it is attached
+    # Its CHECK constraint matches the partition bounds, so ATTACH PARTITION does not scan the rows to check them
+    return f'''DROP TABLE IF EXISTS public."{partition_name}_load";
+        CREATE TABLE public."{partition_name}_load" (LIKE public."salesFactTable" INCLUDING DEFAULTS);
+        ALTER TABLE public."{partition_name}_load" ADD CONSTRAINT "{partition_name}_load_bounds"
+            CHECK (saledate >= DATE '{start}' AND saledate < DATE '{end}');'''
+
+def sql_query_indexing_partition_load(partition_name):
+    
+    # Indexes of the partitioned salesFactTable built on a loaded partition, ATTACH PARTITION uses them as they are
+    # The primary key index of the parent only takes the index of a primary key, not a plain unique index
+    return [f'ALTER TABLE public."{partition_name}_load" ADD CONSTRAINT "{partition_name}_load_pkey" PRIMARY KEY (sale_id, saledate);',
+            f'CREATE INDEX "{partition_name}_load_brin" ON public."{partition_name}_load" USING brin (saledate);']
+
+def sql_query_attaching_partition(partition_name, start, end, replace=False):
+    
+    # Swap a loaded partition in, the partition it replaces is detached and dropped in the same transaction
+    statements = []
+    if replace:
+        statements = [f'ALTER TABLE public."salesFactTable" DETACH PARTITION public."{partition_name}";',
+                      f'DROP TABLE public."{partition_name}";']
+    statements = statements + [
+        f'ALTER TABLE public."{partition_name}_load" RENAME TO "{partition_name}";',
+        f'''ALTER TABLE public."salesFactTable" ATTACH PARTITION public."{partition_name}"
+            FOR VALUES FROM ('{start}') TO ('{end}');''',
+        f'ALTER TABLE public."{partition_name}" DROP CONSTRAINT "{partition_name}_load_bounds";',
+        f'ALTER TABLE public."{partition_name}" RENAME CONSTRAINT "{partition_name}_load_pkey" TO "{partition_name}_pkey";',
+        f'ALTER INDEX public."{partition_name}_load_brin" RENAME TO "{partition_name}_brin";',
+    ]
+    return '\n'.join(statements)
+
+def sql_query_creating_partition(partition_name, start, end):
+    
+    # Empty partition for the sales of an incremental load that fall in a quarter with no partition yet
+    return f'''CREATE TABLE IF NOT EXISTS public."{partition_name}" PARTITION OF public."salesFactTable"
+            FOR VALUES FROM ('{start}') TO ('{end}');'''
+
+def sql_query_analyzing_tables():
+    
+    # Refresh the planner statistics after a load
+    return 'ANALYZE ' + ', '.join(f'public."{table_name}"' for table_name in TABLE_COLUMNS) + ';'
+
+def sql_query_creating_vin_index():
+    
+    command = 'CREATE INDEX IF NOT EXISTS "salesFactTable_vin_idx" ON public."salesFactTable" (vin);'
+    return command
+
+def sql_query_appending_new_sales(partitioned=False):
+    
+    # Appends the staged sales whose vin is not in the fact table yet, sale_id continues after the highest one
+    saledate = ', saledate' if partitioned else ''
+    command = f'''INSERT INTO public."salesFactTable"
+            (sale_id, vin, vehicle_id, state_id, seller_id, mmr, sellingprice, odometer, condition, date_id{saledate})
+        SELECT (SELECT COALESCE(MAX(sale_id), 0) FROM public."salesFactTable") + ROW_NUMBER() OVER (ORDER BY s.sale_id),
+            s.vin, s.vehicle_id, s.state_id, s.seller_id, s.mmr, s.sellingprice, s.odometer, s.condition, s.date_id{saledate.replace(' ', ' s.')}
+        FROM "salesFactStaging" AS s
+        WHERE NOT EXISTS (SELECT 1 FROM public."salesFactTable" AS f WHERE f.vin = s.vin);'''
+    return command
 
-        END;'''
+def sql_query_bumping_data_version():
+    
+    # A single row holding the version of the loaded data, every load replaces it with a new random version
+    # A random version never repeats, not even after the volume is removed and the warehouse starts over
+    command = '''CREATE TABLE IF NOT EXISTS public."warehouseVersionTable"
+        (
+            id integer NOT NULL DEFAULT 1 CHECK (id = 1),
+            data_version character varying(32) NOT NULL,
+            loaded_at timestamp with time zone NOT NULL,
+            PRIMARY KEY (id)
+        );
         
+        INSERT INTO public."warehouseVersionTable" (id, data_version, loaded_at) VALUES (1, %(data_version)s, now())
+        ON CONFLICT (id) DO UPDATE SET data_version = EXCLUDED.data_version, loaded_at = EXCLUDED.loaded_at;'''
     return command
 
 def query_1():
@@ -125,16 +292,276 @@ def query_5():
 
 def query_6():
     
-    query = '''SELECT v.make, COUNT(v.make) AS units_sold FROM "salesFactTable" AS s LEFT JOIN "dateDimTable" AS d 
-            ON s.date_id = d.date_id LEFT JOIN "sellerDimTable" AS sel ON sel.seller_id = s.seller_id LEFT JOIN "stateDimTable" AS st 
-            ON st.state_id = s.state_id LEFT JOIN "vehicleDimTable" AS v ON v.vehicle_id = s.vehicle_id GROUP BY v.make ORDER BY units_sold DESC LIMIT 10;'''         
+    # Only vehicleDimTable is joined, the query is generated from its entry in REPORT_QUERIES
+    query, params = sql_query_star(**REPORT_QUERIES['query_6'])
     return query
 
 def query_7():
     
-    query = '''SELECT d.saledate_year, d.quartername, SUM(s.mmr) AS total_sales FROM "salesFactTable" AS s LEFT JOIN "dateDimTable" AS d 
-            ON s.date_id = d.date_id LEFT JOIN "sellerDimTable" AS sel ON sel.seller_id = s.seller_id LEFT JOIN "stateDimTable" AS st 
-            ON st.state_id = s.state_id LEFT JOIN "vehicleDimTable" AS v ON v.vehicle_id = s.vehicle_id GROUP BY d.saledate_year, d.quartername
-            ORDER BY total_sales DESC;'''         
+    # Only dateDimTable is joined, the query is generated from its entry in REPORT_QUERIES
+    query, params = sql_query_star(**REPORT_QUERIES['query_7'])
     return query
 
+# Alias of each table of the star schema in the generated queries
+TABLE_ALIASES = {
+    'salesFactTable': 's',
+    'dateDimTable': 'd',
+    'vehicleDimTable': 'v',
+    'sellerDimTable': 'sel',
+    'stateDimTable': 'st',
+}
+
+def star_attributes():
+    
+    # Table and column of every attribute of the star schema that a query can group or filter by, keys left out
+    key_columns = [key_column for columns, key_column in TABLE_COLUMNS.values()]
+    attributes = {}
+    for table_name, (columns, key_column) in TABLE_COLUMNS.items():
+        for definition in columns:
+            column = definition.split()[0]
+            if column.strip('"') not in key_columns:
+                attributes[column.strip('"')] = (table_name, f'{TABLE_ALIASES[table_name]}.{column}')
+    return attributes
+
+# Attributes by name, such as make -> (vehicleDimTable, v.make)
+STAR_ATTRIBUTES = star_attributes()
+
+# Measures a query can select, as (aggregate over the fact rows, rollup column it adds up from or None)
+STAR_MEASURES = {
+    'units_sold': ('COUNT(*)', 'units_sold'),
+    'total_sales': ('SUM(s.mmr)', 'total_mmr'),
+    'total_mmr': ('SUM(s.mmr)', 'total_mmr'),
+    'total_sellingprice': ('SUM(s.sellingprice)', 'total_sellingprice'),
+    'avg_mmr': ('AVG(s.mmr)', None),
+    'avg_sellingprice': ('AVG(s.sellingprice)', None),
+    'avg_odometer': ('AVG(s.odometer)', None),
+    'avg_condition': ('AVG(s.condition)', None),
+}
+
+# Operators of the filters, as the sql of the condition around the placeholders of the value
+FILTER_OPERATORS = {
+    '=': '{column} = {0}',
+    '!=': '{column} <> {0}',
+    '<': '{column} < {0}',
+    '<=': '{column} <= {0}',
+    '>': '{column} > {0}',
+    '>=': '{column} >= {0}',
+    'in': '{column} = ANY({0})',
+    'between': '{column} BETWEEN {0} AND {1}',
+    'like': '{column} LIKE {0}',
+}
+
+# Additive measures kept by every rollup, with their column type and how they are computed from the fact rows
+ROLLUP_MEASURES = {
+    'units_sold': ('bigint', 'COUNT(*)'),
+    'total_mmr': ('numeric', 'SUM(s.mmr)'),
+    'total_sellingprice': ('numeric', 'SUM(s.sellingprice)'),
+}
+
+# Summary tables of salesFactTable and the dimension columns they are grouped by
+ROLLUP_TABLES = {
+    'rollupMakeTable': ['make'],
+    'rollupQuarterTable': ['saledate_year', 'quarter', 'quartername'],
+    'rollupMakeQuarterTable': ['make', 'saledate_year', 'quarter', 'quartername'],
+    'rollupStateMonthTable': ['state', 'saledate_year', 'saledate_month'],
+}
+
+# The report queries, as the arguments of sql_query_star
+REPORT_QUERIES = {
+    'query_6': {'measures': ['units_sold'], 'group_by': ['make'], 'order_by': ['units_sold DESC'], 'limit': 10},
+    'query_7': {'measures': ['total_sales'], 'group_by': ['saledate_year', 'quartername'],
+                'order_by': ['total_sales DESC']},
+}
+
+def star_joins(table_names):
+    
+    # Joins from salesFactTable to the given dimension tables, in the order of the foreign keys
+    joins = []
+    for key_column, dimension_table in FACT_FOREIGN_KEYS:
+        if dimension_table in table_names:
+            alias = TABLE_ALIASES[dimension_table]
+            joins.append(f'JOIN public."{dimension_table}" AS {alias} ON {alias}.{key_column} = s.{key_column}')
+    return joins
+
+def filter_condition(column, operator, value, params):
+    
+    # Condition of one filter, its value is passed as parameters named f0, f1, ... in params
+    if operator not in FILTER_OPERATORS:
+        raise ValueError(f"Unknown filter operator {operator}")
+    
+    values = list(value) if operator == 'between' else [list(value) if operator == 'in' else value]
+    placeholders = []
+    for item in values:
+        name = f'f{len(params)}'
+        params[name] = item
+        placeholders.append(f'%({name})s')
+    return FILTER_OPERATORS[operator].format(*placeholders, column=column)
+
+def query_clauses(query, conditions, group_columns, order_by, limit):
+    
+    # WHERE, GROUP BY, ORDER BY and LIMIT of a generated query, the ones that are given
+    if conditions:
+        query = query + f'\n            WHERE {" AND ".join(conditions)}'
+    if group_columns:
+        query = query + f'\n            GROUP BY {", ".join(group_columns)}'
+    if order_by:
+        query = query + f'\n            ORDER BY {", ".join(order_by)}'
+    if limit:
+        query = query + f' LIMIT {int(limit)}'
+    return query + ';'
+
+def sql_query_star(measures, group_by=(), filters=(), order_by=(), limit=None, rollup=False, fact_saledate=None):
+    
+    # Query over salesFactTable that joins only the dimensions whose attributes are grouped by
+    # filters is a list of (attribute, operator, value), a filter on a dimension that is not joined becomes
+    # a filter on the key column of salesFactTable, such as s.state_id IN (SELECT st.state_id ... WHERE st.state = ...)
+    # With rollup=True the query reads a rollup table instead when one can answer it
+    # With fact_saledate=True (a partitioned salesFactTable) filters on saledate use s.saledate, so partitions are pruned
+    # fact_saledate defaults to whether salesFactTable is partitioned (FACT_PARTITIONING=quarter)
+    # Returns the sql and its parameters
+    filters = [tuple(item) for item in filters]
+    unknown = [name for name in measures if name not in STAR_MEASURES] + \
+        [name for name in list(group_by) + [item[0] for item in filters] if name not in STAR_ATTRIBUTES]
+    if unknown:
+        raise ValueError(f"Unknown measures or attributes: {', '.join(unknown)}")
+    
+    if rollup:
+        rollup_query = sql_query_rollup_star(measures, group_by, filters, order_by, limit)
+        if rollup_query is not None:
+            return rollup_query
+    
+    if fact_saledate is None:
+        fact_saledate = partitioned_fact
+    group_columns = [STAR_ATTRIBUTES[attribute][1] for attribute in group_by]
+    joined_tables = {STAR_ATTRIBUTES[attribute][0] for attribute in group_by}
+    
+    params = {}
+    conditions = []
+    key_conditions = {}
+    for attribute, operator, value in filters:
+        table_name, column = STAR_ATTRIBUTES[attribute]
+        if attribute == 'saledate' and fact_saledate:
+            conditions.append(filter_condition('s.saledate', operator, value, params))
+        elif table_name == 'salesFactTable' or table_name in joined_tables:
+            conditions.append(filter_condition(column, operator, value, params))
+        else:
+            key_conditions.setdefault(table_name, []).append(filter_condition(column, operator, value, params))
+    
+    # The filters on each dimension that is not joined select its keys once, in one subquery
+    for key_column, dimension_table in FACT_FOREIGN_KEYS:
+        if dimension_table in key_conditions:
+            alias = TABLE_ALIASES[dimension_table]
+            conditions.append(f's.{key_column} IN (SELECT {alias}.{key_column} FROM public."{dimension_table}" '
+                              f'AS {alias} WHERE {" AND ".join(key_conditions[dimension_table])})')
+    
+    select_columns = group_columns + [f'{STAR_MEASURES[measure][0]} AS {measure}' for measure in measures]
+    query = f'SELECT {", ".join(select_columns)} FROM public."salesFactTable" AS s'
+    for join in star_joins(joined_tables):
+        query = query + f'\n            {join}'
+    return query_clauses(query, conditions, group_columns, order_by, limit), params
+
+def covering_rollup(attributes):
+    
+    # The rollup with the fewest group columns that has every given attribute, None if no rollup has them
+    candidates = [rollup_name for rollup_name, columns in ROLLUP_TABLES.items() if set(attributes) <= set(columns)]
+    return min(candidates, key=lambda rollup_name: len(ROLLUP_TABLES[rollup_name]), default=None)
+
+def sql_query_rollup_star(measures, group_by=(), filters=(), order_by=(), limit=None):
+    
+    # The query of sql_query_star read from a rollup table, the rollup rows are added up again over the group columns
+    # None when a measure does not add up, such as an average, or no rollup has every grouped and filtered attribute
+    if not all(STAR_MEASURES[measure][1] for measure in measures):
+        return None
+    rollup_name = covering_rollup(list(group_by) + [attribute for attribute, operator, value in filters])
+    if rollup_name is None:
+        return None
+    
+    params = {}
+    conditions = [filter_condition(attribute, operator, value, params) for attribute, operator, value in filters]
+    select_columns = list(group_by) + [f'SUM({STAR_MEASURES[measure][1]})::'
+                                       f'{ROLLUP_MEASURES[STAR_MEASURES[measure][1]][0]} AS {measure}'
+                                       for measure in measures]
+    query = f'SELECT {", ".join(select_columns)} FROM public."{rollup_name}"'
+    return query_clauses(query, conditions, list(group_by), order_by, limit), params
+
+def sql_query_rollup_report(report_name):
+    
+    # A report query answered from a rollup table, None if no rollup can answer it
+    rollup_query = sql_query_rollup_star(**REPORT_QUERIES[report_name])
+    return rollup_query[0] if rollup_query is not None else None
+
+def column_definition(column):
+    
+    # Definition of an attribute in its table, such as make character varying(30) NOT NULL
+    columns, key_column = TABLE_COLUMNS[STAR_ATTRIBUTES[column][0]]
+    return next(definition for definition in columns if definition.split()[0].strip('"') == column)
+
+def sql_query_creating_rollups():
+    
+    # The rollup tables, keyed by their group columns so a refresh can add to the existing rows,
+    # and the id of the last sale each rollup has counted
+    statements = ['''CREATE TABLE IF NOT EXISTS public."rollupStateTable"
+        (
+            rollup_name character varying(50) NOT NULL,
+            fact_oid oid NOT NULL,
+            last_sale_id integer NOT NULL,
+            PRIMARY KEY (rollup_name)
+        );''']
+    for rollup_name, group_columns in ROLLUP_TABLES.items():
+        definitions = [column_definition(column) for column in group_columns]
+        definitions = definitions + [f'{measure} {column_type} NOT NULL'
+                                     for measure, (column_type, expression) in ROLLUP_MEASURES.items()]
+        definitions = definitions + [f'PRIMARY KEY ({", ".join(group_columns)})']
+        body = ',\n            '.join(definitions)
+        statements.append(f'''CREATE TABLE IF NOT EXISTS public."{rollup_name}"
+        (
+            {body}
+        );''')
+    return '\n\n        '.join(statements)
+
+def sql_query_refreshing_rollup(rollup_name):
+    
+    # Add the sales with last_sale_id < sale_id <= max_sale_id to a rollup, only the dimensions it groups by are joined
+    group_columns = ROLLUP_TABLES[rollup_name]
+    joins = star_joins({STAR_ATTRIBUTES[column][0] for column in group_columns})
+    
+    select_columns = ', '.join(STAR_ATTRIBUTES[column][1] for column in group_columns)
+    measures = ', '.join(expression for column_type, expression in ROLLUP_MEASURES.values())
+    updates = ', '.join(f'{measure} = r.{measure} + EXCLUDED.{measure}' for measure in ROLLUP_MEASURES)
+    
+    command = f'''INSERT INTO public."{rollup_name}" AS r ({', '.join(group_columns + list(ROLLUP_MEASURES))})
+        SELECT {select_columns}, {measures}
+        FROM public."salesFactTable" AS s {' '.join(joins)}
+        WHERE s.sale_id > %(last_sale_id)s AND s.sale_id <= %(max_sale_id)s
+        GROUP BY {select_columns}
+        ON CONFLICT ({', '.join(group_columns)}) DO UPDATE SET {updates};'''
+    return command
+
+def sql_query_sales_extract(filters=(), fact_saledate=None):
+    
+    # Every sale with the attributes of all its dimensions, one row per sale, for exporting the warehouse as a flat table
+    # filters is a list of (attribute, operator, value) and fact_saledate is as in sql_query_star
+    # Returns the sql and its parameters
+    filters = [tuple(item) for item in filters]
+    unknown = [attribute for attribute, operator, value in filters if attribute not in STAR_ATTRIBUTES]
+    if unknown:
+        raise ValueError(f"Unknown attributes: {', '.join(unknown)}")
+    
+    if fact_saledate is None:
+        fact_saledate = partitioned_fact
+    
+    params = {}
+    conditions = [filter_condition('s.saledate' if attribute == 'saledate' and fact_saledate
+                                   else STAR_ATTRIBUTES[attribute][1], operator, value, params)
+                  for attribute, operator, value in filters]
+    select_columns = ['s.sale_id'] + [column for table_name, column in STAR_ATTRIBUTES.values()]
+    query = f'SELECT {", ".join(select_columns)} FROM public."salesFactTable" AS s'
+    for join in star_joins([dimension_table for key_column, dimension_table in FACT_FOREIGN_KEYS]):
+        query = query + f'\n            {join}'
+    return query_clauses(query, conditions, [], [], None), params
+
+def sql_query_sale_id_range():
+    
+    # Lowest and highest sale_id of salesFactTable, read from its primary key index
+    query = 'SELECT MIN(sale_id), MAX(sale_id) FROM public."salesFactTable";'
+    return query
@@ -0,0 +1,149 @@
+import os
+import pandas as pd
+from dotenv import load_dotenv
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# expanded project directory path
+project_dir = os.path.expanduser('~/dwproject')
+
+# Directory holding the staged files, the project directory unless STAGING_DIR is set
+staging_dir = os.getenv('STAGING_DIR') or project_dir
+
+# Format of the files handed from transform.py to the loader, 'csv' or 'parquet'
+staging_format = os.getenv('STAGING_FORMAT') or 'csv'
+
+# Compression codec of the parquet files
+parquet_compression = 'zstd'
+
+# Column types of each table of the star schema in the parquet files, in the order the columns are written
+STAGING_SCHEMAS = {
+    'dateDimTable': {
+        'saledate': 'date32',
+        'saledate_year': 'int16',
+        'saledate_month': 'int8',
+        'saledate_monthname': 'string',
+        'saledate_day': 'int8',
+        'saledate_weekday': 'int8',
+        'saledate_weekdayname': 'string',
+        'quarter': 'int8',
+        'quartername': 'string',
+        'date_id': 'int64',
+    },
+    'sellerDimTable': {
+        'seller': 'string',
+        'seller_id': 'int64',
+    },
+    'stateDimTable': {
+        'state': 'string',
+        'state_id': 'int64',
+    },
+    'vehicleDimTable': {
+        'year': 'int16',
+        'make': 'string',
+        'model': 'string',
+        'trim': 'string',
+        'body': 'string',
+        'transmission': 'string',
+        'color': 'string',
+        'interior': 'string',
+        'vehicle_id': 'int64',
+    },
+    'salesFactTable': {
+        'vin': 'string',
+        'condition': 'int16',
+        'odometer': 'int32',
+        'mmr': 'float64',
+        'sellingprice': 'float64',
+        'date_id': 'int64',
+        'seller_id': 'int64',
+        'state_id': 'int64',
+        'vehicle_id': 'int64',
+        'sale_id': 'int64',
+    },
+}
+
+def staged_path(table_name, file_format=None):
+
+    # Path of the staged file of a table in the project directory
+    return os.path.join(staging_dir, f'{table_name}.{file_format or staging_format}')
+
+def arrow_schema(table_name):
+
+    # pyarrow is only needed for parquet staging, so it is imported here
+    import pyarrow as pa
+
+    return pa.schema([(column, pa.type_for_alias(type_alias))
+                      for column, type_alias in STAGING_SCHEMAS[table_name].items()])
+
+class TableWriter:
+
+    # Writes a table to its staged file one chunk at a time, the first chunk replaces any existing file
+
+    def __init__(self, table_name, file_format=None):
+
+        self.table_name = table_name
+        self.file_format = file_format or staging_format
+        self.path = staged_path(table_name, self.file_format)
+        self.parquet_writer = None
+        self.first_chunk = True
+
+    def write(self, table):
+
+        if self.file_format == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            # Categorical columns are written as plain strings so every chunk has the same schema
+            schema = arrow_schema(self.table_name)
+            if self.parquet_writer is None:
+                self.parquet_writer = pq.ParquetWriter(self.path, schema, compression=parquet_compression)
+            self.parquet_writer.write_table(pa.Table.from_pandas(table[schema.names], schema=schema,
+                                                                 preserve_index=False))
+        else:
+            table.to_csv(self.path, index=False, mode='w' if self.first_chunk else 'a', header=self.first_chunk)
+
+        self.first_chunk = False
+
+    def close(self):
+
+        if self.parquet_writer is not None:
+            self.parquet_writer.close()
+            self.parquet_writer = None
+        print(f'{os.path.basename(self.path)} created')
+
+def write_table(table, table_name, file_format=None):
+
+    # Write a whole table to its staged file
+    writer = TableWriter(table_name, file_format)
+    writer.write(table)
+    writer.close()
+
+def read_table(table_name, columns=None, file_format=None):
+
+    # Read a staged table into a dataframe, parquet files are memory-mapped and keep their column types
+    # csv files are read as text so the values are passed on exactly as they were written
+    file_format = file_format or staging_format
+    path = staged_path(table_name, file_format)
+
+    if file_format == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+
+    return pd.read_csv(path, usecols=columns, dtype=str, keep_default_na=False)
+
+def read_batches(table_name, batch_rows, columns=None, file_format=None):
+
+    # Yield a staged table as dataframes of at most batch_rows rows, without reading the whole file
+    file_format = file_format or staging_format
+    path = staged_path(table_name, file_format)
+
+    if file_format == 'parquet':
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path, memory_map=True)
+        for batch in parquet_file.iter_batches(batch_size=batch_rows, columns=columns):
+            yield batch.to_pandas()
+        return
+
+    yield from pd.read_csv(path, usecols=columns, dtype=str, keep_default_na=False, chunksize=batch_rows)
@@ -0,0 +1,163 @@
+import numpy as np
+import pandas as pd
+import pytest
+import datagen
+import staging
+import checkpoints
+from transform import fillna_with_mode, read_sales_csv, clean_frame, parallel_clean_frame, CLEANING_RULES, \
+    DIMENSION_TABLES, FACT_COLUMNS, batch_transform, stream_transform, write_tables, split_star_schema, dimension_key
+
+#previous per-group implementation of fillna_with_mode, the vectorized one has to give the same result
+def fillna_with_mode_reference(target_col, reference_col, dataframe):
+
+    #observed=False is the default the previous implementation ran with
+    most_freq = dataframe.groupby(reference_col, observed=False)[target_col] \
+        .agg(lambda x: x.mode()[0] if not x.mode().empty else np.nan)
+    most_freq = most_freq.reset_index(name = 'most_freq')
+
+    merged = pd.merge(dataframe, most_freq, on=reference_col, how='left')
+    dataframe[target_col] = dataframe[target_col].fillna(merged['most_freq'])
+    return dataframe
+
+#frame with a tie in group 'a', an all-missing group 'c', a missing reference value and a group with no missing value
+def sample_frame():
+
+    return pd.DataFrame({
+        'seller': ['a', 'a', 'a', 'a', 'b', 'b', 'b', 'c', 'c', None, 'd', 'd'],
+        'make': ['Kia', 'BMW', 'BMW', None, 'Ford', None, 'Ford', None, None, None, 'Kia', 'Kia'],
+        'odometer': [10.0, 20.0, 10.0, np.nan, 20.0, 30.0, np.nan, np.nan, np.nan, 5.0, 7.0, 8.0],
+        'condition': [2, 2, 3, 3, 1, 4, 4, 5, 5, 1, 2, 2],
+    })
+
+def assert_same_imputation(target_col, reference_col, dataframe):
+
+    expected = fillna_with_mode_reference(target_col, reference_col, dataframe.copy())
+    result = fillna_with_mode(target_col, reference_col, dataframe.copy())
+    assert result[target_col].dtype == expected[target_col].dtype
+    pd.testing.assert_series_equal(result[target_col].astype(object), expected[target_col].astype(object))
+
+def test_object_columns():
+
+    assert_same_imputation('make', 'seller', sample_frame())
+
+def test_numeric_target():
+
+    #'a' has a tie between 10.0 and 20.0, the smallest value is the mode
+    assert_same_imputation('odometer', 'seller', sample_frame())
+
+def test_numeric_reference():
+
+    assert_same_imputation('make', 'condition', sample_frame())
+
+def test_categorical_columns():
+
+    dataframe = sample_frame().astype({'seller': 'category', 'make': 'category'})
+    assert_same_imputation('make', 'seller', dataframe)
+
+def test_categorical_target_numeric_reference():
+
+    dataframe = sample_frame().astype({'make': 'category'})
+    assert_same_imputation('make', 'condition', dataframe)
+
+def test_filtered_frame():
+
+    #rows 0, 4, 8 and 10 are filtered out, so the index is not contiguous and the fills have to follow the labels
+    #'a' fills BMW and the smaller of its tied odometers, 'b' fills Ford and 30.0, 'c' and the missing seller stay missing
+    dataframe = sample_frame().loc[[1, 2, 3, 5, 6, 7, 9, 11]]
+    index = pd.Index([1, 2, 3, 5, 6, 7, 9, 11])
+
+    result = fillna_with_mode('make', 'seller', dataframe.copy())
+    expected = pd.Series(['BMW', 'BMW', 'BMW', 'Ford', 'Ford', np.nan, np.nan, 'Kia'], index=index, name='make')
+    pd.testing.assert_series_equal(result['make'], expected)
+
+    result = fillna_with_mode('odometer', 'seller', dataframe.copy())
+    expected = pd.Series([20.0, 10.0, 10.0, 30.0, 30.0, np.nan, 5.0, 8.0], index=index, name='odometer')
+    pd.testing.assert_series_equal(result['odometer'], expected)
+
+    result = fillna_with_mode('make', 'seller', dataframe.astype({'seller': 'category', 'make': 'category'}))
+    expected = pd.Series(['BMW', 'BMW', 'BMW', 'Ford', 'Ford', np.nan, np.nan, 'Kia'], index=index, name='make')
+    pd.testing.assert_series_equal(result['make'].astype(object), expected)
+
+    #the mask is by position, with the BMW rows of 'a' (labels 1 and 2) left out its Kia row is the only one counted
+    dataframe = sample_frame().loc[[0, 1, 2, 3, 5, 6, 7, 9]]
+    mask = np.array([True, False, False, True, True, True, True, True])
+    result = fillna_with_mode('make', 'seller', dataframe, mask=mask)
+    assert result.loc[3, 'make'] == 'Kia'
+    assert result.loc[6, 'make'] == 'Ford'
+
+#csv file of synthetic sales with the dirty values the cleaning handles, generated once for the tests that read one
+@pytest.fixture(scope='module')
+def sales_csv(tmp_path_factory):
+
+    path = tmp_path_factory.mktemp('sales') / 'sales.csv'
+    datagen.generate_sales(20000, path, seed=1)
+    return path
+
+def test_parallel_clean_frame(sales_csv):
+
+    #every third row is dropped, so the index has gaps as in a filtered frame
+    df = read_sales_csv(sales_csv)
+    df = df[df.index % 3 != 1]
+
+    expected = clean_frame(df.copy())
+    result = parallel_clean_frame(df.copy(), 2)
+    pd.testing.assert_frame_equal(result['sales'], expected['sales'])
+    assert {rule: result['dropped'].get(rule, 0) for rule in CLEANING_RULES} == \
+        {rule: expected['dropped'].get(rule, 0) for rule in CLEANING_RULES}
+    assert result['start_length'] == expected['start_length']
+    assert result['calendar'] == expected['calendar']
+
+def test_stream_transform(sales_csv, tmp_path, monkeypatch):
+
+    #the streaming mode writes the same staged files as the in-memory run, the chunks are small enough that
+    #their categories differ from chunk to chunk
+    monkeypatch.setattr(checkpoints, 'use_checkpoints', False)
+    monkeypatch.setattr(staging, 'staging_format', 'csv')
+
+    monkeypatch.setattr(staging, 'staging_dir', str(tmp_path / 'batch'))
+    (tmp_path / 'batch').mkdir()
+    write_tables(batch_transform(sales_csv))
+
+    monkeypatch.setattr(staging, 'staging_dir', str(tmp_path / 'stream'))
+    (tmp_path / 'stream').mkdir()
+    stream_transform(sales_csv, 3000)
+
+    for table_name in list(DIMENSION_TABLES) + ['salesFactTable']:
+        assert (tmp_path / 'stream' / f'{table_name}.csv').read_bytes() == \
+            (tmp_path / 'batch' / f'{table_name}.csv').read_bytes(), table_name
+
+#previous merge-based split_star_schema, the members of each dimension numbered in order of first appearance
+#and the fact rows given their ids by a left merge on the key columns
+def split_star_schema_reference(df):
+
+    tables = {}
+    salesFactTable = df.copy()
+    for table_name, (columns, id_col) in DIMENSION_TABLES.items():
+        key_columns = dimension_key(table_name)
+        dimTable = df[key_columns].drop_duplicates().reset_index(drop=True)
+        dimTable[id_col] = np.arange(1, len(dimTable) + 1)
+        tables[table_name] = dimTable
+        salesFactTable = salesFactTable.merge(dimTable, on=key_columns, how='left')
+
+    id_cols = [id_col for columns, id_col in DIMENSION_TABLES.values()]
+    tables['salesFactTable'] = salesFactTable[FACT_COLUMNS + id_cols]
+    return tables
+
+def test_split_star_schema_ids(sales_csv):
+
+    #the cleaned frame keeps the index labels of the rows read, so it has gaps
+    #no rule drops a missing interior, some are blanked so the vehicle key has missing values
+    df = clean_frame(read_sales_csv(sales_csv))['sales']
+    df.loc[df.index[::50], 'interior'] = np.nan
+    expected = split_star_schema_reference(df)
+    tables = split_star_schema(df)
+
+    for table_name, (columns, id_col) in DIMENSION_TABLES.items():
+        key_columns = dimension_key(table_name) + [id_col]
+        pd.testing.assert_frame_equal(tables[table_name][key_columns].astype(object),
+                                      expected[table_name][key_columns].astype(object))
+
+    id_cols = [id_col for columns, id_col in DIMENSION_TABLES.values()]
+    np.testing.assert_array_equal(tables['salesFactTable'][id_cols].to_numpy(),
+                                  expected['salesFactTable'][id_cols].to_numpy())
+    np.testing.assert_array_equal(tables['salesFactTable']['sale_id'].to_numpy(), np.arange(1, len(df) + 1))
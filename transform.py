@@ -1,184 +1,906 @@
+import os
 import pandas as pd
 import numpy as np
+from pandas.api.types import union_categoricals
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from dotenv import load_dotenv
+from staging import TableWriter, write_table
+from checkpoints import file_hash, stage_key, load_checkpoint, run_stage
+from importdata import open_dataset, dataset_path
+from metrics import stage
+
+# Load environment variables from the .env file
+load_dotenv()
+
+# expanded project directory path
+project_dir = os.path.expanduser('~/dwproject')
+
+#rows read at a time in streaming mode, 0 reads the whole csv file into memory
+chunksize = int(os.getenv('TRANSFORM_CHUNKSIZE') or 0)
+
+#write the tables of the in-memory run to staged files as well, the loader copies them from memory either way
+write_csv_artifacts = os.getenv('WRITE_CSV_ARTIFACTS', '0') == '1'
+
+#csv parser used for the in-memory read, 'c' or 'pyarrow'
+csv_engine = os.getenv('TRANSFORM_ENGINE') or 'c'
+
+#rows of dateDimTable, 'observed' keeps the sale dates in order of first appearance,
+#'calendar' has every day from the first to the last sale date of the csv file in date order
+date_dimension = os.getenv('DATE_DIMENSION') or 'observed'
+
+#processes the in-memory cleaning runs on, 0 or 1 cleans the rows in this process
+transform_workers = int(os.getenv('TRANSFORM_WORKERS') or 0)
+
+#dtypes of the columns read from the csv file, other columns are skipped
+#the low-cardinality text columns are read as categoricals so the groupbys and drop_duplicates run on integer codes
+SALES_DTYPES = {
+    'year': 'int16',
+    'make': 'category',
+    'model': 'category',
+    'trim': 'category',
+    'body': 'category',
+    'transmission': 'category',
+    'vin': 'string',
+    'state': 'category',
+    'condition': 'float64',
+    'odometer': 'float64',
+    'color': 'category',
+    'interior': 'category',
+    'seller': 'category',
+    'mmr': 'float64',
+    'sellingprice': 'float64',
+    'saledate': 'category',
+}
+
+#columns of each dimension table, in the order they are written to the csv files, and their id column
+DIMENSION_TABLES = {
+    'dateDimTable': (['saledate', 'saledate_year', 'saledate_month', 'saledate_monthname', 'saledate_day',
+                      'saledate_weekday', 'saledate_weekdayname', 'quarter', 'quartername'], 'date_id'),
+    'sellerDimTable': (['seller'], 'seller_id'),
+    'stateDimTable': (['state'], 'state_id'),
+    'vehicleDimTable': (['year', 'make', 'model', 'trim', 'body', 'transmission', 'color', 'interior'], 'vehicle_id'),
+}
+
+#columns of the fact table that are not foreign keys
+FACT_COLUMNS = ['vin', 'condition', 'odometer', 'mmr', 'sellingprice']
+
+#function to return the mode of the target column for each value of the reference column
+#counts every (reference, target) pair once and keeps the most frequent target per reference,
+#ties go to the smallest value, the same as Series.mode()[0]
+#weights names a column holding how many rows each row stands for, used on pre-aggregated counts
+def group_modes(target_col, reference_col, dataframe, weights=None):
+    
+    #observed=True keeps categorical columns from expanding into every pair of categories
+    grouped = dataframe.groupby([reference_col, target_col], observed=True)
+    counts = grouped.size() if weights is None else grouped[weights].sum()
+    counts = counts.reset_index(name='count')
+    counts = counts.sort_values(['count', target_col], ascending=[False, True])
+    most_freq = counts.drop_duplicates(subset=reference_col)
+    #plain object values, Series.map with categorical lookup values mixes up the categories
+    return pd.Series(most_freq[target_col].astype(object).values, index=most_freq[reference_col].astype(object).values)
+
+#function to fill the missing values of the target column with the mode of their reference value
+#only the rows with a missing value are looked up, categorical columns get any new values as categories
+def fillna_from_modes(target_col, reference_col, most_freq, dataframe):
+    
+    missing = dataframe[target_col].isnull()
+    if not missing.any():
+        return dataframe
+    
+    values = dataframe.loc[missing, reference_col].map(most_freq).astype(object)
+    target = dataframe[target_col]
+    if isinstance(target.dtype, pd.CategoricalDtype):
+        new_categories = pd.Index(values.dropna().unique()).difference(target.cat.categories)
+        target = target.cat.add_categories(new_categories)
+        #the filled rows take the codes of their values, setting the values checks each one against the categories
+        codes = target.cat.codes.to_numpy().copy()
+        codes[missing.to_numpy()] = target.cat.categories.get_indexer(values)
+        target = pd.Series(pd.Categorical.from_codes(codes, dtype=target.dtype), index=target.index, name=target_col)
+    else:
+        #the looked up values are objects, they are cast back so a numeric column keeps its dtype
+        target = target.copy()
+        target[missing] = values.astype(target.dtype)
+    dataframe[target_col] = target
+    return dataframe
 
 #function to return a df where missing values are imputed using the mode based on a relevant column
-def fillna_with_mode(target_col, reference_col, dataframe):
+#mask selects the rows the modes are counted over, the rows that are still kept, all rows when it is None
+def fillna_with_mode(target_col, reference_col, dataframe, weights=None, mask=None):
+    
+    #nothing to impute, skip counting the groups
+    if not dataframe[target_col].isnull().any():
+        return dataframe
     
-    most_freq = dataframe.groupby(reference_col)[target_col] \
-        .agg(lambda x: x.mode()[0] if not x.mode().empty else np.nan)
-    most_freq = most_freq.reset_index(name = 'most_freq')
+    counted = dataframe if mask is None else dataframe.loc[mask, [reference_col, target_col]]
+    most_freq = group_modes(target_col, reference_col, counted, weights)
+    return fillna_from_modes(target_col, reference_col, most_freq, dataframe)
+
+#order in which the vehicle columns are imputed, as (target column, reference column)
+#make by seller, model by make, then trim, body and transmission by model
+IMPUTATION_CASCADE = [
+    ('make', 'seller'),
+    ('model', 'make'),
+    ('trim', 'model'),
+    ('body', 'model'),
+    ('transmission', 'model'),
+]
+
+#rules a row has to pass to be kept, in the order they are checked, as (column, check, argument)
+#'first' keeps the first row of each value, 'notnull' drops missing values,
+#'length' compares the length of the text with (operator, length), a missing value fails it
+CLEANING_RULES = {
+    'duplicate_vin': ('vin', 'first', None),
+    'missing_make': ('make', 'notnull', None),
+    'missing_model': ('model', 'notnull', None),
+    'missing_trim': ('trim', 'notnull', None),
+    'missing_body': ('body', 'notnull', None),
+    'missing_transmission': ('transmission', 'notnull', None),
+    'invalid_state': ('state', 'length', ('==', 2)),
+    'missing_odometer': ('odometer', 'notnull', None),
+    'missing_color': ('color', 'notnull', None),
+    #incorrect colors such as '-' and 2-letter words or less
+    'short_color': ('color', 'length', ('>=', 3)),
+    'missing_mmr': ('mmr', 'notnull', None),
+}
+
+#rules checked once the condition column is filled, rows with missing odometer, color and mmr values
+INCOMPLETE_RULES = ['missing_odometer', 'missing_color', 'short_color', 'missing_mmr']
+
+#comparisons of the 'length' rules
+LENGTH_OPERATORS = {
+    '==': np.equal,
+    '!=': np.not_equal,
+    '<': np.less,
+    '<=': np.less_equal,
+    '>': np.greater,
+    '>=': np.greater_equal,
+}
+
+#function to return the mask of the rows of a dataframe that pass a rule
+#the length of a categorical column is computed once per category and looked up by the codes of the rows
+def rule_mask(dataframe, rule_name):
     
-    merged = pd.merge(dataframe, most_freq, on=reference_col, how='left')
-    dataframe[target_col] = dataframe[target_col].fillna(merged['most_freq'])
+    column, check, argument = CLEANING_RULES[rule_name]
+    values = dataframe[column]
+    if check == 'first':
+        return ~values.duplicated().to_numpy()
+    if check == 'notnull':
+        return values.notnull().to_numpy()
+    
+    operator, length = argument
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        passes = LENGTH_OPERATORS[operator](values.cat.categories.str.len().to_numpy(), length)
+        #code -1 is a missing value, it takes the last entry
+        return np.append(passes, False)[values.cat.codes.to_numpy()]
+    return LENGTH_OPERATORS[operator](values.str.len(), length).fillna(False).to_numpy(dtype=bool)
+
+#function to start filtering a dataframe, every row is kept until it fails a rule
+#dropped counts the rows dropped by each rule, pass the counts of earlier chunks to add to them
+def row_filter(dataframe, dropped=None):
+    
+    return {'keep': np.ones(len(dataframe), dtype=bool), 'dropped': {} if dropped is None else dropped}
+
+#function to check the rows of a dataframe against the named rules and update the mask of the kept rows
+#a row is counted as dropped by the first rule it fails, the dataframe is returned as it is
+def check_rules(dataframe, rows, rule_names):
+    
+    for rule_name in rule_names:
+        passes = rule_mask(dataframe, rule_name)
+        rows['dropped'][rule_name] = rows['dropped'].get(rule_name, 0) + int(np.count_nonzero(rows['keep'] & ~passes))
+        rows['keep'] = rows['keep'] & passes
+    return dataframe
+
+#function to return the rows of a dataframe that passed every rule so far, taken by their positions in one copy
+def kept_rows(dataframe, rows):
+    
+    return dataframe.take(np.flatnonzero(rows['keep']))
+
+#function to run the mode imputation cascade, rows that still have no value after each step fail its missing rule
+#the modes of each step are counted over the rows that are still kept
+def impute_cascade(dataframe, rows, cascade=IMPUTATION_CASCADE):
+    
+    for target_col, reference_col in cascade:
+        dataframe = fillna_with_mode(target_col, reference_col, dataframe, mask=rows['keep'])
+        dataframe = check_rules(dataframe, rows, [f'missing_{target_col}'])
     return dataframe
 
 #function to impute missing values in the target column with the mean value of the target column
-def fillna_with_mean(target_col, dataframe):
+#mask selects the rows the mean is taken over, all rows when it is None
+def fillna_with_mean(target_col, dataframe, mask=None):
     
-    mean_value = int(dataframe[target_col].mean())
+    values = dataframe[target_col] if mask is None else dataframe.loc[mask, target_col]
+    mean_value = int(values.mean())
     dataframe[target_col] = dataframe[target_col].fillna(mean_value)
     return dataframe
 
-def generate_weekday(dataframe):
-    weekday_map = {'Mon':1, 'Tue':2, 'Wed':3, 'Thu':4, 'Fri':5, 'Sat':6, 'Sun':7}
-    dataframe['saledate_weekday'] = dataframe['saledate_weekdayname'].map(weekday_map)
+#function to print how many rows each cleaning rule dropped
+def print_dropped(dropped):
+    
+    print('Dropped Rows by Rule:')
+    for rule_name in CLEANING_RULES:
+        print(f'{rule_name}: {dropped.get(rule_name, 0)}')
+
+#format of the date part of the raw saledate strings, 'Tue Dec 16 2014 12:30:00 GMT-0800 (PST)'[4:15] is 'Dec 16 2014'
+SALEDATE_FORMAT = '%b %d %Y'
+
+#dates of the raw saledate strings parsed so far, shared by every chunk of a run
+saledate_cache = {}
+
+#function to parse the raw saledate strings, each distinct string is parsed once and the rows take their date by lookup
+def parse_saledates(raw):
+    
+    raw = raw.astype('category')
+    categories = raw.cat.categories
+    
+    #parse only the strings no earlier chunk has seen
+    new_values = categories[~categories.isin(list(saledate_cache))]
+    if len(new_values):
+        new_dates = pd.to_datetime(new_values.str[4:15], format=SALEDATE_FORMAT)
+        saledate_cache.update(zip(new_values, new_dates))
+    
+    dates = pd.DatetimeIndex([saledate_cache[value] for value in categories]).values
+    codes = raw.cat.codes.to_numpy()
+    return pd.Series(np.where(codes >= 0, dates[codes], np.datetime64('NaT')), index=raw.index, dtype='datetime64[ns]')
+
+#function to return the first and last date of the raw saledate strings
+#the range covers every category, so rows dropped from a categorical column still count
+def saledate_range(raw):
+    
+    dates = parse_saledates(pd.Series(raw.astype('category').cat.categories)).dropna()
+    return dates.min(), dates.max()
+
+#function to build the rows of dateDimTable for the given dates, the date parts are derived once per date
+def calendar_table(dates):
+    
+    dates = pd.DatetimeIndex(dates)
+    calendar = pd.DataFrame({'saledate': dates})
+    calendar['saledate_year'] = dates.year.astype('int16')
+    calendar['saledate_month'] = dates.month.astype('int8')
+    calendar['saledate_monthname'] = dates.month_name()
+    calendar['saledate_day'] = dates.day.astype('int8')
+    #Mon = 1, Tue = 2, etc.
+    calendar['saledate_weekday'] = (dates.dayofweek + 1).astype('int8')
+    calendar['saledate_weekdayname'] = dates.day_name().str[0:3]
+    calendar['quarter'] = dates.quarter.astype('int8')
+    calendar['quartername'] = 'Q' + calendar['quarter'].astype(str)
+    return calendar
+
+#function to build dateDimTable as every day from start to end, date_id counts the days from start
+def calendar_range(start, end):
+    
+    calendar = calendar_table(pd.date_range(start, end, freq='D'))
+    calendar['date_id'] = np.arange(1, len(calendar) + 1)
+    return calendar
+
+#function to return the date_id of each date in a dateDimTable from calendar_range
+def calendar_ids(dates, start):
+    
+    return (dates.to_numpy() - np.datetime64(start, 'D')) // np.timedelta64(1, 'D') + 1
+
+#function to cast correct data types for each columns
+#text columns stay categorical and integers use the smallest type that holds their values
+def cast_types(dataframe):
+    
+    dataframe['year'] = dataframe['year'].astype('int16')
+    dataframe['make'] = dataframe['make'].astype('category')
+    dataframe['model'] = dataframe['model'].astype('category')
+    dataframe['trim'] = dataframe['trim'].astype('category')
+    dataframe['body'] = dataframe['body'].astype('category')
+    dataframe['transmission'] = dataframe['transmission'].astype('category')
+    dataframe['vin'] = dataframe['vin'].astype('string')
+    dataframe['state'] = dataframe['state'].astype('category')
+    dataframe['condition'] = dataframe['condition'].astype('int16')
+    dataframe['odometer'] = dataframe['odometer'].astype('int32')
+    dataframe['color'] = dataframe['color'].astype('category')
+    dataframe['interior'] = dataframe['interior'].astype('category')
+    dataframe['seller'] = dataframe['seller'].astype('category')
+    dataframe['mmr'] = dataframe['mmr'].astype(float)
+    dataframe['sellingprice'] = dataframe['sellingprice'].astype(float)
+    dataframe['saledate'] = parse_saledates(dataframe['saledate'])
+    return dataframe
+
+#function to return the memory used by a dataframe in MB, including the text held by object columns
+def memory_mb(dataframe):
+    
+    return dataframe.memory_usage(deep=True).sum() / 2**20
+
+#function to read the csv file with the ingestion dtypes, in chunks when chunksize is given
+#csv_path is a csv file or a zip archive, whose csv member is read straight out of the archive
+def read_sales_csv(csv_path, chunksize=None, usecols=None):
+    
+    usecols = usecols or list(SALES_DTYPES)
+    dtype = {column: SALES_DTYPES[column] for column in usecols}
+    
+    #the pyarrow parser reads the whole file at once, chunks always use the c parser
+    if chunksize:
+        return read_sales_chunks(csv_path, chunksize, usecols, dtype)
+    with open_dataset(csv_path) as f:
+        return pd.read_csv(f, usecols=usecols, dtype=dtype, engine=csv_engine)
+
+#function to yield the csv file in chunks, the file stays open until the last chunk is read
+def read_sales_chunks(csv_path, chunksize, usecols, dtype):
+    
+    with open_dataset(csv_path) as f:
+        yield from pd.read_csv(f, usecols=usecols, dtype=dtype, chunksize=chunksize)
+
+#function to print how many rows the transformation dropped
+#start_memory and end_memory are the MB held by the dataframe when read and when transformed, if known
+#dropped is the number of rows each cleaning rule dropped, if known
+def print_summary(start_length, end_length, start_memory=None, end_memory=None, dropped=None):
+    
+    difference = start_length - end_length
+    
+    print('Dataframe Summary')
+    print(f'Before Transformation: {start_length}')
+    print(f'After Transformation: {end_length}')
+    print(f'Dropped Rows: {difference} ({(difference/start_length)*100:.2f}%)')
+    if dropped is not None:
+        print_dropped(dropped)
+    if start_memory is not None:
+        print(f'Memory Before Transformation: {start_memory:.2f} MB')
+        print(f'Memory After Transformation: {end_memory:.2f} MB')
+
+#function to return the columns that identify a member of a dimension, saledate alone identifies a row of dateDimTable
+def dimension_key(table_name):
+    
+    columns, id_col = DIMENSION_TABLES[table_name]
+    return ['saledate'] if table_name == 'dateDimTable' else columns
+
+#function to number the members of a dimension in one hash pass over the rows
+#returns the member number of each row, counted from 0 in order of first appearance, and the row where each member first appears
+def factorize_members(dataframe, key_columns):
+    
+    if len(key_columns) == 1:
+        codes = pd.factorize(dataframe[key_columns[0]], use_na_sentinel=False)[0]
+    else:
+        codes = dataframe.groupby(key_columns, dropna=False, sort=False, observed=True).ngroup().to_numpy()
+    
+    #renumber the members in order of first appearance, the groupby numbering is not guaranteed to follow it
+    first_pos = np.flatnonzero(~pd.Series(codes).duplicated().to_numpy())
+    rank = np.empty(len(first_pos), dtype=np.int64)
+    rank[codes[first_pos]] = np.arange(len(first_pos))
+    return rank[codes], first_pos
+
+#function to return the rows of a dimension table for the members that first appear at first_pos
+#dateDimTable rows are built from their dates, the other dimensions copy their columns
+def dimension_members(dataframe, table_name, first_pos):
+    
+    columns, id_col = DIMENSION_TABLES[table_name]
+    if table_name == 'dateDimTable':
+        return calendar_table(dataframe['saledate'].iloc[first_pos])
+    return dataframe[columns].iloc[first_pos].reset_index(drop=True)
+
+#function to make different dataframes that will correspond to the diffrent tables in the star schema
+#each dimension and the foreign keys of the fact rows come from one factorize pass, without merging the frame
+#calendar is the (first, last) sale date when dateDimTable is a calendar range
+def split_star_schema(df, calendar=None):
+    
+    tables = {}
+    salesFactTable = df[FACT_COLUMNS].reset_index(drop=True)
+    
+    #dimension tables, ids follow the order in which each member first appears
+    for table_name, (columns, id_col) in DIMENSION_TABLES.items():
+        if table_name == 'dateDimTable' and calendar is not None:
+            tables[table_name] = calendar_range(*calendar)
+            salesFactTable[id_col] = calendar_ids(df['saledate'], calendar[0])
+            continue
+        codes, first_pos = factorize_members(df, dimension_key(table_name))
+        dimTable = dimension_members(df, table_name, first_pos)
+        dimTable[id_col] = np.arange(1, len(dimTable) + 1)
+        tables[table_name] = dimTable
+        salesFactTable[id_col] = codes + 1
+    
+    salesFactTable['sale_id'] = np.arange(1, len(salesFactTable) + 1)
+    tables['salesFactTable'] = salesFactTable
+    
+    return tables
+
+#function to save each table of the star schema as a staged file in the project directory, csv or parquet
+def write_tables(tables):
+    
+    print('Staging the dimension tables and fact table')
+    
+    for table_name, table in tables.items():
+        with stage(f'stage_{table_name}', rows_in=len(table)) as record:
+            write_table(table, table_name)
+            record['rows_out'] = len(table)
+
+#function to run one step of the cleaning on the dataframe and record its time, memory and rows in and out
+#rows is the filter of a step that only checks rules, its rows are the ones still kept rather than the whole frame
+def measured_step(name, function, dataframe, rows=None):
+    
+    count = len if rows is None else lambda dataframe: int(np.count_nonzero(rows['keep']))
+    with stage(name, rows_in=count(dataframe)) as record:
+        dataframe = function(dataframe)
+        record['rows_out'] = count(dataframe)
+    return dataframe
+
+#function to read the csv file and clean it in memory
+def clean_sales(csv_path):
+    
+    #read the csv file into a pandas dataframe
+    with stage('read') as record:
+        df = read_sales_csv(csv_path)
+        record['rows_out'] = len(df)
+    if transform_workers > 1:
+        return parallel_clean_frame(df, transform_workers)
+    return clean_frame(df)
+
+#function to clean the rows read from the csv file
+#returns the cleaned rows with the row count and memory of the frame as read and its (first, last) sale date
+def clean_frame(df):
+    
+    #get initial length and memory usage of df
+    start_length = len(df)
+    start_memory = memory_mb(df)
+    calendar = saledate_range(df['saledate'])
+    
+    #every row is kept until it fails one of CLEANING_RULES, the frame is filtered once after the last rule
+    rows = row_filter(df)
+    
+    #drop rows that corresponds to duplicates in the vin column
+    df = measured_step('drop_duplicate_vins', lambda dataframe: check_rules(dataframe, rows, ['duplicate_vin']), df, rows)
+    
+    #fill missing make, model, trim, body and transmission values using the mode of their reference column
+    df = measured_step('impute_cascade', lambda dataframe: impute_cascade(dataframe, rows), df, rows)
+    
+    #drop state values where length of input is more than 2
+    df = measured_step('drop_invalid_states', lambda dataframe: check_rules(dataframe, rows, ['invalid_state']), df, rows)
+    
+    #fill missing values in the condition column with the mean value of the condition column over the rows kept so far
+    df = measured_step('fillna_condition', lambda dataframe: fillna_with_mean('condition', dataframe, rows['keep']),
+                       df, rows)
+    
+    #drop rows with missing odometer, color and mmr values
+    df = measured_step('drop_incomplete_rows', lambda dataframe: check_rules(dataframe, rows, INCOMPLETE_RULES), df, rows)
+    
+    df = measured_step('filter_rows', lambda dataframe: kept_rows(dataframe, rows), df)
+    df = measured_step('cast_types', cast_types, df)
+    
+    return {'sales': df, 'start_length': start_length, 'start_memory': start_memory, 'calendar': calendar,
+            'dropped': rows['dropped']}
+
+#function to print the summary of the cleaned rows
+def print_cleaned(cleaned):
+    
+    df = cleaned['sales']
+    print_summary(cleaned['start_length'], len(df), cleaned['start_memory'], memory_mb(df), cleaned['dropped'])
+    print('Data types for each column:')
+    print(df.dtypes)
+    print('Are there null values in each column?')
+    print(df.isnull().any())
+    print('Printing top 5 rows')
+    print(df.head())
+
+#hash of this file, part of every checkpoint key so a change to the transformation recomputes its stages
+code_version = file_hash(__file__)
+
+#function to transform the whole csv file in memory and return the tables of the star schema
+#the clean and dimension build stages are loaded from their checkpoints when the csv file and parameters are unchanged
+#the tables are written to staged files only when WRITE_CSV_ARTIFACTS=1
+def batch_transform(csv_path):
+    
+    clean_inputs = [file_hash(csv_path)]
+    clean_params = {'code_version': code_version, 'cascade': IMPUTATION_CASCADE}
+    dimension_params = {'code_version': code_version, 'date_dimension': date_dimension}
+    
+    #the keys only depend on the csv file and the parameters, so the dimensions checkpoint is looked up first
+    #and the cleaned rows are only loaded or computed when it misses
+    clean_key = stage_key('clean', clean_inputs, clean_params)
+    tables = load_checkpoint('dimensions', stage_key('dimensions', [clean_key], dimension_params))
+    if tables is None:
+        with stage('clean') as record:
+            cleaned = run_stage('clean', clean_inputs, clean_params, lambda: clean_sales(csv_path))[0]
+            record['rows_in'] = cleaned['start_length']
+            record['rows_out'] = len(cleaned['sales'])
+        print_cleaned(cleaned)
+    
+        calendar = cleaned['calendar'] if date_dimension == 'calendar' else None
+        with stage('dimensions', rows_in=len(cleaned['sales'])) as record:
+            tables = run_stage('dimensions', [clean_key], dimension_params,
+                               lambda: split_star_schema(cleaned['sales'], calendar))[0]
+            record['rows_out'] = len(tables['salesFactTable'])
+    
+    if write_csv_artifacts:
+        write_tables(tables)
+    return tables
+
+#columns the streaming mode needs in its first pass
+PROFILE_COLUMNS = ['vin', 'seller', 'make', 'model', 'trim', 'body', 'transmission', 'state', 'condition']
+
+#key columns of the two tables of the row profile
+#'pairs' counts each (seller, make) pair, the modes of the first imputation step
+#'vehicles' counts the rows per vehicle and valid state, seller is only kept on the rows with a missing make,
+#so the number of groups does not grow with sellers times vehicles
+PROFILE_KEYS = {
+    'pairs': ['seller', 'make'],
+    'vehicles': ['seller', 'make', 'model', 'trim', 'body', 'transmission', 'state_ok'],
+}
+
+#function to flag the first occurrence of each vin across chunks
+#seen is a sorted array of the 64-bit hashes of the vins kept so far, returned updated with this chunk
+#the new hashes are sorted and inserted at their positions, so seen is never sorted again as a whole,
+#and looking them up in sorted order reads seen from front to back instead of at random
+#repeats within a chunk are found on the vins themselves, repeats of earlier chunks on their hashes only, so the
+#result matches the in-memory drop_duplicates unless two different vins share a hash, which for n vins happens
+#with a probability of about n**2 / 2**65 (around 1e-6 for 6 million vins)
+def first_vins(vins, seen):
+    
+    hashes = pd.util.hash_pandas_object(vins, index=False).to_numpy()
+    keep = ~vins.duplicated().to_numpy()
+    
+    rows = np.flatnonzero(keep)
+    order = np.argsort(hashes[rows])
+    rows, new = rows[order], hashes[rows][order]
+    pos = np.searchsorted(seen, new)
+    found = seen[np.minimum(pos, len(seen) - 1)] == new if len(seen) else np.zeros(len(new), dtype=bool)
+    keep[rows[found]] = False
+    return keep, np.insert(seen, pos[~found], new[~found])
+
+#function to read the csv file in chunks, keeping only the first row of each vin
+def read_unique_vins(csv_path, chunksize, usecols=None):
+    
+    seen = np.empty(0, dtype=np.uint64)
+    for chunk in read_sales_csv(csv_path, chunksize, usecols):
+        keep, seen = first_vins(chunk['vin'], seen)
+        yield len(chunk), chunk[keep].copy()
+
+#function to collapse the rows of a chunk into the row profile, counts per imputation group with the sum and count
+#of their condition, the first imputation step only needs its (reference, target) pairs so they are counted apart
+def chunk_profile(chunk):
+    
+    target_col, reference_col = IMPUTATION_CASCADE[0]
+    pairs = chunk.groupby([reference_col, target_col], sort=False, observed=True).size().reset_index(name='rows')
+    
+    chunk = chunk.assign(state_ok=chunk['state'].str.len() == 2,
+                         **{reference_col: chunk[reference_col].where(chunk[target_col].isnull())})
+    vehicles = chunk.groupby(PROFILE_KEYS['vehicles'], dropna=False, sort=False, observed=True) \
+        .agg(rows=('seller', 'size'), condition_sum=('condition', 'sum'), condition_count=('condition', 'count')) \
+        .reset_index()
+    return {'pairs': pairs, 'vehicles': vehicles}
+
+#function to return the integer codes of the key columns of a profile table, a missing value is code -1
+def profile_codes(counts, keys):
+    
+    return pd.MultiIndex.from_arrays([counts[key].cat.codes.to_numpy() if isinstance(counts[key].dtype, pd.CategoricalDtype)
+                                      else counts[key].to_numpy() for key in keys])
+
+#function to add the counts of a profile table to the running one, the groups already there have their counts added
+#and the new groups are appended, without grouping the running table again
+#the categories of the partial table extend the ones of the running table, so the codes of both agree
+def merge_counts(counts, partial, keys):
+    
+    for key in keys:
+        if isinstance(partial[key].dtype, pd.CategoricalDtype):
+            counts[key] = counts[key].cat.set_categories(partial[key].cat.categories)
+    
+    positions = profile_codes(counts, keys).get_indexer(profile_codes(partial, keys))
+    found = positions >= 0
+    for column in counts.columns.difference(keys):
+        values = counts[column].to_numpy().copy()
+        values[positions[found]] = values[positions[found]] + partial[column].to_numpy()[found]
+        counts[column] = values
+    return pd.concat([counts, partial[~found]], ignore_index=True)
+
+#function to add the row profiles of several chunks into one, their categorical columns have the same categories
+#or the categories of each one extend the ones of the previous ones
+def combine_profiles(profiles):
+    
+    profile = None
+    for partial in profiles:
+        if profile is None:
+            profile = {name: counts.copy() for name, counts in partial.items()}
+        else:
+            profile = {name: merge_counts(profile[name], partial[name], PROFILE_KEYS[name]) for name in profile}
+    return profile
+
+#function to recode the categorical columns of a chunk onto the categories of the earlier chunks
+#categories keeps the categories of each column, the new values of the chunk are appended so the codes of the
+#values already seen stay the same from chunk to chunk
+def extend_categories(chunk, categories):
+    
+    for column in chunk.columns:
+        if not isinstance(chunk[column].dtype, pd.CategoricalDtype):
+            continue
+        if column in categories:
+            known = pd.Categorical([], categories=categories[column])
+            categories[column] = union_categoricals([known, chunk[column].array]).categories
+            chunk[column] = chunk[column].cat.set_categories(categories[column])
+        else:
+            categories[column] = chunk[column].cat.categories
+    return chunk
+
+#function to sort the categories of the categorical columns of the profile tables
+#ties between modes go to the smallest value, which for a categorical column is the one with the lowest code
+def sort_profile_categories(profile):
+    
+    for counts in profile.values():
+        for column in counts.columns:
+            if isinstance(counts[column].dtype, pd.CategoricalDtype):
+                counts[column] = counts[column].cat.set_categories(counts[column].cat.categories.sort_values())
+    return profile
+
+#function to collapse the rows of the csv file into the row profile
+#the counts are enough to compute the cascade of modes and the condition mean of the whole file
+#with_dates also returns the (first, last) sale date of the file, otherwise None
+def profile_rows(csv_path, chunksize, with_dates=False):
+    
+    start_length = 0
+    profile = None
+    calendar = None
+    categories = {}
+    usecols = PROFILE_COLUMNS + ['saledate'] if with_dates else PROFILE_COLUMNS
+    
+    for length, chunk in read_unique_vins(csv_path, chunksize, usecols=usecols):
+        start_length = start_length + length
+        if with_dates:
+            first, last = saledate_range(chunk['saledate'])
+            calendar = (first, last) if calendar is None else (min(calendar[0], first), max(calendar[1], last))
+            chunk = chunk.drop(columns='saledate')
+        partial = chunk_profile(extend_categories(chunk, categories))
+        profile = partial if profile is None else combine_profiles([profile, partial])
+    
+    return start_length, sort_profile_categories(profile), calendar
+
+#function to run the imputation cascade on the row profile and return the mode table of each step
+#the first step counts its modes on the (reference, target) pairs, the next ones on the vehicles as they are filled
+def profile_modes(profile, cascade=IMPUTATION_CASCADE):
+    
+    #the vehicles are filled on a copy, each step keeps its rows with a value in a frame of their own
+    mode_tables = []
+    vehicles = profile['vehicles'].copy()
+    for step, (target_col, reference_col) in enumerate(cascade):
+        counted = profile['pairs'] if step == 0 else vehicles
+        most_freq = group_modes(target_col, reference_col, counted, weights='rows')
+        vehicles = fillna_from_modes(target_col, reference_col, most_freq, vehicles)
+        vehicles = vehicles.dropna(subset=target_col).copy()
+        mode_tables.append((target_col, reference_col, most_freq))
+    
+    #mean of the condition column over the rows that are left after the state filter
+    valid = vehicles[vehicles['state_ok']]
+    condition_mean = int(valid['condition_sum'].sum() / valid['condition_count'].sum())
+    
+    return mode_tables, condition_mean
+
+#function to fill the rows of a chunk using the mode tables of the whole file
+#rows that still have no value after each step fail its missing rule
+def apply_modes(dataframe, mode_tables, rows):
+    
+    for target_col, reference_col, most_freq in mode_tables:
+        dataframe = fillna_from_modes(target_col, reference_col, most_freq, dataframe)
+        dataframe = check_rules(dataframe, rows, [f'missing_{target_col}'])
     return dataframe
 
-#read the csv file into a pandas dataframe
-df = pd.read_csv(r'~/dwproject/Vehicle_sales_data.csv')
-
-#get initial length of df
-start_length = len(df)
-
-#drop rows that corresponds to duplicates in the vin column
-df.drop_duplicates(subset='vin', inplace=True)
-
-#fill missing make values using mode of make grouped by seller
-df = fillna_with_mode('make', 'seller', df)
-df.dropna(subset='make', inplace=True)
-
-#fill missing model values using mode of model grouped by make
-df = fillna_with_mode('model', 'make', df)
-df.dropna(subset='model', inplace=True)
-
-#fill missing trim values using mode of trim grouped by model
-df = fillna_with_mode('trim', 'model', df)
-df.dropna(subset='trim', inplace=True)
-
-#fill missing body values using mode of body grouped by model
-df = fillna_with_mode('body', 'model', df)
-df.dropna(subset='body', inplace=True)
-
-#fill missing transmission values using mode of transmission grouped by model
-df = fillna_with_mode('transmission', 'model', df)
-df.dropna(subset='transmission', inplace=True)
-
-#drop state values where length of input is more than 2
-df = df[df['state'].str.len() == 2]
-
-#fill missing values in the condition column with the mean value of the condition column
-df = fillna_with_mean('condition', df)
-
-#drop rows with missing odometer values
-df.dropna(subset='odometer', inplace=True)
-
-#drop rows with missing color values and incorrect color such as '-' and 2-letter word or less values
-df.dropna(subset='color', inplace=True)
-df = df[df['color'].str.len() >= 3]
-
-#drop rows with missing mmr values
-df.dropna(subset='mmr', inplace=True)
-
-#parse the saledate column to get just the date part and store in a new column
-df['saledate_new'] = df['saledate'].str[4:15]
-#parse the saledate column to get just the weekdayname and store in a new column
-df['saledate_weekdayname'] = df['saledate'].str[0:3]
-#add anew column saledate_weekday corresponding to weekdayname, Mon = 1, Tue = 2, etc.
-df = generate_weekday(df)
-#format saledate_new to datetime
-df['saledate_new'] = pd.to_datetime(df['saledate_new'])
-#drop the saledate column then rename saledate_new to saledate
-df.drop('saledate', axis=1, inplace=True)
-df.rename(columns={'saledate_new': 'saledate'}, inplace=True)
-#add a column for year, month and day
-df['saledate_year'] = df['saledate'].dt.year
-df['saledate_month'] = df['saledate'].dt.month
-df['saledate_monthname'] = df['saledate'].dt.month_name()
-df['saledate_day'] = df['saledate'].dt.day
-#add a quarter and a quartername column
-df['quarter'] = df['saledate'].dt.quarter
-df['quartername'] = 'Q' + df['quarter'].astype(str)
-
-#cast correct data types for each columns
-df['year'] = df['year'].astype(int)
-df['make'] = df['make'].astype('string')
-df['model'] = df['model'].astype('string')
-df['trim'] = df['trim'].astype('string')
-df['body'] = df['body'].astype('string')
-df['transmission'] = df['transmission'].astype('string')
-df['vin'] = df['vin'].astype('string')
-df['state'] = df['state'].astype('string')
-df['condition'] = df['condition'].astype(int)
-df['odometer'] = df['odometer'].astype(int)
-df['color'] = df['color'].astype('string')
-df['interior'] = df['interior'].astype('string')
-df['seller'] = df['seller'].astype('string')
-df['mmr'] = df['mmr'].astype(float)
-df['sellingprice'] = df['sellingprice'].astype(float)
-df['saledate'] = pd.to_datetime(df['saledate'])
-df['saledate_year'] = df['saledate_year'].astype(int)
-df['saledate_month'] = df['saledate_month'].astype(int)
-df['saledate_monthname'] = df['saledate_monthname'].astype('string')
-df['saledate_day'] = df['saledate_day'].astype(int)
-df['saledate_weekdayname'] = df['saledate_weekdayname'].astype('string')
-df['saledate_weekday'] = df['saledate_weekday'].astype(int)
-df['quarter'] = df['quarter'].astype(int)
-df['quartername'] = df['quartername'].astype('string')
-
-end_length = len(df)
-difference = start_length - end_length
-
-print('Dataframe Summary')
-print(f'Before Transformation: {start_length}')
-print(f'After Transformation: {end_length}')
-print(f'Dropped Rows: {difference} ({(difference/start_length)*100:.2f}%)')
-print('Data types for each column:')
-print(df.dtypes)
-print('Are there null values in each column?')
-print(df.isnull().any())
-print('Printing top 5 rows')
-print(df.head())
-
-#make different dataframes that will correspond to the diffrent tables in the star schema
-#dateDimTable
-
-print('Creating CSV files for the dimension tables and fact table')
-
-dateDimTable = df[['saledate', 'saledate_year', 'saledate_month', 'saledate_monthname','saledate_day',
-                   'saledate_weekday', 'saledate_weekdayname', 'quarter', 'quartername', 
-                   ]].drop_duplicates()
-dateDimTable = dateDimTable.copy()
-dateDimTable['date_id'] = dateDimTable.reset_index().index+1
-dateDimTable.to_csv('~/dwproject/dateDimTable.csv', index=False)
-print('dateDimTable.csv created')
-
-#sellerDimTable
-sellerDimTable = df[['seller']].drop_duplicates()
-sellerDimTable = sellerDimTable.copy()
-sellerDimTable['seller_id'] = sellerDimTable.reset_index().index+1
-sellerDimTable.to_csv('~/dwproject/sellerDimTable.csv', index=False)
-print('sellerDimTable.csv created')
-
-#stateDimTable
-stateDimTable = df[['state']].drop_duplicates()
-stateDimTable = stateDimTable.copy()
-stateDimTable['state_id'] = stateDimTable.reset_index().index+1
-stateDimTable.to_csv('~/dwproject/stateDimTable.csv', index=False)
-print('stateDimTable.csv created')
-
-#vehicleDimTable
-vehicleDimTable = df[['year', 'make', 'model', 'trim', 'body', 'transmission', 'color', 'interior']].drop_duplicates()
-vehicleDimTable = vehicleDimTable.copy()
-vehicleDimTable['vehicle_id'] = vehicleDimTable.reset_index().index+1
-vehicleDimTable.to_csv('~/dwproject/vehicleDimTable.csv', index=False)
-print('vehicleDimTable.csv created')
-
-#salesFactTable
-salesFactTable = df.copy()
-salesFactTable = salesFactTable.merge(dateDimTable[['date_id', 'saledate']], on='saledate', how='left')
-salesFactTable = salesFactTable.merge(sellerDimTable[['seller_id', 'seller']], on='seller', how='left')
-salesFactTable = salesFactTable.merge(stateDimTable[['state_id', 'state']], on='state', how='left')
-salesFactTable = salesFactTable.merge(vehicleDimTable[['vehicle_id', 'year', 'make', 'model', 'trim', 'body', 
-                                                       'transmission', 'color', 'interior']], 
-                                      on=['year', 'make', 'model', 'trim', 'body', 'transmission', 'color', 'interior'], 
-                                      how='left')
-
-#Drop Redundant Columns (i.e., columns that are now part of the dimension tables)
-salesFactTable = salesFactTable.drop(columns=['year', 'make', 'model', 'trim', 'body', 'transmission',
-                                              'color', 'interior', 'saledate', 'seller', 'state',
-                                              'saledate_weekdayname','saledate_weekday', 'saledate_year',
-                                              'saledate_month', 'saledate_monthname', 'saledate_day',
-                                              'quarter', 'quartername'])
-salesFactTable['sale_id'] = salesFactTable.reset_index().index+1
-salesFactTable.to_csv('~/dwproject/salesFactTable.csv', index=False)
-print('salesFactTable.csv created')
\ No newline at end of file
+#columns the worker processes clean, categorical columns are shared as their integer codes
+SHARED_COLUMNS = ['seller', 'make', 'model', 'trim', 'body', 'transmission', 'state', 'condition', 'odometer',
+                  'color', 'mmr']
+
+#shared memory block, its arrays and the categories of the shared columns, attached when a worker process starts
+worker_block = {}
+
+#function to lay out arrays of the given (dtype, length) one after the other in a single block
+#returns the (offset, dtype, length) of each array and the size of the block
+def shared_layout(specs):
+    
+    layout = {}
+    size = 0
+    for name, (dtype, length) in specs.items():
+        layout[name] = (size, np.dtype(dtype).str, length)
+        #each array starts at a multiple of 8 bytes
+        size = size + -(-np.dtype(dtype).itemsize * length // 8) * 8
+    return layout, max(size, 1)
+
+#function to return numpy arrays over the memory of a shared block, nothing is copied
+def shared_arrays(block, layout):
+    
+    return {name: np.ndarray(length, dtype=dtype, buffer=block.buf, offset=offset)
+            for name, (offset, dtype, length) in layout.items()}
+
+#function to attach a worker process to the shared memory block of the frame it cleans
+def attach_block(block_name, layout, categories):
+    
+    block = shared_memory.SharedMemory(name=block_name)
+    worker_block['block'] = block
+    worker_block['arrays'] = shared_arrays(block, layout)
+    worker_block['categories'] = categories
+
+#function to rebuild rows start to stop of the shared columns as a dataframe indexed by their position in the frame
+def shared_frame(start, stop):
+    
+    arrays = worker_block['arrays']
+    categories = worker_block['categories']
+    frame = pd.DataFrame(index=pd.RangeIndex(start, stop))
+    for column in SHARED_COLUMNS:
+        values = arrays[column][start:stop]
+        frame[column] = pd.Categorical.from_codes(values, categories[column]) if column in categories else values
+    return frame
+
+#function to count the rows of one partition per imputation group, the map step of the mode tables
+def partition_profile(start, stop):
+    
+    return chunk_profile(shared_frame(start, stop))
+
+#function to fill the vehicle columns of one partition with the modes of the whole frame and drop its invalid states
+#the rows that are kept and their filled codes are written to the output arrays of the block
+#returns the number of rows each rule dropped
+def clean_partition(start, stop, mode_tables, filled_categories):
+    
+    arrays = worker_block['arrays']
+    dataframe = shared_frame(start, stop)
+    rows = row_filter(dataframe)
+    dataframe = apply_modes(dataframe, mode_tables, rows)
+    dataframe = check_rules(dataframe, rows, ['invalid_state'])
+    
+    positions = dataframe.index.to_numpy()[rows['keep']]
+    arrays['keep'][positions] = True
+    for target_col, reference_col in IMPUTATION_CASCADE:
+        filled = dataframe[target_col].cat.set_categories(filled_categories[target_col])
+        arrays[f'{target_col}_filled'][positions] = filled.cat.codes.to_numpy()[rows['keep']]
+    return rows['dropped']
+
+#function to clean the rows read from the csv file on worker processes, with the same result as clean_frame
+#the columns the workers need are copied once into shared memory and each worker reads its own range of rows
+#the workers count the imputation groups of their rows and the counts are added up into the modes of the whole frame,
+#then each worker fills and filters its rows with those modes, the condition mean and the last steps run here
+def parallel_clean_frame(df, workers):
+    
+    #get initial length and memory usage of df
+    start_length = len(df)
+    start_memory = memory_mb(df)
+    calendar = saledate_range(df['saledate'])
+    
+    #drop rows that corresponds to duplicates in the vin column, only the first row of each vin is shared
+    rows = row_filter(df)
+    df = measured_step('drop_duplicate_vins',
+                       lambda dataframe: kept_rows(check_rules(dataframe, rows, ['duplicate_vin']), rows), df)
+    
+    categories = {column: df[column].cat.categories for column in SHARED_COLUMNS
+                  if isinstance(df[column].dtype, pd.CategoricalDtype)}
+    columns = {column: df[column].cat.codes.to_numpy() if column in categories else df[column].to_numpy()
+               for column in SHARED_COLUMNS}
+    specs = {column: (values.dtype, len(df)) for column, values in columns.items()}
+    specs['keep'] = (np.bool_, len(df))
+    specs.update({f'{target_col}_filled': (np.int32, len(df)) for target_col, reference_col in IMPUTATION_CASCADE})
+    layout, size = shared_layout(specs)
+    
+    bounds = np.linspace(0, len(df), workers + 1).astype(int)
+    partitions = list(zip(bounds[:-1], bounds[1:]))
+    block = shared_memory.SharedMemory(create=True, size=size)
+    
+    try:
+        arrays = shared_arrays(block, layout)
+        for column, values in columns.items():
+            arrays[column][:] = values
+        arrays['keep'][:] = False
+    
+        with ProcessPoolExecutor(max_workers=workers, initializer=attach_block,
+                                 initargs=(block.name, layout, categories)) as executor:
+            with stage('parallel_cascade', rows_in=len(df)) as record:
+                profile = combine_profiles(list(executor.map(partition_profile, *zip(*partitions))))
+                mode_tables = profile_modes(profile)[0]
+    
+                #the modes are values of their column, any that is not a category yet is added as fillna_from_modes does
+                filled_categories = {}
+                for target_col, reference_col, most_freq in mode_tables:
+                    new_categories = pd.Index(most_freq.dropna().unique()).difference(categories[target_col])
+                    filled_categories[target_col] = categories[target_col].append(new_categories)
+    
+                for dropped in executor.map(clean_partition, *zip(*partitions), [mode_tables] * len(partitions),
+                                            [filled_categories] * len(partitions)):
+                    for rule_name, count in dropped.items():
+                        rows['dropped'][rule_name] = rows['dropped'].get(rule_name, 0) + count
+                record['rows_out'] = int(np.count_nonzero(arrays['keep']))
+    
+        keep = arrays['keep'].copy()
+        filled = {target_col: arrays[f'{target_col}_filled'][keep] for target_col in filled_categories}
+    
+    finally:
+        #the arrays are views of the block, they are released before it is closed
+        arrays = None
+        block.close()
+        block.unlink()
+    
+    df = df[keep].copy()
+    for target_col, codes in filled.items():
+        df[target_col] = pd.Categorical.from_codes(codes, filled_categories[target_col])
+    
+    #fill missing values in the condition column with the mean value of the condition column
+    df = measured_step('fillna_condition', lambda dataframe: fillna_with_mean('condition', dataframe), df)
+    
+    #drop rows with missing odometer, color and mmr values, the counts of the workers are added to
+    rows = row_filter(df, rows['dropped'])
+    df = measured_step('drop_incomplete_rows', lambda dataframe: check_rules(dataframe, rows, INCOMPLETE_RULES), df, rows)
+    
+    df = measured_step('filter_rows', lambda dataframe: kept_rows(dataframe, rows), df)
+    df = measured_step('cast_types', cast_types, df)
+    
+    return {'sales': df, 'start_length': start_length, 'start_memory': start_memory, 'calendar': calendar,
+            'dropped': rows['dropped']}
+
+#function to give each row of a chunk the id of its dimension member
+#registry maps the members seen in earlier chunks to their ids, new members get the next ids in order of appearance
+def assign_ids(chunk, table_name, registry):
+    
+    columns, id_col = DIMENSION_TABLES[table_name]
+    key_columns = dimension_key(table_name)
+    codes, first_pos = factorize_members(chunk, key_columns)
+    keys = list(chunk[key_columns].iloc[first_pos].itertuples(index=False, name=None))
+    
+    member_ids = np.empty(len(first_pos), dtype=np.int64)
+    new_members = []
+    for i, key in enumerate(keys):
+        member_id = registry.get(key)
+        if member_id is None:
+            member_id = len(registry) + 1
+            registry[key] = member_id
+            new_members.append(i)
+        member_ids[i] = member_id
+    
+    dimTable = dimension_members(chunk, table_name, first_pos[new_members])
+    dimTable[id_col] = member_ids[new_members]
+    return member_ids[codes], dimTable
+
+#function to transform the csv file chunk by chunk, appending each chunk to the staged files of the star schema
+#the vin dedup, mode tables and condition mean are computed over the whole file in a first pass
+def stream_transform(csv_path, chunksize):
+    
+    print(f'Streaming the csv file in chunks of {chunksize} rows')
+    with stage('profile') as record:
+        start_length, profile, calendar = profile_rows(csv_path, chunksize, with_dates=date_dimension == 'calendar')
+        mode_tables, condition_mean = profile_modes(profile)
+        record['rows_in'] = start_length
+        record['rows_out'] = len(profile['vehicles'])
+    
+    print('Staging the dimension tables and fact table')
+    registries = {table_name: {} for table_name in DIMENSION_TABLES}
+    writers = {table_name: TableWriter(table_name) for table_name in list(DIMENSION_TABLES) + ['salesFactTable']}
+    end_length = 0
+    dropped = {'duplicate_vin': 0}
+    
+    #a calendar range is known from the first pass, so dateDimTable is written whole before the chunks
+    if calendar is not None:
+        writers['dateDimTable'].write(calendar_range(*calendar))
+    
+    with stage('stream_chunks', rows_in=start_length) as record:
+        for length, chunk in read_unique_vins(csv_path, chunksize):
+            dropped['duplicate_vin'] = dropped['duplicate_vin'] + length - len(chunk)
+            rows = row_filter(chunk, dropped)
+            chunk = apply_modes(chunk, mode_tables, rows)
+            chunk = check_rules(chunk, rows, ['invalid_state'])
+            chunk = chunk.assign(condition=chunk['condition'].fillna(condition_mean))
+            chunk = check_rules(chunk, rows, INCOMPLETE_RULES)
+            chunk = cast_types(kept_rows(chunk, rows))
+            
+            #append the new dimension members and the fact rows of this chunk
+            salesFactTable = chunk[FACT_COLUMNS].copy()
+            for table_name, (columns, id_col) in DIMENSION_TABLES.items():
+                if table_name == 'dateDimTable' and calendar is not None:
+                    salesFactTable[id_col] = calendar_ids(chunk['saledate'], calendar[0])
+                    continue
+                ids, dimTable = assign_ids(chunk, table_name, registries[table_name])
+                salesFactTable[id_col] = ids
+                writers[table_name].write(dimTable)
+            salesFactTable['sale_id'] = np.arange(end_length + 1, end_length + len(salesFactTable) + 1)
+            writers['salesFactTable'].write(salesFactTable)
+            
+            end_length = end_length + len(salesFactTable)
+        record['rows_out'] = end_length
+    
+    print_summary(start_length, end_length, dropped=dropped)
+    for writer in writers.values():
+        writer.close()
+
+#function to read the csv file and build the tables of the star schema, chunk by chunk when chunksize is set
+#csv_path is the csv file or zip archive to read, the one already downloaded from DATASET_SOURCE by default
+#streaming mode leaves its output in the staged files and returns None
+def run_transform(csv_path=None, chunksize=chunksize):
+    
+    csv_path = csv_path or dataset_path()
+    if chunksize:
+        stream_transform(csv_path, chunksize)
+        return None
+    return batch_transform(csv_path)
+
+if __name__ == '__main__':
+    run_transform()